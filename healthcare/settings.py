@@ -10,8 +10,9 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+from importlib.util import find_spec
 from pathlib import Path
-from decouple import config
+from decouple import config, Csv
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -38,12 +39,15 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     "rest_framework",
     "hospital",
 ]
 
 MIDDLEWARE = [
+    'hospital.middleware.RequestMetricsMiddleware',
+    'hospital.middleware.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -51,6 +55,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'hospital.middleware.ReplicaRoutingMiddleware',
 ]
 
 ROOT_URLCONF = 'healthcare.urls'
@@ -87,6 +92,56 @@ DATABASES = {
     }
 }
 
+# Connection reuse. With DB_POOL each worker process keeps a psycopg pool of DB_POOL_MIN_SIZE to
+# DB_POOL_MAX_SIZE connections: a request waits up to DB_POOL_TIMEOUT seconds for one, it's
+# checked before being handed out, and recycled after DB_POOL_MAX_LIFETIME seconds (or
+# DB_POOL_MAX_IDLE unused). Without it connections are kept for DB_CONN_MAX_AGE seconds per thread.
+DB_POOL = config("DB_POOL", default=False, cast=bool)
+if DB_POOL:
+    from psycopg_pool import ConnectionPool
+
+    DATABASES["default"]["OPTIONS"] = {
+        "pool": {
+            "min_size": config("DB_POOL_MIN_SIZE", default=2, cast=int),
+            "max_size": config("DB_POOL_MAX_SIZE", default=10, cast=int),
+            "timeout": config("DB_POOL_TIMEOUT", default=10, cast=float),
+            "max_lifetime": config("DB_POOL_MAX_LIFETIME", default=1800, cast=float),
+            "max_idle": config("DB_POOL_MAX_IDLE", default=600, cast=float),
+            "check": ConnectionPool.check_connection,
+        },
+    }
+else:
+    DATABASES["default"]["CONN_MAX_AGE"] = config("DB_CONN_MAX_AGE", default=60, cast=int)
+    DATABASES["default"]["CONN_HEALTH_CHECKS"] = True
+
+# Read replicas, comma separated host[:port][/dbname] (same user and password as the primary),
+# e.g. POSTGRES_REPLICAS=replica1.internal,localhost:5433/healthcare_replica.
+# Each becomes a replica<n> alias. Under test they mirror default so tests see one database.
+DATABASE_REPLICAS = []
+for n, replica in enumerate(config("POSTGRES_REPLICAS", default="", cast=Csv()), start=1):
+    address, _, name = replica.partition("/")
+    host, _, port = address.partition(":")
+    DATABASES[f"replica{n}"] = {
+        **DATABASES["default"],
+        "HOST": host,
+        "PORT": port or DATABASES["default"]["PORT"],
+        "NAME": name or DATABASES["default"]["NAME"],
+        "TEST": {"MIRROR": "default"},
+    }
+    DATABASE_REPLICAS.append(f"replica{n}")
+
+# Safe-method requests read from the replicas, everything else (and every write) uses default
+DATABASE_ROUTERS = ["hospital.routers.PrimaryReplicaRouter"]
+
+# After a POST/PUT/PATCH/DELETE the client reads from the primary for this many seconds, so
+# it sees its own writes even when the replicas lag behind
+REPLICA_PIN_SECONDS = config("REPLICA_PIN_SECONDS", default=5, cast=int)
+
+# How often a replica's health is rechecked, and how far behind (in seconds, PostgreSQL only)
+# it may be before it's taken out of rotation. 0 disables the lag check
+REPLICA_HEALTH_CHECK_INTERVAL = config("REPLICA_HEALTH_CHECK_INTERVAL", default=10, cast=int)
+REPLICA_MAX_LAG_SECONDS = config("REPLICA_MAX_LAG_SECONDS", default=30, cast=int)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -131,9 +186,138 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
 # Settings for JWT authentication
+# "stateful" loads the user from the db on every request, "stateless" trusts the claims in the
+# token and skips that query (revocation then needs a cache shared by all workers)
+
+JWT_AUTH_MODE = config("JWT_AUTH_MODE", default="stateful")
+JWT_AUTHENTICATION_CLASSES = {
+    "stateful": "hospital.authentication.TimedJWTAuthentication",
+    "stateless": "hospital.authentication.CachedStatelessJWTAuthentication",
+}
+
+# How many verified tokens each worker remembers in stateless mode
+JWT_VERIFIED_CACHE_SIZE = config("JWT_VERIFIED_CACHE_SIZE", default=10000, cast=int)
+
+# Response and request body formats. JSON is written and read with orjson when it's installed
+# (same bytes as DRF's classes, which take over without it). MessagePack is offered to clients
+# that ask for it (Accept: application/msgpack) when msgpack is installed
+
+MSGPACK_ENABLED = config("MSGPACK_ENABLED", default=True, cast=bool) and find_spec("msgpack") is not None
+RENDERER_CLASSES = [
+    "hospital.renderers.FastJSONRenderer",
+    "rest_framework.renderers.BrowsableAPIRenderer",
+]
+PARSER_CLASSES = [
+    "hospital.renderers.FastJSONParser",
+    "rest_framework.parsers.FormParser",
+    "rest_framework.parsers.MultiPartParser",
+]
+if MSGPACK_ENABLED:
+    RENDERER_CLASSES.insert(1, "hospital.renderers.MessagePackRenderer")
+    PARSER_CLASSES.insert(1, "hospital.renderers.MessagePackParser")
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
-    ]
-}
\ No newline at end of file
+        JWT_AUTHENTICATION_CLASSES[JWT_AUTH_MODE],
+    ],
+    "DEFAULT_RENDERER_CLASSES": RENDERER_CLASSES,
+    "DEFAULT_PARSER_CLASSES": PARSER_CLASSES,
+}
+
+SIMPLE_JWT = {
+    "TOKEN_OBTAIN_SERIALIZER": "hospital.serializers.ClaimsTokenObtainPairSerializer",
+}
+
+
+# Keyset pagination for the list endpoints
+
+PAGE_SIZE = config("PAGE_SIZE", default=50, cast=int)
+MAX_PAGE_SIZE = config("MAX_PAGE_SIZE", default=500, cast=int)
+
+
+# Cache, locmem unless a shared backend (redis, memcached) is configured
+
+CACHES = {
+    "default": {
+        "BACKEND": config("CACHE_BACKEND", default="django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": config("CACHE_LOCATION", default="healthcare"),
+    }
+}
+
+# The list ETags (/api/patients/, /api/doctors/, /api/mappings/) hang off version counters in the
+# cache. With locmem each worker has its own, and a worker that didn't see a write would keep
+# answering 304, so they're only sent with a shared backend unless LIST_ETAGS says otherwise
+# (one worker, e.g. runserver)
+SHARED_CACHE = CACHES["default"]["BACKEND"] not in (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+LIST_ETAGS = config("LIST_ETAGS", default=SHARED_CACHE, cast=bool)
+
+# How long a cached doctor payload lives if nothing invalidates it first, in seconds
+DOCTOR_CACHE_TIMEOUT = config("DOCTOR_CACHE_TIMEOUT", default=300, cast=int)
+
+
+# Bulk endpoints, rows per INSERT (the patient import takes a ?batch_size= override)
+
+BULK_BATCH_SIZE = config("BULK_BATCH_SIZE", default=500, cast=int)
+BULK_MAX_BATCH_SIZE = config("BULK_MAX_BATCH_SIZE", default=5000, cast=int)
+
+# Most patient-doctor pairs a single bulk assignment may contain
+BULK_MAX_PAIRS = config("BULK_MAX_PAIRS", default=10000, cast=int)
+
+# Most ids a batch lookup (/api/patients/batch/, /api/doctors/batch/) may ask for
+BATCH_MAX_IDS = config("BATCH_MAX_IDS", default=100, cast=int)
+
+
+# Streaming exports, rows fetched per server-side cursor round trip (and written per chunk)
+
+EXPORT_CHUNK_SIZE = config("EXPORT_CHUNK_SIZE", default=2000, cast=int)
+
+
+# Name/email search, results per request (?limit= goes up to SEARCH_MAX_LIMIT)
+
+SEARCH_LIMIT = config("SEARCH_LIMIT", default=20, cast=int)
+SEARCH_MAX_LIMIT = config("SEARCH_MAX_LIMIT", default=100, cast=int)
+
+
+# Appointments can be booked (and availability asked for) up to this many days ahead.
+# materialize_availability fills in the availability rows of that window, run it daily
+
+BOOKING_HORIZON_DAYS = config("BOOKING_HORIZON_DAYS", default=90, cast=int)
+
+
+# Change feed (/api/changes/), entries per page (?limit= goes up to CHANGES_MAX_LIMIT). Entries
+# are served once they're CHANGES_SETTLE_SECONDS old, so writes whose transactions commit out of
+# id order aren't skipped, and prune_changes removes them after CHANGES_RETENTION_DAYS
+
+CHANGES_LIMIT = config("CHANGES_LIMIT", default=200, cast=int)
+CHANGES_MAX_LIMIT = config("CHANGES_MAX_LIMIT", default=1000, cast=int)
+CHANGES_SETTLE_SECONDS = config("CHANGES_SETTLE_SECONDS", default=2, cast=float)
+CHANGES_RETENTION_DAYS = config("CHANGES_RETENTION_DAYS", default=30, cast=int)
+
+
+# Request timings: a Server-Timing header on every response and histograms at /api/metrics/
+# (staff, or a scraper sending "Authorization: Metrics <METRICS_TOKEN>")
+
+METRICS_ENABLED = config("METRICS_ENABLED", default=True, cast=bool)
+SERVER_TIMING = config("SERVER_TIMING", default=True, cast=bool)
+METRICS_TOKEN = config("METRICS_TOKEN", default="")
+
+
+# On-demand request profiling (see hospital/profiling.py). Profiles are JSON files in PROFILE_DIR
+# on each worker's host, the newest PROFILE_MAX_FILES are kept
+
+PROFILE_DIR = config("PROFILE_DIR", default=str(BASE_DIR / "profiles"))
+PROFILE_MAX_FILES = config("PROFILE_MAX_FILES", default=200, cast=int)
+# stack samples are taken every PROFILE_INTERVAL_MS, for at most PROFILE_MAX_SECONDS per request
+PROFILE_INTERVAL_MS = config("PROFILE_INTERVAL_MS", default=5, cast=int)
+PROFILE_MAX_SECONDS = config("PROFILE_MAX_SECONDS", default=30, cast=int)
+# requests profiled at the same time per worker process, others go unprofiled meanwhile
+PROFILE_MAX_CONCURRENT = config("PROFILE_MAX_CONCURRENT", default=2, cast=int)
+PROFILE_MAX_QUERIES = config("PROFILE_MAX_QUERIES", default=500, cast=int)
+# how long an X-Profile token is honoured, and the longest sampling can be switched on for
+PROFILE_TOKEN_MAX_AGE = config("PROFILE_TOKEN_MAX_AGE", default=900, cast=int)
+PROFILE_MAX_SAMPLING_SECONDS = config("PROFILE_MAX_SAMPLING_SECONDS", default=3600, cast=int)
+# how often each worker rereads the sampling switch from the cache
+PROFILE_CONFIG_REFRESH = config("PROFILE_CONFIG_REFRESH", default=5, cast=int)
@@ -0,0 +1,293 @@
+import json
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.db.models import Count, Max
+from django.http import HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from . import cache
+from .authentication import aauthenticate
+from .conditional import row_etag, version_etag, alist_etag, is_conditional, not_modified, with_validators
+from .fastpath import patient_rows, doctor_rows, mapping_rows
+from .models import Patient, Doctor, PatientDoctorMapping
+from .pagination import KeysetPagination
+from .renderers import FastJSONRenderer
+from .serializers import (
+    PatientCreateSerializer,
+    PatientPublicSerializer,
+    PatientUpdateSerializer,
+
+    DoctorPublicSerializer,
+    DoctorCreateSerializer,
+    DoctorUpdateSerializer,
+    DoctorFilterSerializer,
+
+    MappingsSerializer,
+    SparseFieldsSerializer,
+)
+
+# Async versions of the patient, doctor and mapping endpoints in views.py, for running under
+# ASGI. DRF views are sync only, so these are plain Django async views: the ORM calls go
+# through the async API (aget, acreate, async for) and the validation through the same
+# serializers as the sync views, with is_valid() run via sync_to_async since validators can
+# query. Responses are rendered with the sync views' JSON renderer so the bodies match.
+
+renderer = FastJSONRenderer()
+
+
+def json_response(data, status=status.HTTP_200_OK):
+    return HttpResponse(renderer.render(data), status=status, content_type="application/json")
+
+
+def async_api_view(methods, authenticated=False):
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            try:
+                user = await aauthenticate(request)
+            except APIException as exc:
+                # AuthenticationFailed/InvalidToken, same 401 body DRF would send
+                response = json_response(exc.detail, status=exc.status_code)
+                response["WWW-Authenticate"] = 'Bearer realm="api"'
+                return response
+
+            if authenticated and user is None:
+                response = json_response({"detail": "Authentication credentials were not provided."}, status=status.HTTP_401_UNAUTHORIZED)
+                response["WWW-Authenticate"] = 'Bearer realm="api"'
+                return response
+
+            request.user = user or AnonymousUser()
+            if request.method in ("POST", "PUT"):
+                try:
+                    request.data = json.loads(request.body or b"{}")
+                except ValueError:
+                    return json_response({"detail": "JSON parse error"}, status=status.HTTP_400_BAD_REQUEST)
+            try:
+                return await view(request, *args, **kwargs)
+            except APIException as exc:
+                # e.g. NotFound for a bad pagination cursor
+                return json_response({"detail": exc.detail}, status=exc.status_code)
+
+        # csrf is for cookie auth, these take bearer tokens like the DRF views
+        return csrf_exempt(require_http_methods(methods)(wrapper))
+    return decorator
+
+
+async def is_valid(serializer):
+    return await sync_to_async(serializer.is_valid)()
+
+
+async def apply_update(serializer):
+    # the async ORM counterpart of serializer.save() for a partial update
+    instance = serializer.instance
+    for field, value in serializer.validated_data.items():
+        setattr(instance, field, value)
+    # updated_at has to go along, the ETag and Last-Modified of the row are derived from it
+    fields = list(serializer.validated_data)
+    await instance.asave(update_fields=[*fields, "updated_at"] if fields else None)
+
+
+# ----- Patient endpoints -----
+
+@async_api_view(["GET", "POST"], authenticated=True)
+async def patients_list(request):
+    if request.method == "GET":
+        sparse = SparseFieldsSerializer(data=request.GET, context={"rows": patient_rows})
+        if not sparse.is_valid():
+            return json_response(sparse.errors, status=status.HTTP_400_BAD_REQUEST)
+        rows = sparse.validated_data["rows"]
+
+        etag = await alist_etag(request, lambda: cache.aget_patients_version(request.user.id), request.user.id)
+        unchanged = not_modified(request, etag)
+        if unchanged is not None:
+            return unchanged
+
+        patients = rows.values(Patient.objects.filter(created_by_id=request.user.id), "id")
+        paginator = KeysetPagination(ordering=("id",))
+        page = await paginator.apaginate_queryset(patients, request)
+        return with_validators(json_response(paginator.get_paginated_data(rows.serialize(page))), etag)
+
+    serializer = PatientCreateSerializer(data=request.data)
+    if not await is_valid(serializer):
+        return json_response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    patient = await Patient.objects.acreate(**serializer.validated_data, created_by_id=request.user.id)
+    return json_response(PatientPublicSerializer(patient).data, status=status.HTTP_201_CREATED)
+
+
+@async_api_view(["GET", "PUT", "DELETE"])
+async def patient_detail(request, pk):
+    if request.method == "GET" and is_conditional(request):
+        # a client revalidating its copy: look up the version only, and skip the row if it matches
+        updated_at = await Patient.objects.filter(pk=pk).values_list("updated_at", flat=True).afirst()
+        if updated_at is not None:
+            unchanged = not_modified(request, row_etag(pk, updated_at), updated_at)
+            if unchanged is not None:
+                return unchanged
+
+    if request.method == "GET":
+        sparse = SparseFieldsSerializer(data=request.GET, context={"rows": patient_rows})
+        if not sparse.is_valid():
+            return json_response(sparse.errors, status=status.HTTP_400_BAD_REQUEST)
+        rows = sparse.validated_data["rows"]
+
+        row = await rows.values(Patient.objects.filter(pk=pk), "updated_at").afirst()
+        if row is None:
+            return json_response({"msg": "Patient Not Found"}, status=status.HTTP_404_NOT_FOUND)
+        return with_validators(json_response(rows.to_representation(row)), row_etag(pk, row["updated_at"]), row["updated_at"])
+
+    try:
+        patient = await Patient.objects.aget(pk=pk)
+    except Patient.DoesNotExist:
+        return json_response({"msg": "Patient Not Found"}, status=status.HTTP_404_NOT_FOUND)
+
+    if request.method == "PUT":
+        serializer = PatientUpdateSerializer(patient, data=request.data, partial=True)
+        if not await is_valid(serializer):
+            return json_response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        await apply_update(serializer)
+        return with_validators(json_response(serializer.data), row_etag(pk, patient.updated_at), patient.updated_at)
+
+    await patient.adelete()
+    return HttpResponse(status=status.HTTP_204_NO_CONTENT)
+
+
+# ----- Doctor endpoints -----
+
+@async_api_view(["GET", "POST"])
+async def doctors_list(request):
+    if request.method == "GET":
+        filters = DoctorFilterSerializer(data=request.GET)
+        sparse = SparseFieldsSerializer(data=request.GET, context={"rows": doctor_rows})
+        if not all([filters.is_valid(), sparse.is_valid()]):
+            return json_response({**filters.errors, **sparse.errors}, status=status.HTTP_400_BAD_REQUEST)
+        rows = sparse.validated_data["rows"]
+
+        etag = await alist_etag(request, cache.aget_doctors_version)
+        unchanged = not_modified(request, etag)
+        if unchanged is not None:
+            return unchanged
+
+        async def build_page():
+            paginator = KeysetPagination(ordering=("id",))
+            doctors = rows.values(filters.filter_queryset(Doctor.objects.all()), "id")
+            page = await paginator.apaginate_queryset(doctors, request)
+            return paginator.get_paginated_data(rows.serialize(page))
+
+        return with_validators(json_response(await cache.aget_doctor_list(request, build_page)), etag)
+
+    if not request.user.is_authenticated:
+        return json_response({"detail": "Unauthorized"}, status=status.HTTP_401_UNAUTHORIZED)
+
+    serializer = DoctorCreateSerializer(data=request.data)
+    if not await is_valid(serializer):
+        return json_response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    # acreate goes through Doctor.save, so the post_save signal invalidates the cache as usual
+    doctor = await Doctor.objects.acreate(**serializer.validated_data)
+    return json_response(DoctorPublicSerializer(doctor).data, status=status.HTTP_201_CREATED)
+
+
+@async_api_view(["GET", "PUT", "DELETE"])
+async def doctor_detail(request, pk):
+    try:
+        if request.method == "GET":
+            sparse = SparseFieldsSerializer(data=request.GET, context={"rows": doctor_rows})
+            if not sparse.is_valid():
+                return json_response(sparse.errors, status=status.HTTP_400_BAD_REQUEST)
+            rows = sparse.validated_data["rows"]
+
+            # same cache entries as views.doctor_detail, payload and its validators
+            async def build():
+                doctor = await Doctor.objects.aget(pk=pk)
+                return {"doctor": DoctorPublicSerializer(doctor).data, "updated_at": doctor.updated_at}
+
+            entry = await cache.aget_doctor_detail(pk, build)
+            etag = row_etag(pk, entry["updated_at"])
+            unchanged = not_modified(request, etag, entry["updated_at"])
+            if unchanged is not None:
+                return unchanged
+            return with_validators(json_response(rows.pick(entry["doctor"])), etag, entry["updated_at"])
+
+        doctor = await Doctor.objects.aget(pk=pk)
+    except Doctor.DoesNotExist:
+        return json_response({"msg": "Doctor Not Found"}, status=status.HTTP_404_NOT_FOUND)
+
+    if request.method == "PUT":
+        serializer = DoctorUpdateSerializer(doctor, data=request.data, partial=True)
+        if not await is_valid(serializer):
+            return json_response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        await apply_update(serializer)
+        return with_validators(json_response(serializer.data), row_etag(pk, doctor.updated_at), doctor.updated_at)
+
+    await doctor.adelete()
+    return HttpResponse(status=status.HTTP_204_NO_CONTENT)
+
+
+# ----- Mappings endpoints -----
+
+@async_api_view(["GET", "POST"])
+async def mappings_list(request):
+    if request.method == "GET":
+        sparse = SparseFieldsSerializer(data=request.GET, context={"rows": mapping_rows})
+        if not sparse.is_valid():
+            return json_response(sparse.errors, status=status.HTTP_400_BAD_REQUEST)
+        rows = sparse.validated_data["rows"]
+
+        etag = await alist_etag(request, cache.aget_mappings_version)
+        unchanged = not_modified(request, etag)
+        if unchanged is not None:
+            return unchanged
+
+        paginator = KeysetPagination(ordering=("assigned_at", "id"))
+        page = await paginator.apaginate_queryset(rows.values(PatientDoctorMapping.objects.all(), "assigned_at", "id"), request)
+        return with_validators(json_response(paginator.get_paginated_data(rows.serialize(page))), etag)
+
+    serializer = MappingsSerializer(data=request.data)
+    if not await is_valid(serializer):
+        return json_response({"detail": "Mapping already exists"}, status=status.HTTP_409_CONFLICT)
+
+    mapping = await PatientDoctorMapping.objects.acreate(**serializer.validated_data)
+    return json_response(MappingsSerializer(mapping).data, status=status.HTTP_201_CREATED)
+
+
+@async_api_view(["GET"])
+async def mapping_detail(request, patient_id):
+    # ?fields= picks the fields of the doctors listed
+    sparse = SparseFieldsSerializer(data=request.GET, context={"rows": doctor_rows})
+    if not sparse.is_valid():
+        return json_response(sparse.errors, status=status.HTTP_400_BAD_REQUEST)
+    rows = sparse.validated_data["rows"]
+
+    # the patient together with the same version parts as views.mapping_detail
+    patient = await (
+        Patient.objects.filter(pk=patient_id)
+        .values("id", "firstname", "lastname", "updated_at")
+        .annotate(
+            mappings=Count("doctor_mappings"),
+            mapped=Max("doctor_mappings__updated_at"),
+            doctors_updated=Max("doctor_mappings__doctor__updated_at"),
+        )
+        .afirst()
+    )
+    if patient is None:
+        return json_response({"detail": "Patient Not Found"}, status=status.HTTP_404_NOT_FOUND)
+
+    etag = version_etag(request, patient["updated_at"], patient["mappings"], patient["mapped"], patient["doctors_updated"])
+    unchanged = not_modified(request, etag)
+    if unchanged is not None:
+        return unchanged
+
+    doctors = rows.values(
+        Doctor.objects.filter(patient_mappings__patient_id=patient_id).order_by("patient_mappings__assigned_at", "patient_mappings__id")
+    )
+    return with_validators(json_response({
+        "patient_id": f"{patient['id']}",
+        "patient": f"{patient['firstname']} {patient['lastname']}",
+        "doctors": rows.serialize([row async for row in doctors]),
+    }), etag)
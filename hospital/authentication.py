@@ -0,0 +1,172 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework.settings import api_settings as drf_settings
+from rest_framework_simplejwt.authentication import JWTAuthentication, JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken, TokenError
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import aware_utcnow, datetime_to_epoch
+
+from .metrics import timed
+
+
+class VerifiedTokenCache:
+    # Small thread-safe LRU of tokens whose signature already checked out, keyed on a digest
+    # of the raw token. Per process, so each worker verifies a token once.
+    def __init__(self):
+        self.tokens = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            token = self.tokens.get(key)
+            if token is not None:
+                self.tokens.move_to_end(key)
+            return token
+
+    def put(self, key, token):
+        with self.lock:
+            self.tokens[key] = token
+            self.tokens.move_to_end(key)
+            while len(self.tokens) > settings.JWT_VERIFIED_CACHE_SIZE:
+                self.tokens.popitem(last=False)
+
+    def discard(self, key):
+        with self.lock:
+            self.tokens.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.tokens.clear()
+
+    def __len__(self):
+        return len(self.tokens)
+
+
+verified_tokens = VerifiedTokenCache()
+
+
+# ----- Revocation -----
+# Kept in Django's cache so every worker sees it (with a shared backend). Entries only need to
+# live as long as the longest access token could, after that the token is expired anyway.
+
+def revoked_jti_key(jti):
+    return f"jwt:revoked:{jti}"
+
+
+def revoked_user_key(user_id):
+    return f"jwt:revoked-before:{user_id}"
+
+
+def revoke_token(token):
+    # revokes this one token, e.g. on logout
+    cache.set(revoked_jti_key(token[api_settings.JTI_CLAIM]), True, timeout=api_settings.ACCESS_TOKEN_LIFETIME.total_seconds())
+
+
+def revoke_user_tokens(user_id):
+    # revokes every token issued to the user so far, e.g. on deactivation or password change
+    now = datetime_to_epoch(aware_utcnow())
+    cache.set(revoked_user_key(user_id), now, timeout=api_settings.ACCESS_TOKEN_LIFETIME.total_seconds())
+
+
+def is_revoked(token):
+    user_id = token.get(api_settings.USER_ID_CLAIM)
+    keys = [revoked_jti_key(token.get(api_settings.JTI_CLAIM)), revoked_user_key(user_id)]
+    revoked = cache.get_many(keys)
+
+    if revoked.get(keys[0]):
+        return True
+    revoked_before = revoked.get(keys[1])
+    return revoked_before is not None and token.get("iat", 0) <= revoked_before
+
+
+class ClaimsTokenUser(TokenUser):
+    # simplejwt keeps the user id claim as a string, views write it into created_by_id and
+    # serialize it back, so hand it out with the pk's own type
+    @cached_property
+    def id(self):
+        return get_user_model()._meta.pk.to_python(self.token[api_settings.USER_ID_CLAIM])
+
+    @cached_property
+    def pk(self):
+        return self.id
+
+
+class TimedAuthentication:
+    # counts authenticate() toward the auth time of the request (Server-Timing, /api/metrics/)
+    def authenticate(self, request):
+        with timed("auth"):
+            return super().authenticate(request)
+
+
+class TimedJWTAuthentication(TimedAuthentication, JWTAuthentication):
+    pass
+
+
+class CachedStatelessJWTAuthentication(TimedAuthentication, JWTStatelessUserAuthentication):
+    # Trusts the claims in the token (user id, is_active, is_staff) instead of loading the User
+    # row on every request, so authenticating costs no query. Tokens whose signature was already
+    # verified are remembered in an LRU, but expiry and revocation are still checked every time.
+    def get_validated_token(self, raw_token):
+        key = hashlib.sha256(raw_token).digest()
+        token = verified_tokens.get(key)
+
+        if token is None:
+            token = super().get_validated_token(raw_token)
+            verified_tokens.put(key, token)
+        else:
+            try:
+                token.check_exp(current_time=aware_utcnow())
+            except TokenError as exc:
+                verified_tokens.discard(key)
+                raise InvalidToken(exc.args[0])
+
+        if is_revoked(token):
+            verified_tokens.discard(key)
+            raise AuthenticationFailed(_("Token has been revoked"), code="token_revoked")
+        return token
+
+    def get_user(self, validated_token):
+        if api_settings.USER_ID_CLAIM not in validated_token:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+        if api_settings.CHECK_USER_IS_ACTIVE and not validated_token.get("is_active", True):
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return ClaimsTokenUser(validated_token)
+
+
+async def aauthenticate(request):
+    # What DRF does with DEFAULT_AUTHENTICATION_CLASSES, for the plain Django async views.
+    # Returns None when no token was sent, raises AuthenticationFailed/InvalidToken for a bad one.
+    # Token checks are pure CPU (and a cache lookup in stateless mode), only the stateful user
+    # lookup touches the db and that goes through the async ORM.
+    for authentication_class in drf_settings.DEFAULT_AUTHENTICATION_CLASSES:
+        authenticator = authentication_class()
+        header = authenticator.get_header(request)
+        if header is None:
+            continue
+        raw_token = authenticator.get_raw_token(header)
+        if raw_token is None:
+            continue
+
+        token = authenticator.get_validated_token(raw_token)
+        if isinstance(authenticator, JWTStatelessUserAuthentication):
+            return authenticator.get_user(token)
+
+        try:
+            user_id = token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+        user = await get_user_model().objects.filter(**{api_settings.USER_ID_FIELD: user_id}).afirst()
+        if user is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return user
+    return None
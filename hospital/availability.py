@@ -0,0 +1,87 @@
+from django.db import DEFAULT_DB_ALIAS, connection, transaction
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Doctor, DoctorDayBookings, AvailabilityDay
+
+# Keeps DoctorDayBookings usable as an availability index. A booking only creates its own
+# doctor's row, so materialize_availability gives every doctor a row for each date up to
+# BOOKING_HORIZON_DAYS ahead (one INSERT .. SELECT per date) and notes the date in
+# AvailabilityDay. For those dates "who still has slots" is answered off the
+# (date, specialization, -remaining) index, and the rows are kept current incrementally:
+# booking/cancelling in hospital.booking, doctor changes via signals. Doctors added with
+# bulk_create skip those signals, run materialize_availability afterwards.
+#
+# Queries never write. A date the command hasn't filled in yet is answered off the doctors
+# table, with the rows that bookings already created for it.
+
+BOOKINGS_TABLE = DoctorDayBookings._meta.db_table
+DOCTORS_TABLE = Doctor._meta.db_table
+DAYS_TABLE = AvailabilityDay._meta.db_table
+
+
+def materialize_day(date):
+    # returns True when this call filled the date in, False when it already was
+    if AvailabilityDay.objects.using(DEFAULT_DB_ALIAS).filter(date=date).exists():
+        return False
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            # "WHERE TRUE" keeps sqlite from reading ON CONFLICT as a join constraint
+            cursor.execute(
+                f"INSERT INTO {BOOKINGS_TABLE} (doctor_id, date, specialization, booked, remaining) "
+                f"SELECT id, %s, specialization, 0, max_appointments_per_day FROM {DOCTORS_TABLE} WHERE TRUE "
+                f"ON CONFLICT DO NOTHING",
+                [date],
+            )
+        AvailabilityDay.objects.bulk_create([AvailabilityDay(date=date)], ignore_conflicts=True)
+    return True
+
+
+def doctor_added(doctor):
+    # a new doctor gets rows for every upcoming date that's already materialized
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {BOOKINGS_TABLE} (doctor_id, date, specialization, booked, remaining) "
+            f"SELECT %s, date, %s, 0, %s FROM {DAYS_TABLE} WHERE date >= %s "
+            f"ON CONFLICT DO NOTHING",
+            [doctor.id, doctor.specialization, doctor.max_appointments_per_day, timezone.localdate()],
+        )
+
+
+def doctor_changed(doctor):
+    # past days are history, only upcoming rows follow a new specialization or cap
+    DoctorDayBookings.objects.filter(doctor_id=doctor.id, date__gte=timezone.localdate()).update(
+        specialization=doctor.specialization,
+        remaining=doctor.max_appointments_per_day - F("booked"),
+    )
+
+
+def refresh_upcoming():
+    # resyncs every upcoming row with its doctor in one statement, and forgets which dates were
+    # materialized so the next materialize_day adds doctors that are missing rows
+    today = timezone.localdate()
+    doctor = Doctor.objects.filter(pk=OuterRef("doctor_id"))
+    with transaction.atomic():
+        DoctorDayBookings.objects.filter(date__gte=today).update(
+            specialization=Subquery(doctor.values("specialization")),
+            remaining=Subquery(doctor.values("max_appointments_per_day")) - F("booked"),
+        )
+        AvailabilityDay.objects.filter(date__gte=today).delete()
+
+
+def available_doctors(date, specialization=None, limit=20):
+    # (doctor, slots left) on `date` for the doctors that have any, most slots first
+    if AvailabilityDay.objects.filter(date=date).exists():
+        days = DoctorDayBookings.objects.filter(date=date, remaining__gt=0)
+        if specialization:
+            days = days.filter(specialization=specialization)
+        return [(day.doctor, day.remaining) for day in days.select_related("doctor").order_by("-remaining", "doctor_id")[:limit]]
+
+    # not materialized: a doctor without a row for the date has their whole cap left
+    booked = DoctorDayBookings.objects.filter(doctor_id=OuterRef("pk"), date=date).values("remaining")
+    doctors = Doctor.objects.annotate(remaining=Coalesce(Subquery(booked), F("max_appointments_per_day"))).filter(remaining__gt=0)
+    if specialization:
+        doctors = doctors.filter(specialization=specialization)
+    return [(doctor, doctor.remaining) for doctor in doctors.order_by("-remaining", "id")[:limit]]
@@ -0,0 +1,357 @@
+import datetime
+import queue
+import statistics
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, connections, DatabaseError
+from django.db.models import Count
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from .models import Patient, Doctor, PatientDoctorMapping, Appointment, DoctorDayBookings
+from .booking import book, DoctorFullyBooked, AlreadyBooked
+from .changes import head
+from .stats import reconcile
+from .serializers import DoctorFilterSerializer
+
+BENCH_PASSWORD = "bench-password-123"
+
+
+# ----- Helpers -----
+
+def percentile(samples, pct):
+    # nearest-rank percentile, good enough for latency reporting
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def best_of(repeat, func):
+    # (fastest of `repeat` runs of func, its output), for micro benchmarks where the minimum is the
+    # least noisy number
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, output
+
+
+@contextmanager
+def isolated_database(keepdb=False):
+    # runs the benchmark against a throwaway test database, the same way manage.py test does
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=keepdb)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keepdb)
+        teardown_test_environment()
+
+
+def seed_dataset(patients, doctors, mappings_per_patient):
+    owner = User.objects.create_user(username="bench-owner", password=BENCH_PASSWORD)
+    patient_objs = Patient.objects.bulk_create([
+        Patient(firstname=f"Patient{i}", lastname="Bench", email=f"bench-patient{i}@example.com", age=i % 100, gender="MF"[i % 2], created_by=owner)
+        for i in range(patients)
+    ], batch_size=1000)
+    doctor_objs = Doctor.objects.bulk_create([
+        Doctor(firstname=f"Doctor{i}", lastname="Bench", email=f"bench-doctor{i}@example.com", gender="FM"[i % 2], specialization=Doctor.SPECIALIZATION_CHOICES[i % 6][0])
+        for i in range(doctors)
+    ], batch_size=1000)
+
+    per_patient = min(mappings_per_patient, len(doctor_objs))
+    PatientDoctorMapping.objects.bulk_create([
+        PatientDoctorMapping(patient=patient, doctor=doctor_objs[(i + j) % len(doctor_objs)])
+        for i, patient in enumerate(patient_objs) for j in range(per_patient)
+    ], batch_size=1000)
+    # bulk_create skips the signals that keep the roster counters
+    reconcile()
+    return owner
+
+
+# ----- Routes -----
+# Each route gets a prepare(ctx, i) that does whatever setup the request needs (outside the
+# timed part) and returns the request to send as (method, url, data).
+
+class BenchmarkContext:
+    def __init__(self, owner):
+        self.owner = owner
+        self.counter = 0
+        self.patient = Patient.objects.filter(created_by=owner).order_by("id").first()
+        self.doctor = Doctor.objects.order_by("id").first()
+        # what the batch lookups ask for, and where the change feed is read from
+        self.patient_ids = ",".join(str(pk) for pk in Patient.objects.filter(created_by=owner).order_by("id").values_list("id", flat=True)[:20])
+        self.doctor_ids = ",".join(str(pk) for pk in Doctor.objects.order_by("id").values_list("id", flat=True)[:20])
+        self.changes_cursor = head()
+
+    def unique(self):
+        self.counter += 1
+        return self.counter
+
+    def new_patient(self):
+        n = self.unique()
+        return Patient.objects.create(firstname="Bench", lastname="Patient", email=f"bench-new-patient{n}@example.com", age=40, gender="F", created_by=self.owner)
+
+    def new_doctor(self):
+        n = self.unique()
+        return Doctor.objects.create(firstname="Bench", lastname="Doctor", email=f"bench-new-doctor{n}@example.com", gender="M", specialization="GEN")
+
+    def patient_data(self):
+        n = self.unique()
+        return {"firstname": "Bench", "lastname": "Patient", "age": 40, "gender": "F", "email": f"bench-post-patient{n}@example.com"}
+
+    def doctor_data(self):
+        n = self.unique()
+        return {"firstname": "Bench", "lastname": "Doctor", "specialization": "CARD", "email": f"bench-post-doctor{n}@example.com", "gender": "M"}
+
+
+def prepare_mapping_delete(ctx, i):
+    mapping = PatientDoctorMapping.objects.create(patient=ctx.new_patient(), doctor=ctx.doctor)
+    return "delete", f"/api/mappings/{mapping.id}/{mapping.doctor_id}/", None
+
+
+def prepare_appointment_create(ctx, i):
+    # a fresh doctor every time, so the day never fills up
+    mapping = PatientDoctorMapping.objects.create(patient=ctx.new_patient(), doctor=ctx.new_doctor())
+    date = timezone.localdate() + datetime.timedelta(days=1)
+    return "post", "/api/appointments/", {"patient": mapping.patient_id, "doctor": mapping.doctor_id, "date": date.isoformat()}
+
+
+ROUTES = {
+    "auth-register": lambda ctx, i: ("post", "/api/auth/register/", {"username": f"bench-user{ctx.unique()}", "email": "bench@example.com", "password": BENCH_PASSWORD}),
+    "auth-login": lambda ctx, i: ("post", "/api/auth/login/", {"username": ctx.owner.username, "password": BENCH_PASSWORD}),
+
+    "patients-list": lambda ctx, i: ("get", "/api/patients/", None),
+    "patients-create": lambda ctx, i: ("post", "/api/patients/", ctx.patient_data()),
+    "patients-bulk": lambda ctx, i: ("post", "/api/patients/bulk/", [ctx.patient_data() for _ in range(10)]),
+    "patients-export": lambda ctx, i: ("get", "/api/patients/export/", None),
+    "patient-detail": lambda ctx, i: ("get", f"/api/patients/{ctx.patient.id}/", None),
+    "patient-update": lambda ctx, i: ("put", f"/api/patients/{ctx.patient.id}/", {"firstname": f"Bench{i}"}),
+    "patient-delete": lambda ctx, i: ("delete", f"/api/patients/{ctx.new_patient().id}/", None),
+    "patients-search": lambda ctx, i: ("get", "/api/patients/search/?q=bench", None),
+    "patients-batch": lambda ctx, i: ("get", f"/api/patients/batch/?ids={ctx.patient_ids}", None),
+
+    "doctors-list": lambda ctx, i: ("get", "/api/doctors/", None),
+    "doctors-create": lambda ctx, i: ("post", "/api/doctors/", ctx.doctor_data()),
+    "doctor-detail": lambda ctx, i: ("get", f"/api/doctors/{ctx.doctor.id}/", None),
+    "doctor-update": lambda ctx, i: ("put", f"/api/doctors/{ctx.doctor.id}/", {"firstname": f"Bench{i}"}),
+    "doctor-delete": lambda ctx, i: ("delete", f"/api/doctors/{ctx.new_doctor().id}/", None),
+    "doctors-search": lambda ctx, i: ("get", "/api/doctors/search/?q=bench", None),
+    "doctors-batch": lambda ctx, i: ("get", f"/api/doctors/batch/?ids={ctx.doctor_ids}", None),
+    "doctors-availability": lambda ctx, i: ("get", f"/api/doctors/availability/?date={timezone.localdate() + datetime.timedelta(days=1)}", None),
+
+    "mappings-list": lambda ctx, i: ("get", "/api/mappings/", None),
+    "mappings-create": lambda ctx, i: ("post", "/api/mappings/", {"patient": ctx.new_patient().id, "doctor": ctx.doctor.id}),
+    "mappings-bulk": lambda ctx, i: ("post", "/api/mappings/bulk/", {"patient_ids": [ctx.new_patient().id], "doctor_ids": list(Doctor.objects.values_list("id", flat=True)[:10])}),
+    "mappings-export": lambda ctx, i: ("get", "/api/mappings/export/", None),
+    "mapping-detail": lambda ctx, i: ("get", f"/api/mappings/{ctx.patient.id}/", None),
+    "mapping-delete": prepare_mapping_delete,
+
+    "appointments-list": lambda ctx, i: ("get", "/api/appointments/", None),
+    "appointment-create": prepare_appointment_create,
+
+    "stats-summary": lambda ctx, i: ("get", "/api/stats/", None),
+    "stats-doctors": lambda ctx, i: ("get", "/api/stats/doctors/", None),
+    "stats-patients": lambda ctx, i: ("get", "/api/stats/patients/", None),
+
+    "changes": lambda ctx, i: ("get", f"/api/changes/?since={ctx.changes_cursor}", None),
+}
+
+
+# ----- Doctor filters -----
+# The filter combinations clients use most, as query parameters of GET /api/doctors/
+
+DOCTOR_FILTER_CASES = {
+    "unfiltered": {},
+    "specialization": {"specialization": "CARD"},
+    "specialization+gender": {"specialization": "NEUR", "gender": "F"},
+    "gender": {"gender": "M"},
+    "capacity": {"min_capacity": 30, "max_capacity": 32},
+    "specialization+capacity": {"specialization": "PED", "min_capacity": 35},
+    "specializations": {"specialization": "CARD,DERM"},
+}
+
+
+def doctor_filter_page(params):
+    # the query doctors_list runs for the first page with these filters
+    filters = DoctorFilterSerializer(data=params)
+    filters.is_valid(raise_exception=True)
+    return filters.filter_queryset(Doctor.objects.all()).order_by("id")[:settings.PAGE_SIZE + 1]
+
+
+# ----- Running -----
+
+def send(client, method, url, data):
+    response = getattr(client, method)(url, data, format="json")
+    if response.streaming:
+        # an export isn't done until its body has been read
+        b"".join(response.streaming_content)
+    return response
+
+
+def measure_route(client, ctx, prepare, iterations, alloc_iterations):
+    latencies, queries = [], []
+    for i in range(iterations):
+        method, url, data = prepare(ctx, i)
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            response = send(client, method, url, data)
+            latencies.append((time.perf_counter() - start) * 1000)
+        if response.status_code >= status.HTTP_400_BAD_REQUEST:
+            raise RuntimeError(f"{method.upper()} {url} returned {response.status_code}")
+        queries.append(len(captured))
+
+    # tracemalloc slows everything down, so allocations get their own (shorter) pass
+    allocations = []
+    tracemalloc.start()
+    try:
+        for i in range(alloc_iterations):
+            method, url, data = prepare(ctx, iterations + i)
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            send(client, method, url, data)
+            allocations.append((tracemalloc.get_traced_memory()[1] - before) / 1024)
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "iterations": iterations,
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "mean_ms": round(statistics.fmean(latencies), 3),
+        "queries": max(queries),
+        "peak_alloc_kib": round(statistics.median(allocations), 1) if allocations else None,
+    }
+
+
+def run_benchmarks(owner, routes, iterations, alloc_iterations, on_route=None):
+    cache.clear()
+    client = APIClient()
+    response = client.post("/api/auth/login/", {"username": owner.username, "password": BENCH_PASSWORD})
+    client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+
+    ctx = BenchmarkContext(owner)
+    results = {}
+    for name in routes:
+        results[name] = measure_route(client, ctx, ROUTES[name], iterations, alloc_iterations)
+        if on_route:
+            on_route(name, results[name])
+    return results
+
+
+def compare_results(results, baseline, tolerance):
+    # latency and allocations may drift by `tolerance` (0.2 = 20%) before it counts, query
+    # counts are deterministic so any increase is a regression
+    regressions = []
+    for name, base in baseline.items():
+        current = results.get(name)
+        if current is None:
+            continue
+        for metric in ("p50_ms", "p95_ms", "p99_ms", "peak_alloc_kib"):
+            if base.get(metric) and current.get(metric) and current[metric] > base[metric] * (1 + tolerance):
+                regressions.append(f"{name}: {metric} {current[metric]} > baseline {base[metric]} (+{tolerance:.0%})")
+        if current["queries"] > base["queries"]:
+            regressions.append(f"{name}: queries {current['queries']} > baseline {base['queries']}")
+    return regressions
+
+
+# ----- Booking stress -----
+# Every patient tries to book every doctor on every day, from `threads` threads at once, each with
+# its own db connection. Afterwards every doctor/day must hold exactly min(cap, patients)
+# appointments and its counter row has to agree.
+
+def seed_booking(doctors, patients, capacity):
+    owner = User.objects.create_user(username="stress-owner", password=BENCH_PASSWORD)
+    doctor_objs = Doctor.objects.bulk_create([
+        Doctor(firstname=f"Doctor{i}", lastname="Stress", email=f"stress-doctor{i}@example.com", gender="M", specialization="GEN", max_appointments_per_day=capacity)
+        for i in range(doctors)
+    ])
+    patient_objs = Patient.objects.bulk_create([
+        Patient(firstname=f"Patient{i}", lastname="Stress", email=f"stress-patient{i}@example.com", age=30, gender="F", created_by=owner)
+        for i in range(patients)
+    ], batch_size=1000)
+    PatientDoctorMapping.objects.bulk_create([
+        PatientDoctorMapping(patient=patient, doctor=doctor) for patient in patient_objs for doctor in doctor_objs
+    ], batch_size=1000)
+    return list(PatientDoctorMapping.objects.select_related("patient", "doctor").order_by("patient_id", "doctor_id"))
+
+
+def run_booking_stress(mappings, days, threads):
+    start_date = timezone.localdate() + datetime.timedelta(days=1)
+    dates = [start_date + datetime.timedelta(days=n) for n in range(days)]
+    jobs = queue.Queue()
+    for date in dates:
+        for mapping in mappings:
+            jobs.put((mapping, date))
+
+    outcomes, latencies, lock = Counter(), [], threading.Lock()
+
+    def worker():
+        try:
+            while True:
+                try:
+                    mapping, date = jobs.get_nowait()
+                except queue.Empty:
+                    return
+                started = time.perf_counter()
+                try:
+                    book(mapping, date)
+                    outcome = "booked"
+                except DoctorFullyBooked:
+                    outcome = "full"
+                except AlreadyBooked:
+                    outcome = "duplicate"
+                except DatabaseError:
+                    outcome = "error"
+                with lock:
+                    outcomes[outcome] += 1
+                    latencies.append((time.perf_counter() - started) * 1000)
+        finally:
+            connections.close_all()
+
+    started = time.perf_counter()
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    return {
+        "attempts": len(latencies),
+        "outcomes": dict(outcomes),
+        "attempts_per_s": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 50), 3) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95), 3) if latencies else None,
+        "violations": check_bookings(dates),
+    }
+
+
+def check_bookings(dates):
+    # every way the cap or the counters could have gone wrong, empty when all is well
+    violations = []
+    counts = {
+        (row["doctor_id"], row["date"]): row["count"]
+        for row in Appointment.objects.filter(date__in=dates).values("doctor_id", "date").annotate(count=Count("id"))
+    }
+    for day in DoctorDayBookings.objects.filter(date__in=dates).select_related("doctor"):
+        appointments = counts.get((day.doctor_id, day.date), 0)
+        if appointments > day.doctor.max_appointments_per_day:
+            violations.append(f"{day.doctor} on {day.date}: {appointments} appointments, cap {day.doctor.max_appointments_per_day}")
+        if appointments != day.booked:
+            violations.append(f"{day.doctor} on {day.date}: counter says {day.booked}, {appointments} appointments exist")
+        if day.remaining != day.doctor.max_appointments_per_day - day.booked:
+            violations.append(f"{day.doctor} on {day.date}: {day.remaining} slots left, should be {day.doctor.max_appointments_per_day - day.booked}")
+    return violations
@@ -0,0 +1,53 @@
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import Appointment, DoctorDayBookings
+
+# Appointments are capped at Doctor.max_appointments_per_day. The count lives in one
+# DoctorDayBookings row per doctor and day: a booking takes a slot with
+#   UPDATE ... SET booked = booked + 1, remaining = remaining - 1
+#   WHERE doctor = ? AND date = ? AND remaining > 0
+# which either gets the row lock and a free slot, or matches nothing. Concurrent bookings for the
+# same doctor and day wait on that row only (PostgreSQL rechecks remaining > 0 once the lock is
+# theirs), other doctors and days are never blocked, and the slot can't be overbooked.
+
+
+class BookingError(Exception):
+    pass
+
+
+class DoctorFullyBooked(BookingError):
+    pass
+
+
+class AlreadyBooked(BookingError):
+    pass
+
+
+def book(mapping, date):
+    doctor = mapping.doctor
+    with transaction.atomic():
+        # creates the day's counter the first time anyone books it (INSERT .. ON CONFLICT DO
+        # NOTHING, so two bookings racing to create the same row are fine)
+        DoctorDayBookings.objects.bulk_create([DoctorDayBookings(
+            doctor_id=doctor.id, date=date, specialization=doctor.specialization, remaining=doctor.max_appointments_per_day,
+        )], ignore_conflicts=True)
+
+        taken = DoctorDayBookings.objects.filter(doctor_id=doctor.id, date=date, remaining__gt=0).update(
+            booked=F("booked") + 1, remaining=F("remaining") - 1,
+        )
+        if not taken:
+            raise DoctorFullyBooked(f"{doctor} is fully booked on {date}")
+
+        # leaving the block with an exception rolls the increment back, giving the slot back
+        try:
+            return Appointment.objects.create(mapping=mapping, doctor=doctor, date=date)
+        except IntegrityError:
+            raise AlreadyBooked(f"{mapping.patient} already has an appointment with {doctor} on {date}")
+
+
+def release(doctor_id, date):
+    # called for every deleted appointment, including ones removed by a cascade
+    DoctorDayBookings.objects.filter(doctor_id=doctor_id, date=date, booked__gt=0).update(
+        booked=F("booked") - 1, remaining=F("remaining") + 1,
+    )
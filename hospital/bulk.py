@@ -0,0 +1,225 @@
+import codecs
+import json
+
+from django.db import IntegrityError, transaction
+
+from . import changes, stats
+from .cache import invalidate_mapping_list, invalidate_patient_list
+from .models import Patient, Doctor, PatientDoctorMapping
+from .serializers import PatientBulkCreateSerializer
+
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonlines")
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class RowParseError(Exception):
+    pass
+
+
+# ----- Body parsing -----
+# Both readers yield (row number, row) pairs while reading the body in chunks, so an upload of
+# any size is never held in memory all at once. A row that can't be parsed is yielded as a
+# RowParseError in its place.
+
+def iter_ndjson_rows(stream):
+    number = 0
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError as exc:
+            yield number, RowParseError(f"Invalid JSON: {exc}")
+        number += 1
+
+
+def iter_json_array_rows(stream):
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buffer, pos, eof = "", 0, False
+
+    def fill():
+        nonlocal buffer, pos, eof
+        chunk = stream.read(READ_CHUNK_SIZE)
+        eof = not chunk
+        buffer = buffer[pos:] + utf8.decode(chunk, final=eof)
+        pos = 0
+
+    def skip_whitespace():
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+            if pos < len(buffer) or eof:
+                return
+            fill()
+
+    number = 0
+    try:
+        fill()
+        skip_whitespace()
+        if buffer[pos:pos + 1] != "[":
+            raise ValueError("Expected a JSON array or NDJSON")
+        pos += 1
+
+        while True:
+            skip_whitespace()
+            if buffer[pos:pos + 1] == "]":
+                return
+            if number:
+                if buffer[pos:pos + 1] != ",":
+                    raise ValueError("Expected ',' or ']' between rows")
+                pos += 1
+                skip_whitespace()
+
+            # raw_decode on a half read object fails, so keep reading until the row is complete.
+            # A row that ends right at the end of the buffer might be a truncated number, so
+            # that one is retried with more data too.
+            while True:
+                try:
+                    row, end = decoder.raw_decode(buffer, pos)
+                    if end < len(buffer) or eof:
+                        break
+                except ValueError:
+                    if eof:
+                        raise
+                fill()
+
+            pos = end
+            yield number, row
+            number += 1
+    except (ValueError, UnicodeDecodeError) as exc:
+        # the rest of a broken array can't be trusted, so the upload stops at this row
+        yield number, RowParseError(f"Invalid JSON: {exc}")
+
+
+def iter_rows(stream, content_type):
+    if stream is None:
+        return iter(())
+    if content_type.split(";")[0].strip() in NDJSON_CONTENT_TYPES:
+        return iter_ndjson_rows(stream)
+    return iter_json_array_rows(stream)
+
+
+# ----- Import -----
+
+def email_taken_error():
+    field = Patient._meta.get_field("email")
+    return field.error_messages["unique"] % {
+        "model_name": Patient._meta.verbose_name,
+        "field_label": field.verbose_name,
+    }
+
+
+def insert_batch(batch, user, report):
+    # one query checks every email in the batch, instead of the per row UniqueValidator query
+    emails = [data["email"] for _, data in batch]
+    taken = set(Patient.objects.filter(email__in=emails).values_list("email", flat=True))
+
+    patients = []
+    for number, data in batch:
+        if data["email"] in taken:
+            report["errors"].append({"row": number, "errors": {"email": [email_taken_error()]}})
+            continue
+        taken.add(data["email"])
+        patients.append((number, Patient(**data, created_by_id=user.id)))
+
+    try:
+        with transaction.atomic():
+            created = Patient.objects.bulk_create([patient for _, patient in patients])
+            changes.log_inserted(Patient, [(patient.pk, user.id) for patient in created])
+        report["created"] += len(patients)
+        # bulk_create sends no post_save, the row by row fallback below does
+        invalidate_patient_list(user.id)
+    except IntegrityError:
+        # someone else inserted one of these emails since we checked, insert row by row so
+        # only the colliding rows fail
+        for number, patient in patients:
+            try:
+                with transaction.atomic():
+                    patient.save()
+                report["created"] += 1
+            except IntegrityError:
+                report["errors"].append({"row": number, "errors": {"email": [email_taken_error()]}})
+
+
+def import_patients(rows, user, batch_size):
+    report = {"created": 0, "errors": []}
+    batch = []
+
+    for number, row in rows:
+        if isinstance(row, RowParseError):
+            report["errors"].append({"row": number, "errors": {"non_field_errors": [str(row)]}})
+            continue
+
+        serializer = PatientBulkCreateSerializer(data=row)
+        if not serializer.is_valid():
+            report["errors"].append({"row": number, "errors": serializer.errors})
+            continue
+
+        batch.append((number, serializer.validated_data))
+        if len(batch) >= batch_size:
+            insert_batch(batch, user, report)
+            batch = []
+
+    if batch:
+        insert_batch(batch, user, report)
+
+    report["failed"] = len(report["errors"])
+    return report
+
+
+# ----- Mapping assignment -----
+
+def assign_doctors(pairs, batch_size):
+    # a fixed handful of queries for any number of pairs: one lookup each for the patients,
+    # the doctors and the pairs that already exist, then the inserts in batch_size chunks
+    patient_ids = {patient_id for patient_id, _ in pairs}
+    doctor_ids = {doctor_id for _, doctor_id in pairs}
+
+    found_patients = set(Patient.objects.filter(id__in=patient_ids).values_list("id", flat=True))
+    found_doctors = set(Doctor.objects.filter(id__in=doctor_ids).values_list("id", flat=True))
+    pairs = {
+        (patient_id, doctor_id) for patient_id, doctor_id in pairs
+        if patient_id in found_patients and doctor_id in found_doctors
+    }
+
+    existing = set(
+        PatientDoctorMapping.objects
+        .filter(patient_id__in=found_patients, doctor_id__in=found_doctors)
+        .values_list("patient_id", "doctor_id")
+    ) & pairs
+    new = pairs - existing
+
+    # ignore_conflicts covers a pair someone else inserted after the lookup above, instead of
+    # failing the whole request on the unique_together constraint
+    mappings = [PatientDoctorMapping(patient_id=patient_id, doctor_id=doctor_id) for patient_id, doctor_id in sorted(new)]
+    inserted = []
+    with transaction.atomic():
+        PatientDoctorMapping.objects.bulk_create(mappings, batch_size=batch_size, ignore_conflicts=True)
+        if new:
+            # ignore_conflicts leaves the pks unset and doesn't tell which rows were skipped. The
+            # rows are read back, ours are the ones with the assigned_at bulk_create stamped on them
+            stamped = {(mapping.patient_id, mapping.doctor_id): mapping.assigned_at for mapping in mappings}
+            inserted = [
+                (pk, patient_id, doctor_id, owner)
+                for pk, patient_id, doctor_id, owner, assigned_at in (
+                    PatientDoctorMapping.objects
+                    .filter(patient_id__in={patient_id for patient_id, _ in new}, doctor_id__in={doctor_id for _, doctor_id in new})
+                    .values_list("id", "patient_id", "doctor_id", "patient__created_by_id", "assigned_at")
+                )
+                if stamped.get((patient_id, doctor_id)) == assigned_at
+            ]
+            # only what went in counts, a pair someone else inserted meanwhile was counted by them
+            stats.mappings_added([(patient_id, doctor_id) for _, patient_id, doctor_id, _ in inserted])
+            changes.log_inserted(PatientDoctorMapping, [(pk, owner) for pk, _, _, owner in inserted])
+    if inserted:
+        invalidate_mapping_list()
+
+    return {
+        "created": len(inserted),
+        "existing": len(pairs) - len(inserted),
+        "missing_patients": sorted(patient_ids - found_patients),
+        "missing_doctors": sorted(doctor_ids - found_doctors),
+    }
@@ -0,0 +1,192 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+# Read-through cache for the doctor directory. List pages and detail payloads are keyed on a
+# version number that gets bumped whenever any doctor changes, detail payloads on the doctor's pk
+# as well. Stale entries are never deleted, they just stop being read and age out of the backend.
+#
+# Versions are bumped when the write happens and again once it commits: a reader that saw the
+# first bump before the commit may have cached the old row under the new version.
+DOCTORS_VERSION_KEY = "doctors:version"
+DOCTORS_HITS_KEY = "doctors:hits"
+DOCTORS_MISSES_KEY = "doctors:misses"
+MAPPINGS_VERSION_KEY = "mappings:version"
+PATIENTS_VERSION_KEY = "patients:version:{}"
+
+
+def _incr(key, delta=1):
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        # the counter got evicted (or never existed), start it over
+        cache.add(key, 0, timeout=None)
+        cache.incr(key, delta)
+
+
+def _get_version(key):
+    version = cache.get(key)
+    if version is None:
+        # seeding with the clock rather than 1 so a version key that got evicted can't
+        # come back with a number that still has old pages cached under it
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def _bump_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        _get_version(key)
+
+
+def _bump_version_on_commit(key):
+    _bump_version(key)
+    transaction.on_commit(lambda: _bump_version(key))
+
+
+def get_doctors_version():
+    return _get_version(DOCTORS_VERSION_KEY)
+
+
+def invalidate_doctor_list():
+    _bump_version_on_commit(DOCTORS_VERSION_KEY)
+
+
+# the mappings list isn't cached, but its rows embed patients and doctors, so its ETag hangs off a
+# version bumped whenever a mapping, patient or doctor changes (see signals.py)
+def get_mappings_version():
+    return _get_version(MAPPINGS_VERSION_KEY)
+
+
+def invalidate_mapping_list():
+    _bump_version_on_commit(MAPPINGS_VERSION_KEY)
+
+
+# the patients list isn't cached either, each owner's list gets a version for its ETag, bumped
+# when one of their patients is written (see signals.py and the bulk import)
+def get_patients_version(user_id):
+    return _get_version(PATIENTS_VERSION_KEY.format(user_id))
+
+
+def invalidate_patient_list(user_id):
+    _bump_version_on_commit(PATIENTS_VERSION_KEY.format(user_id))
+
+
+def invalidate_doctor(pk):
+    # the detail entries hang off the list version too
+    invalidate_doctor_list()
+
+
+def doctor_detail_key(pk, version):
+    # entries are {"doctor": payload, "updated_at": ...}
+    return f"doctors:entry:{version}:{pk}"
+
+
+def doctor_list_key(request):
+    # the full url covers the cursor, page size and host used in the next link
+    url = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+    return f"doctors:list:{get_doctors_version()}:{url}"
+
+
+def _get_or_build(key, build):
+    payload = cache.get(key)
+    if payload is not None:
+        _incr(DOCTORS_HITS_KEY)
+        return payload
+
+    _incr(DOCTORS_MISSES_KEY)
+    payload = build()
+    cache.set(key, payload, timeout=settings.DOCTOR_CACHE_TIMEOUT)
+    return payload
+
+
+def get_doctor_list(request, build):
+    return _get_or_build(doctor_list_key(request), build)
+
+
+def get_doctor_detail(pk, build):
+    return _get_or_build(doctor_detail_key(pk, get_doctors_version()), build)
+
+
+def get_doctor_details(pks, build):
+    # several detail entries in one cache round trip. build(missing pks) returns {pk: entry} for
+    # the ones it found in the db, doctors that don't exist are left out of the result
+    version = get_doctors_version()
+    keys = {doctor_detail_key(pk, version): pk for pk in pks}
+    entries = {keys[key]: entry for key, entry in cache.get_many(list(keys)).items()}
+    missing = [pk for pk in pks if pk not in entries]
+    if entries:
+        _incr(DOCTORS_HITS_KEY, len(entries))
+    if missing:
+        _incr(DOCTORS_MISSES_KEY, len(missing))
+        built = build(missing)
+        cache.set_many({doctor_detail_key(pk, version): entry for pk, entry in built.items()}, timeout=settings.DOCTOR_CACHE_TIMEOUT)
+        entries.update(built)
+    return entries
+
+
+def doctor_cache_stats():
+    hits = cache.get(DOCTORS_HITS_KEY, 0)
+    misses = cache.get(DOCTORS_MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": hits / total if total else None,
+    }
+
+
+# ----- Async twins for the async views, same keys and counters -----
+
+async def _aincr(key):
+    try:
+        await cache.aincr(key)
+    except ValueError:
+        await cache.aadd(key, 0, timeout=None)
+        await cache.aincr(key)
+
+
+async def _aget_version(key):
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, time.time_ns(), timeout=None)
+        version = await cache.aget(key)
+    return version
+
+
+async def aget_doctors_version():
+    return await _aget_version(DOCTORS_VERSION_KEY)
+
+
+async def aget_mappings_version():
+    return await _aget_version(MAPPINGS_VERSION_KEY)
+
+
+async def aget_patients_version(user_id):
+    return await _aget_version(PATIENTS_VERSION_KEY.format(user_id))
+
+
+async def _aget_or_build(key, abuild):
+    payload = await cache.aget(key)
+    if payload is not None:
+        await _aincr(DOCTORS_HITS_KEY)
+        return payload
+
+    await _aincr(DOCTORS_MISSES_KEY)
+    payload = await abuild()
+    await cache.aset(key, payload, timeout=settings.DOCTOR_CACHE_TIMEOUT)
+    return payload
+
+
+async def aget_doctor_list(request, abuild):
+    url = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+    return await _aget_or_build(f"doctors:list:{await aget_doctors_version()}:{url}", abuild)
+
+
+async def aget_doctor_detail(pk, abuild):
+    return await _aget_or_build(doctor_detail_key(pk, await aget_doctors_version()), abuild)
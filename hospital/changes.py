@@ -0,0 +1,178 @@
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Patient, Doctor, PatientDoctorMapping, ChangeLog
+from .fastpath import patient_rows, doctor_rows, mapping_rows
+
+# Change feed for offline clients. Every insert, update and delete of a patient, doctor or
+# mapping appends a ChangeLog row in the same transaction as the write (from the signals in
+# signals.py and from the bulk paths), tagged with the user who owns it: a patient's or
+# mapping's created_by, or nobody for doctors, which everyone sees. A client keeps the id of
+# the last entry it got and asks for what came after it.
+#
+# Ids come from a sequence and are handed out before commit, so a slow transaction can commit
+# an id below one a client already read. The feed only serves entries older than
+# CHANGES_SETTLE_SECONDS to leave those time to land; the log rows are written at the very end
+# of their transaction to keep that window short.
+#
+# Deletes are batched like the roster counters (hospital.stats): the rows a delete is about to
+# remove are noted in pre_delete and logged with one INSERT after the last post_delete.
+
+MODELS = {
+    Patient: "patient",
+    Doctor: "doctor",
+    PatientDoctorMapping: "mapping",
+}
+ROWS = {
+    "patient": (Patient, patient_rows),
+    "doctor": (Doctor, doctor_rows),
+    "mapping": (PatientDoctorMapping, mapping_rows),
+}
+
+OLDEST_KEY = "changes:oldest"
+
+pending = threading.local()
+
+
+def owner_of(instance):
+    if isinstance(instance, Patient):
+        return instance.created_by_id
+    if isinstance(instance, PatientDoctorMapping):
+        # the serializers hand the patient over already loaded, so this rarely queries
+        return instance.patient.created_by_id
+    return None
+
+
+def log_saved(instance, created):
+    ChangeLog.objects.create(
+        model=MODELS[type(instance)], object_id=instance.pk, owner=owner_of(instance),
+        op=ChangeLog.INSERT if created else ChangeLog.UPDATE,
+    )
+
+
+def log_inserted(model, rows):
+    # rows are (pk, owner) pairs written by a bulk insert
+    ChangeLog.objects.bulk_create([
+        ChangeLog(model=MODELS[model], object_id=pk, owner=owner, op=ChangeLog.INSERT)
+        for pk, owner in rows
+    ])
+
+
+def deleting(origin, instance):
+    state = getattr(pending, "state", None)
+    if state is None or state["origin"] is not origin:
+        state = pending.state = {"origin": origin, "remaining": 0, "rows": []}
+    state["remaining"] += 1
+    state["rows"].append(instance)
+
+
+def deleted(origin, instance):
+    state = getattr(pending, "state", None)
+    if state is None or state["origin"] is not origin:
+        rows = [instance]
+    else:
+        state["remaining"] -= 1
+        if state["remaining"]:
+            return
+        rows = state["rows"]
+        pending.state = None
+
+    # a mapping's owner is its patient's. Patients that went in the same delete or came loaded
+    # with their mapping are at hand, the others are still there to be looked up, in one query
+    owners = {row.pk: row.created_by_id for row in rows if isinstance(row, Patient)}
+    owners.update(
+        (row.patient_id, row.patient.created_by_id) for row in rows
+        if isinstance(row, PatientDoctorMapping) and PatientDoctorMapping.patient.is_cached(row)
+    )
+    missing = {row.patient_id for row in rows if isinstance(row, PatientDoctorMapping)} - set(owners)
+    if missing:
+        owners.update(Patient.objects.filter(pk__in=missing).values_list("id", "created_by_id"))
+
+    ChangeLog.objects.bulk_create([
+        ChangeLog(
+            model=MODELS[type(row)], object_id=row.pk, op=ChangeLog.DELETE,
+            owner=owners.get(row.patient_id) if isinstance(row, PatientDoctorMapping) else owner_of(row),
+        )
+        for row in rows
+    ])
+
+
+# ----- Reading -----
+
+def head():
+    # where a client starts: the newest entry, fetch the lists after asking for it
+    return ChangeLog.objects.order_by("-id").values_list("id", flat=True).first() or 0
+
+
+def oldest():
+    # the first entry still there, only moves when prune() runs so it's cached until then
+    value = cache.get(OLDEST_KEY)
+    if value is None:
+        value = ChangeLog.objects.order_by("id").values_list("id", flat=True).first() or 0
+        cache.set(OLDEST_KEY, value, timeout=None)
+    return value
+
+
+def is_expired(cursor):
+    # a client whose cursor points before the oldest entry left may have missed pruned ones and
+    # has to start over from the lists (a rolled back write right before it can make that a
+    # needless resync, ids aren't gapless)
+    return cursor < oldest() - 1
+
+
+def changes_since(user_id, cursor, limit):
+    # one indexed range scan when nothing changed. Otherwise one more query per kind of row in
+    # the page, for the current state of everything that was inserted or updated
+    entries = list(
+        ChangeLog.objects
+        .filter(Q(owner=user_id) | Q(owner__isnull=True), id__gt=cursor)
+        .filter(created_at__lte=timezone.now() - timedelta(seconds=settings.CHANGES_SETTLE_SECONDS))
+        .order_by("id")
+        .values("id", "model", "object_id", "op")[:limit + 1]
+    )
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+    if not entries:
+        return {"changes": [], "cursor": cursor, "has_more": False}
+
+    # several writes to the same row collapse into one change, at the position of the last one
+    first_op, last = {}, {}
+    for entry in entries:
+        key = (entry["model"], entry["object_id"])
+        first_op.setdefault(key, entry["op"])
+        last[key] = entry
+
+    upserts = {}
+    for model_name, (model, rows) in ROWS.items():
+        ids = [object_id for (name, object_id), entry in last.items() if name == model_name and entry["op"] != ChangeLog.DELETE]
+        if ids:
+            upserts.update(((model_name, row["id"]), row) for row in rows.values(model.objects.filter(pk__in=ids)))
+
+    changes = []
+    for key, entry in sorted(last.items(), key=lambda item: item[1]["id"]):
+        model_name, object_id = key
+        if entry["op"] == ChangeLog.DELETE:
+            changes.append({"model": model_name, "id": object_id, "op": ChangeLog.DELETE})
+            continue
+        row = upserts.get(key)
+        if row is None:
+            # deleted since, its tombstone comes in a later entry
+            continue
+        op = ChangeLog.INSERT if first_op[key] == ChangeLog.INSERT else ChangeLog.UPDATE
+        changes.append({"model": model_name, "id": object_id, "op": op, "data": ROWS[model_name][1].to_representation(row)})
+
+    return {"changes": changes, "cursor": entries[-1]["id"], "has_more": has_more}
+
+
+def prune(days):
+    # keeps the newest entry whatever its age, so is_expired always has something to compare to
+    newest = head()
+    cutoff = timezone.now() - timedelta(days=days)
+    deleted, _ = ChangeLog.objects.filter(created_at__lt=cutoff, id__lt=newest).delete()
+    cache.delete(OLDEST_KEY)
+    return deleted
@@ -0,0 +1,56 @@
+import hashlib
+
+from django.conf import settings
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+# Conditional GET: responses carry an ETag (and a Last-Modified when they show one row), and a
+# client sending If-None-Match / If-Modified-Since gets a bodiless 304 when nothing changed.
+# The validators come from Patient/Doctor/PatientDoctorMapping.updated_at or, for lists, from
+# an aggregate version, so a 304 costs a version lookup and never builds or serializes the body.
+# ETags are weak: the bytes depend on the renderer picked, the data they describe doesn't.
+
+
+def row_etag(pk, updated_at):
+    return f'W/"{pk}-{int(updated_at.timestamp() * 1_000_000)}"'
+
+
+def version_etag(request, *parts):
+    # the full path keeps pages, filters and page sizes apart
+    key = "|".join(str(part) for part in (request.get_full_path(), *parts))
+    return f'W/"{hashlib.md5(key.encode()).hexdigest()}"'
+
+
+def list_etag(request, get_version, *parts):
+    # for the lists versioned in the cache (see LIST_ETAGS), None when those aren't trustworthy
+    if not settings.LIST_ETAGS:
+        return None
+    return version_etag(request, *parts, get_version())
+
+
+async def alist_etag(request, aget_version, *parts):
+    # the same for the async views, the version comes from the async cache API
+    if not settings.LIST_ETAGS:
+        return None
+    return version_etag(request, *parts, await aget_version())
+
+
+def is_conditional(request):
+    return "HTTP_IF_NONE_MATCH" in request.META or "HTTP_IF_MODIFIED_SINCE" in request.META
+
+
+def not_modified(request, etag, updated_at=None):
+    # the 304 (or None when the client's copy is stale and the body has to be built). Without
+    # validators there's never one
+    if etag is None and updated_at is None:
+        return None
+    last_modified = int(updated_at.timestamp()) if updated_at else None
+    return get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+
+def with_validators(response, etag, updated_at=None):
+    if etag is not None:
+        response["ETag"] = etag
+    if updated_at:
+        response["Last-Modified"] = http_date(updated_at.timestamp())
+    return response
@@ -0,0 +1,179 @@
+import io
+import itertools
+import random
+import time
+from array import array
+from bisect import bisect_left
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Patient, Doctor, PatientDoctorMapping, GENDER_CHOICES
+
+FIRST_NAMES = [
+    "James", "Mary", "John", "Patricia", "Robert", "Jennifer", "Michael", "Linda", "David", "Elizabeth",
+    "Aarav", "Ananya", "Mohammed", "Fatima", "Wei", "Mei", "Hiroshi", "Yuki", "Carlos", "Sofia",
+    "Olusegun", "Amara", "Ivan", "Olga", "Lars", "Ingrid", "Mateo", "Valentina", "Noah", "Emma",
+]
+LAST_NAMES = [
+    "Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez",
+    "Sharma", "Patel", "Khan", "Ali", "Wang", "Li", "Tanaka", "Sato", "Silva", "Rossi",
+    "Okafor", "Adeyemi", "Petrov", "Ivanova", "Nielsen", "Larsen", "Lopez", "Gonzalez", "Muller", "Schmidt",
+]
+GENDERS = [code for code, _ in GENDER_CHOICES]
+SPECIALIZATIONS = [code for code, _ in Doctor.SPECIALIZATION_CHOICES]
+
+
+def zipf_cum_weights(n, skew):
+    # rank i gets weight 1 / (i + 1) ** skew: 0 is uniform, 1 is the classic "few own most" curve
+    total, cum = 0.0, []
+    for i in range(n):
+        total += 1.0 / (i + 1) ** skew
+        cum.append(total)
+    return cum
+
+
+class DataGenerator:
+    # Fills the tables with synthetic rows. Every value is drawn from one random.Random(seed),
+    # so the same seed and options always produce the same dataset. Rows are generated lazily
+    # and written in batches, on PostgreSQL with COPY, elsewhere with bulk_create.
+    def __init__(self, seed=0, prefix=None, batch_size=5000, method="auto", log=None):
+        self.rng = random.Random(seed)
+        self.prefix = prefix or f"gen{seed}"
+        self.batch_size = batch_size
+        if method == "auto":
+            method = "copy" if connection.vendor == "postgresql" else "bulk"
+        self.method = method
+        self.log = log or (lambda message: None)
+        self.now = timezone.now()
+
+    def check_prefix(self):
+        if User.objects.filter(username__startswith=f"{self.prefix}-").exists():
+            raise ValueError(f"Data with prefix {self.prefix!r} already exists, pick another seed or prefix")
+
+    def name(self):
+        return self.rng.choice(FIRST_NAMES), self.rng.choice(LAST_NAMES)
+
+    # ----- Writing -----
+
+    def write(self, model, fields, rows):
+        # rows are tuples in `fields` order, consumed batch by batch so nothing is held in memory
+        start, written = time.perf_counter(), 0
+        rows = iter(rows)
+        while True:
+            batch = list(itertools.islice(rows, self.batch_size))
+            if not batch:
+                break
+            with transaction.atomic():
+                if self.method == "copy":
+                    self.copy(model, fields, batch)
+                else:
+                    model.objects.bulk_create([model(**dict(zip(fields, row))) for row in batch])
+            written += len(batch)
+
+        elapsed = time.perf_counter() - start
+        self.log(f"{model._meta.verbose_name_plural}: {written:,} rows in {elapsed:.1f}s ({written / elapsed if elapsed else 0:,.0f} rows/s)")
+
+    def copy(self, model, fields, batch):
+        columns = ", ".join(connection.ops.quote_name(model._meta.get_field(field).column) for field in fields)
+        sql = f"COPY {connection.ops.quote_name(model._meta.db_table)} ({columns}) FROM STDIN"
+
+        buffer = io.StringIO()
+        for row in batch:
+            buffer.write("\t".join(self.copy_value(value) for value in row))
+            buffer.write("\n")
+
+        with connection.cursor() as cursor:
+            raw = cursor.cursor
+            if hasattr(raw, "copy_expert"):
+                # psycopg2
+                buffer.seek(0)
+                raw.copy_expert(sql, buffer)
+            else:
+                # psycopg 3
+                with raw.copy(sql) as copy:
+                    copy.write(buffer.getvalue())
+
+    def copy_value(self, value):
+        if value is None:
+            return "\\N"
+        if isinstance(value, bool):
+            return "t" if value else "f"
+        if hasattr(value, "isoformat"):
+            return value.isoformat()
+        return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
+
+    def ids(self, queryset):
+        return array("q", queryset.order_by("id").values_list("id", flat=True).iterator(chunk_size=self.batch_size))
+
+    # ----- Tables -----
+
+    def users(self, count, password):
+        # hashing once and reusing it: PBKDF2 per user would take longer than everything else
+        password_hash = make_password(password)
+
+        def rows():
+            for n in range(count):
+                first, last = self.name()
+                yield (
+                    f"{self.prefix}-user{n}", password_hash, first, last,
+                    f"{self.prefix}-user{n}@example.com", False, False, True, self.now,
+                )
+
+        self.write(User, ["username", "password", "first_name", "last_name", "email", "is_superuser", "is_staff", "is_active", "date_joined"], rows())
+        return self.ids(User.objects.filter(username__startswith=f"{self.prefix}-"))
+
+    def doctors(self, count):
+        def rows():
+            for n in range(count):
+                first, last = self.name()
+                yield (
+                    first, last, self.rng.choice(SPECIALIZATIONS), self.rng.choice(GENDERS),
+                    self.rng.randint(5, 40), f"{self.prefix}-doctor{n}@example.com", self.now, 0,
+                )
+
+        # COPY skips the model defaults and the columns have none in the db, so the roster
+        # counter is written as 0 here (generate_data reconciles it afterwards)
+        self.write(Doctor, ["firstname", "lastname", "specialization", "gender", "max_appointments_per_day", "email", "updated_at", "patient_count"], rows())
+        return self.ids(Doctor.objects.filter(email__startswith=f"{self.prefix}-"))
+
+    def patients(self, count, owner_ids, owner_skew):
+        # owners are ranked by a shuffled order, so with skew > 0 a handful of users own most patients
+        owners = list(owner_ids)
+        self.rng.shuffle(owners)
+        cum = zipf_cum_weights(len(owners), owner_skew)
+
+        def rows():
+            for n in range(count):
+                first, last = self.name()
+                owner = owners[bisect_left(cum, self.rng.random() * cum[-1])]
+                yield first, last, f"{self.prefix}-patient{n}@example.com", self.rng.randint(0, 120), self.rng.choice(GENDERS), owner, self.now, 0
+
+        self.write(Patient, ["firstname", "lastname", "email", "age", "gender", "created_by_id", "updated_at", "doctor_count"], rows())
+        return self.ids(Patient.objects.filter(email__startswith=f"{self.prefix}-"))
+
+    def mappings(self, patient_ids, doctor_ids, per_patient, doctor_skew):
+        # each patient gets 0..2*per_patient distinct doctors, popular doctors (skew > 0) end up
+        # with huge rosters. Pairs are deduplicated per patient so unique_together always holds
+        doctors = list(doctor_ids)
+        self.rng.shuffle(doctors)
+        cum = zipf_cum_weights(len(doctors), doctor_skew)
+        top = cum[-1] if cum else 0
+
+        def rows():
+            if not doctors:
+                return
+            for patient_id in patient_ids:
+                wanted = min(self.rng.randint(0, 2 * per_patient), len(doctors))
+                chosen = set()
+                # heavy skew keeps drawing the same few doctors, so give up after a few misses
+                for _ in range(wanted * 4):
+                    if len(chosen) == wanted:
+                        break
+                    chosen.add(doctors[bisect_left(cum, self.rng.random() * top)])
+                for doctor_id in sorted(chosen):
+                    yield patient_id, doctor_id, self.now, self.now
+
+        self.write(PatientDoctorMapping, ["patient_id", "doctor_id", "assigned_at", "updated_at"], rows())
@@ -0,0 +1,131 @@
+from rest_framework import serializers
+
+from .serializers import PatientPublicSerializer, DoctorPublicSerializer, MappingsDetailSerializer
+
+# Fields whose to_representation hands back a value from the db unchanged (str stays str, int
+# stays int, a pk column already is the pk), so the fast path can copy those values as they are.
+PASSTHROUGH_FIELDS = (
+    serializers.CharField,
+    serializers.IntegerField,
+    serializers.ChoiceField,
+    serializers.BooleanField,
+    serializers.PrimaryKeyRelatedField,
+)
+
+
+MAX_VARIANTS = 64
+
+
+def tree(fields):
+    # {"id", "patient", "doctor.lastname"} -> {"id": None, "patient": None, "doctor": {"lastname": None}}
+    if fields is None:
+        return None
+    result = {}
+    for name in fields:
+        relation, _, nested = name.partition(".")
+        if nested:
+            result.setdefault(relation, {})[nested] = None
+    # a relation asked for whole wins over some of its fields
+    for name in fields:
+        if "." not in name:
+            result[name] = None
+    return result
+
+
+class FastRowSerializer:
+    # Read-only twin of a ModelSerializer that works on .values() rows instead of model
+    # instances. The field list, nesting and formatting are read off the real serializer once,
+    # so the rendered JSON is byte for byte what the serializer would produce, without building
+    # a model instance and running every field object for every row.
+    #
+    # select() gives a narrower twin for ?fields= / ?expand=: only the columns of the fields
+    # asked for are read, and a relation that isn't expanded is rendered as its pk, read off the
+    # foreign key column without joining its table.
+    def __init__(self, serializer_class, fields=None, expand=None):
+        self.serializer_class = serializer_class
+        self.columns = []
+        self.plan = self.compile(serializer_class(), "", tree(fields), expand)
+        self.names, self.relations = self.allowed()
+        self.variants = {}
+
+    def compile(self, serializer, prefix, fields, expand):
+        # fields is {name: nested fields or None for all of them}, None for every field. expand
+        # is the set of relations to embed, None for all of them
+        plan = []
+        for name, field in serializer.fields.items():
+            if field.write_only or (fields is not None and name not in fields):
+                continue
+            if "." in field.source or field.source == "*":
+                raise ValueError(f"{name}: only plain model fields are supported")
+
+            if isinstance(field, serializers.BaseSerializer):
+                if expand is not None and name not in expand:
+                    # the foreign key column alone, no join
+                    self.columns.append(prefix + field.source)
+                    plan.append((name, prefix + field.source, None))
+                    continue
+                # nested serializer -> its columns come through the join, patient__firstname etc
+                nested = fields[name] if fields is not None else None
+                plan.append((name, None, self.compile(field, f"{prefix}{field.source}__", nested, None)))
+            else:
+                column = prefix + field.source
+                self.columns.append(column)
+                convert = None if isinstance(field, PASSTHROUGH_FIELDS) else field.to_representation
+                plan.append((name, column, convert))
+        return plan
+
+    def allowed(self):
+        # what ?fields= takes (every field, and "relation.field" for the nested ones) and what
+        # ?expand= takes (the nested ones)
+        names, relations = set(), set()
+        for name, field in self.serializer_class().fields.items():
+            if field.write_only:
+                continue
+            names.add(name)
+            if isinstance(field, serializers.BaseSerializer):
+                relations.add(name)
+                names.update(f"{name}.{nested}" for nested, inner in field.fields.items() if not inner.write_only)
+        return names, relations
+
+    def select(self, fields=None, expand=None):
+        # fields and expand are frozensets (None for all). Compiled once per combination, there
+        # are few in use, and past MAX_VARIANTS the odd ones are compiled per request
+        if fields is None and expand is None:
+            return self
+        key = (fields, expand)
+        variant = self.variants.get(key)
+        if variant is None:
+            variant = FastRowSerializer(self.serializer_class, fields, expand)
+            if len(self.variants) < MAX_VARIANTS:
+                self.variants[key] = variant
+        return variant
+
+    def build(self, plan, row):
+        data = {}
+        for name, column, convert in plan:
+            if column is None:
+                data[name] = self.build(convert, row)
+                continue
+            value = row[column]
+            # same as Serializer.to_representation, None skips the field's formatting
+            data[name] = value if convert is None or value is None else convert(value)
+        return data
+
+    def to_representation(self, row):
+        return self.build(self.plan, row)
+
+    def serialize(self, rows):
+        return [self.build(self.plan, row) for row in rows]
+
+    def pick(self, data):
+        # narrows a payload rendered in full (the cached doctor entries) to this twin's fields
+        return {name: data[name] for name, column, convert in self.plan}
+
+    def values(self, queryset, *extra):
+        # extra columns are read without being rendered, the keyset pagination needs its ordering
+        return queryset.values(*dict.fromkeys((*self.columns, *extra)))
+
+
+patient_rows = FastRowSerializer(PatientPublicSerializer)
+doctor_rows = FastRowSerializer(DoctorPublicSerializer)
+mapping_rows = FastRowSerializer(MappingsDetailSerializer)
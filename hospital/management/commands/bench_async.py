@@ -0,0 +1,75 @@
+import asyncio
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient
+
+from hospital.benchmarks import BENCH_PASSWORD, BenchmarkContext, isolated_database, percentile, seed_dataset
+
+# read endpoints that exist both as DRF views (/api/...) and as native async views (/api/async/...)
+ROUTES = {
+    "patients-list": lambda ctx: "patients/",
+    "patient-detail": lambda ctx: f"patients/{ctx.patient.id}/",
+    "doctors-list": lambda ctx: "doctors/",
+    "doctor-detail": lambda ctx: f"doctors/{ctx.doctor.id}/",
+    "mappings-list": lambda ctx: "mappings/",
+    "mapping-detail": lambda ctx: f"mappings/{ctx.patient.id}/",
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Fires concurrent requests through Django's ASGI handler at the sync DRF views and at their "
+        "native async counterparts under /api/async/, and reports throughput and latency for each."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--patients", type=int, default=1000)
+        parser.add_argument("--doctors", type=int, default=200)
+        parser.add_argument("--mappings-per-patient", type=int, default=3)
+        parser.add_argument("--requests", type=int, default=200, help="requests per route and concurrency level")
+        parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50, 100])
+        parser.add_argument("--routes", nargs="+", choices=sorted(ROUTES), default=list(ROUTES))
+        parser.add_argument("--keepdb", action="store_true", help="keep the test database around between runs")
+
+    def handle(self, *args, **options):
+        with isolated_database(keepdb=options["keepdb"]):
+            owner = seed_dataset(options["patients"], options["doctors"], options["mappings_per_patient"])
+            ctx = BenchmarkContext(owner)
+            cache.clear()
+
+            self.stdout.write(f"{'route':<16} {'conc':>5} {'sync req/s':>11} {'async req/s':>12} {'sync p95':>9} {'async p95':>10}")
+            asyncio.run(self.run(ctx, options))
+
+    async def run(self, ctx, options):
+        client = AsyncClient()
+        response = await client.post("/api/auth/login/", {"username": ctx.owner.username, "password": BENCH_PASSWORD}, content_type="application/json")
+        headers = {"Authorization": f"Bearer {response.json()['access']}"}
+
+        for name in options["routes"]:
+            path = ROUTES[name](ctx)
+            for concurrency in options["concurrency"]:
+                sync = await self.measure(client, f"/api/{path}", headers, options["requests"], concurrency)
+                native = await self.measure(client, f"/api/async/{path}", headers, options["requests"], concurrency)
+                self.stdout.write(
+                    f"{name:<16} {concurrency:>5} {sync['rps']:>11.1f} {native['rps']:>12.1f} "
+                    f"{sync['p95_ms']:>9.2f} {native['p95_ms']:>10.2f}"
+                )
+
+    async def measure(self, client, url, headers, requests, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+
+        async def one():
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.get(url, headers=headers)
+                latencies.append((time.perf_counter() - start) * 1000)
+                if response.status_code >= 400:
+                    raise RuntimeError(f"GET {url} returned {response.status_code}")
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(requests)))
+        elapsed = time.perf_counter() - start
+        return {"rps": requests / elapsed, "p95_ms": percentile(latencies, 95)}
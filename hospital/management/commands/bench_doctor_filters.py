@@ -0,0 +1,59 @@
+import re
+import statistics
+import time
+from urllib.parse import urlencode
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from rest_framework.test import APIClient
+
+from hospital.benchmarks import DOCTOR_FILTER_CASES, doctor_filter_page, isolated_database, percentile
+from hospital.datagen import DataGenerator
+
+
+class Command(BaseCommand):
+    help = (
+        "Generates a doctor directory in a throwaway test database and times the filtered doctor "
+        "listing for the common filter combinations, printing the plan each query gets."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--doctors", type=int, default=1000000)
+        parser.add_argument("--iterations", type=int, default=50, help="timed requests per filter combination")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--keepdb", action="store_true", help="keep the test database around between runs")
+
+    def handle(self, *args, **options):
+        with isolated_database(keepdb=options["keepdb"]):
+            if options["doctors"]:
+                generator = DataGenerator(seed=options["seed"], prefix=f"bench{options['seed']}", batch_size=20000, log=self.stdout.write)
+                generator.doctors(options["doctors"])
+            if connection.vendor == "postgresql":
+                # fresh statistics, or the planner guesses row counts for an empty table
+                with connection.cursor() as cursor:
+                    cursor.execute("ANALYZE hospital_doctor")
+
+            client = APIClient()
+            self.stdout.write(f"{'filters':<25} {'p50 ms':>8} {'p95 ms':>8}  plan")
+            for name, params in DOCTOR_FILTER_CASES.items():
+                latencies = []
+                for _ in range(options["iterations"]):
+                    # every request has to reach the db, not the doctor cache
+                    cache.clear()
+                    start = time.perf_counter()
+                    response = client.get(f"/api/doctors/?{urlencode(params)}")
+                    latencies.append((time.perf_counter() - start) * 1000)
+                    assert response.status_code == 200, response.content
+
+                self.stdout.write(
+                    f"{name:<25} {statistics.median(latencies):>8.2f} {percentile(latencies, 95):>8.2f}  "
+                    f"{self.plan_summary(doctor_filter_page(params))}"
+                )
+
+    def plan_summary(self, queryset):
+        # the scan nodes are what matter here, e.g. "Index Scan using doctor_spec_id_idx"
+        plan = queryset.explain()
+        # (sqlite prefixes its plan lines with node ids, PostgreSQL appends costs)
+        scans = [re.sub(r"^[\d ]+", "", line.strip(" ->")) for line in plan.splitlines() if "Scan" in line or "SCAN" in line]
+        return "; ".join(scan.split("  (cost")[0] for scan in scans) or plan.splitlines()[0]
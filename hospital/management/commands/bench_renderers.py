@@ -0,0 +1,52 @@
+import gzip
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from hospital import renderers
+from hospital.benchmarks import best_of, isolated_database, seed_dataset
+from hospital.fastpath import mapping_rows
+from hospital.models import PatientDoctorMapping
+from hospital.pagination import KeysetPagination
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds a throwaway test database and compares encode time and body size of the response "
+        "renderers (DRF's JSONRenderer, the orjson one, MessagePack) on a large mappings list page"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=10000, help="mappings in the page")
+        parser.add_argument("--repeat", type=int, default=5, help="runs per renderer, the best one counts")
+        parser.add_argument("--keepdb", action="store_true", help="keep the test database around between runs")
+
+    def handle(self, *args, **options):
+        with isolated_database(keepdb=options["keepdb"]):
+            # one mapping per patient, so the page has --rows rows
+            owner = seed_dataset(options["rows"], options["rows"], 1)
+            # what mappings_list hands to the renderer, as one page
+            page = list(mapping_rows.values(PatientDoctorMapping.objects.filter(patient__created_by=owner)).order_by("assigned_at", "id"))
+            data = KeysetPagination().get_paginated_data(mapping_rows.serialize(page))
+        self.run(data, options["rows"], options["repeat"])
+
+    def run(self, data, rows, repeat):
+        cases = [("drf json", JSONRenderer())]
+        cases.append(("orjson" if renderers.orjson is not None else "json (no orjson)", renderers.FastJSONRenderer()))
+        if renderers.msgpack is not None:
+            cases.append(("msgpack", renderers.MessagePackRenderer()))
+        else:
+            self.stdout.write("msgpack isn't installed, skipping MessagePack")
+
+        results = [(name, renderer, *best_of(repeat, lambda: renderer.render(data))) for name, renderer in cases]
+        _, _, baseline_time, baseline = results[0]
+
+        self.stdout.write(f"{'renderer':<18} {'encode ms':>10} {'rows/s':>12} {'speedup':>8} {'bytes':>11} {'gzip bytes':>11} {'size':>6}")
+        for name, renderer, elapsed, body in results:
+            if isinstance(renderer, renderers.FastJSONRenderer) and body != baseline:
+                self.stderr.write(self.style.ERROR(f"{name}: output differs from JSONRenderer"))
+
+            self.stdout.write(
+                f"{name:<18} {elapsed * 1000:>10.1f} {rows / elapsed:>12,.0f} {baseline_time / elapsed:>7.1f}x "
+                f"{len(body):>11,} {len(gzip.compress(body)):>11,} {len(body) / len(baseline):>6.0%}"
+            )
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from hospital.benchmarks import best_of, isolated_database, seed_dataset
+from hospital.fastpath import patient_rows, doctor_rows, mapping_rows
+from hospital.models import Patient, Doctor, PatientDoctorMapping
+from hospital.serializers import PatientPublicSerializer, DoctorPublicSerializer, MappingsDetailSerializer
+
+
+class Command(BaseCommand):
+    help = "Seeds a throwaway test database and compares rows/sec of the ModelSerializer and .values() fast path list output"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=10000, help="rows per table")
+        parser.add_argument("--repeat", type=int, default=5, help="runs per case, the best one counts")
+        parser.add_argument("--keepdb", action="store_true", help="keep the test database around between runs")
+
+    def handle(self, *args, **options):
+        with isolated_database(keepdb=options["keepdb"]):
+            # one mapping per patient, so every table has --rows rows
+            owner = seed_dataset(options["rows"], options["rows"], 1)
+            self.run(owner, options["rows"], options["repeat"])
+
+    def run(self, owner, rows, repeat):
+        renderer = JSONRenderer()
+        cases = [
+            ("patients", PatientPublicSerializer, patient_rows, Patient.objects.filter(created_by=owner)),
+            ("doctors", DoctorPublicSerializer, doctor_rows, Doctor.objects.all()),
+            ("mappings", MappingsDetailSerializer, mapping_rows, PatientDoctorMapping.objects.select_related("patient", "doctor")),
+        ]
+
+        self.stdout.write(f"{'endpoint':<10} {'serializer rows/s':>18} {'fast path rows/s':>18} {'speedup':>8}")
+        for name, serializer_class, fast, queryset in cases:
+            queryset = queryset.order_by("id")
+
+            # query + serialize + render, the work a list endpoint does per page
+            slow_time, slow = best_of(repeat, lambda: renderer.render(serializer_class(queryset, many=True).data))
+            fast_time, quick = best_of(repeat, lambda: renderer.render(fast.serialize(fast.values(queryset))))
+            if slow != quick:
+                self.stderr.write(self.style.ERROR(f"{name}: fast path output differs from {serializer_class.__name__}"))
+
+            self.stdout.write(
+                f"{name:<10} {rows / slow_time:>18,.0f} {rows / fast_time:>18,.0f} {slow_time / fast_time:>7.1f}x"
+            )
@@ -0,0 +1,72 @@
+import json
+import platform
+from datetime import datetime, timezone
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+
+from hospital.benchmarks import ROUTES, isolated_database, seed_dataset, run_benchmarks, compare_results
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds a throwaway test database and measures every API route: p50/p95/p99 latency, "
+        "queries per request and peak allocations. Optionally fails on regressions against a baseline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--patients", type=int, default=1000)
+        parser.add_argument("--doctors", type=int, default=200)
+        parser.add_argument("--mappings-per-patient", type=int, default=3)
+        parser.add_argument("--iterations", type=int, default=50, help="timed requests per route")
+        parser.add_argument("--alloc-iterations", type=int, default=5, help="requests per route traced with tracemalloc")
+        parser.add_argument("--routes", nargs="+", choices=sorted(ROUTES), default=list(ROUTES), help="only run these routes")
+        parser.add_argument("--output", help="write the results as JSON to this file")
+        parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+        parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown before it counts as a regression, 0.2 = 20%%")
+        parser.add_argument("--keepdb", action="store_true", help="keep the test database around between runs")
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options["baseline"]:
+            with open(options["baseline"]) as f:
+                baseline = json.load(f)["routes"]
+
+        with isolated_database(keepdb=options["keepdb"]):
+            owner = seed_dataset(options["patients"], options["doctors"], options["mappings_per_patient"])
+
+            self.stdout.write(f"{'route':<18} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'queries':>8} {'alloc KiB':>10}")
+            results = run_benchmarks(
+                owner, options["routes"], options["iterations"], options["alloc_iterations"],
+                on_route=self.write_route,
+            )
+
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump({
+                    "meta": {
+                        "created_at": datetime.now(timezone.utc).isoformat(),
+                        "django": django.get_version(),
+                        "python": platform.python_version(),
+                        "patients": options["patients"],
+                        "doctors": options["doctors"],
+                        "mappings_per_patient": options["mappings_per_patient"],
+                        "iterations": options["iterations"],
+                    },
+                    "routes": results,
+                }, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+        if baseline is not None:
+            regressions = compare_results(results, baseline, options["tolerance"])
+            if regressions:
+                for regression in regressions:
+                    self.stderr.write(self.style.ERROR(regression))
+                raise CommandError(f"{len(regressions)} regression(s) against {options['baseline']}")
+            self.stdout.write(self.style.SUCCESS("No regressions against the baseline"))
+
+    def write_route(self, name, result):
+        self.stdout.write(
+            f"{name:<18} {result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} {result['p99_ms']:>9.2f} "
+            f"{result['queries']:>8} {result['peak_alloc_kib']:>10}"
+        )
@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from hospital.availability import refresh_upcoming
+from hospital.cache import invalidate_doctor_list, invalidate_mapping_list, invalidate_patient_list
+from hospital.stats import reconcile
+from hospital.datagen import DataGenerator
+
+
+class Command(BaseCommand):
+    help = (
+        "Fills the database with synthetic users, doctors, patients and mappings. The same --seed "
+        "always gives the same data. Uses COPY on PostgreSQL and batched bulk_create elsewhere."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100)
+        parser.add_argument("--doctors", type=int, default=1000)
+        parser.add_argument("--patients", type=int, default=10000)
+        parser.add_argument("--mappings-per-patient", type=int, default=3, help="average doctors per patient")
+        parser.add_argument("--owner-skew", type=float, default=1.0, help="zipf exponent for how patients spread over users, 0 = evenly")
+        parser.add_argument("--doctor-skew", type=float, default=1.0, help="zipf exponent for how patients spread over doctors, 0 = evenly")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--prefix", help="prefix for usernames and emails, defaults to gen<seed>. Pick a new one to add a second dataset")
+        parser.add_argument("--password", default="password123", help="password of every generated user")
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--method", choices=["auto", "copy", "bulk"], default="auto")
+
+    def handle(self, *args, **options):
+        generator = DataGenerator(
+            seed=options["seed"],
+            prefix=options["prefix"],
+            batch_size=options["batch_size"],
+            method=options["method"],
+            log=self.stdout.write,
+        )
+        try:
+            generator.check_prefix()
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        if options["users"] < 1 and options["patients"]:
+            raise CommandError("Patients need at least one user to own them")
+
+        user_ids = generator.users(options["users"], options["password"])
+        doctor_ids = generator.doctors(options["doctors"])
+        patient_ids = generator.patients(options["patients"], user_ids, options["owner_skew"])
+        generator.mappings(patient_ids, doctor_ids, options["mappings_per_patient"], options["doctor_skew"])
+
+        # the inserts skipped the model signals, so the cached doctor pages (and the mappings and
+        # patients list ETags) are stale now. None of it is in the change feed either, clients download
+        # the lists again and sync from since=latest
+        invalidate_doctor_list()
+        invalidate_mapping_list()
+        for user_id in user_ids:
+            invalidate_patient_list(user_id)
+        # the roster counters too, recomputed from scratch
+        fixed = reconcile()
+        self.stdout.write(f"Roster counters updated: {fixed}")
+        # and the availability of dates already materialized, which wouldn't list the new doctors.
+        # Those dates read off the bookings until materialize_availability runs again
+        refresh_upcoming()
+        self.stdout.write(self.style.SUCCESS(f"Generated dataset {generator.prefix!r}"))
@@ -0,0 +1,31 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from hospital.availability import materialize_day, refresh_upcoming
+
+
+class Command(BaseCommand):
+    help = (
+        "Fills in the availability rows from today to the end of the booking horizon, so availability "
+        "queries read them off the index. Run it daily to keep the window moving. With --refresh, "
+        "also re-syncs every doctor's upcoming rows, e.g. after doctors were bulk imported or edited "
+        "with queryset.update()."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=None, help="how many days from today (default: through BOOKING_HORIZON_DAYS)")
+        parser.add_argument("--refresh", action="store_true")
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        days = options["days"] if options["days"] is not None else settings.BOOKING_HORIZON_DAYS + 1
+        if options["refresh"]:
+            refresh_upcoming()
+
+        created = 0
+        for n in range(days):
+            created += materialize_day(today + datetime.timedelta(days=n))
+        self.stdout.write(self.style.SUCCESS(f"{created} day(s) materialized, {days - created} already were"))
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from hospital.changes import prune
+
+
+class Command(BaseCommand):
+    help = (
+        "Removes change feed entries older than CHANGES_RETENTION_DAYS. Clients whose cursor "
+        "is older than what's left get a 410 and download the lists again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=settings.CHANGES_RETENTION_DAYS)
+
+    def handle(self, *args, **options):
+        deleted = prune(options["days"])
+        self.stdout.write(self.style.SUCCESS(f"Removed {deleted} change(s) older than {options['days']} day(s)"))
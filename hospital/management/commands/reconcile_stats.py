@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from hospital.stats import reconcile
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes the roster counters (patients per doctor, doctors per patient, doctors per "
+        "specialization) from the mappings and fixes the ones that drifted, e.g. after raw SQL "
+        "or COPY imports that skipped the model signals."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="only report what drifted")
+
+    def handle(self, *args, **options):
+        fixed = reconcile(dry_run=options["dry_run"])
+        verb = "drifted" if options["dry_run"] else "fixed"
+        for counter, rows in fixed.items():
+            self.stdout.write(f"{counter}: {rows} {verb}")
+        self.stdout.write(self.style.SUCCESS(f"{sum(fixed.values())} counter(s) {verb}"))
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from hospital.benchmarks import isolated_database, seed_booking, run_booking_stress
+
+
+class Command(BaseCommand):
+    help = (
+        "Books appointments from many threads at once in a throwaway test database, every patient "
+        "trying every doctor on every day, then checks no doctor went over max_appointments_per_day."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--doctors", type=int, default=10)
+        parser.add_argument("--patients", type=int, default=200)
+        parser.add_argument("--capacity", type=int, default=20, help="max_appointments_per_day of every doctor")
+        parser.add_argument("--days", type=int, default=3)
+        parser.add_argument("--threads", type=int, default=16)
+        parser.add_argument("--keepdb", action="store_true", help="keep the test database around between runs")
+
+    def handle(self, *args, **options):
+        if connection.vendor == "sqlite" and options["threads"] > 1:
+            # sqlite's shared in-memory test db fails concurrent writers with "table is locked"
+            # instead of queueing them, only the single threaded run means anything there
+            self.stderr.write(self.style.WARNING("SQLite can't take concurrent writers, running with 1 thread. Use PostgreSQL for the real test"))
+            options["threads"] = 1
+
+        with isolated_database(keepdb=options["keepdb"]):
+            mappings = seed_booking(options["doctors"], options["patients"], options["capacity"])
+            result = run_booking_stress(mappings, options["days"], options["threads"])
+
+        self.stdout.write(
+            f"{result['attempts']:,} attempts from {options['threads']} threads: {result['attempts_per_s']:,} /s, "
+            f"p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms"
+        )
+        self.stdout.write(", ".join(f"{outcome} {count:,}" for outcome, count in sorted(result["outcomes"].items())))
+
+        expected = options["doctors"] * options["days"] * min(options["capacity"], options["patients"])
+        booked = result["outcomes"].get("booked", 0)
+        if booked != expected:
+            result["violations"].append(f"{booked:,} bookings went through, expected {expected:,}")
+        if result["violations"]:
+            for violation in result["violations"]:
+                self.stderr.write(self.style.ERROR(violation))
+            raise CommandError(f"{len(result['violations'])} violation(s)")
+        self.stdout.write(self.style.SUCCESS(f"No overbooking, {booked:,} appointments as expected"))
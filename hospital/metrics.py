@@ -0,0 +1,172 @@
+import hmac
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from rest_framework.permissions import BasePermission
+
+# Per-request timings (total, db, auth, serialize) sent back in a Server-Timing header and
+# folded into per-route histograms, rendered in the Prometheus text format by the metrics
+# endpoint. Everything is kept in memory per worker process: recording a request is a few
+# perf_counter() calls and one short lock, there's no I/O on the request path.
+
+# the timings of the request being handled, None outside of RequestMetricsMiddleware
+current_timings = ContextVar("current_timings", default=None)
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class RequestTimings:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.db = 0.0
+        self.queries = 0
+        self.auth = 0.0
+        self.serialize = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        # installed with connection.execute_wrapper, sees every query on every alias
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += time.perf_counter() - start
+            self.queries += 1
+
+    def server_timing(self, total):
+        # durations in milliseconds. auth includes the user lookup of stateful JWT auth, which
+        # is counted under db as well
+        return (
+            f'total;dur={total * 1000:.2f}, '
+            f'db;dur={self.db * 1000:.2f};desc="{self.queries} queries", '
+            f'auth;dur={self.auth * 1000:.2f}, '
+            f'serialize;dur={self.serialize * 1000:.2f}'
+        )
+
+
+@contextmanager
+def track_queries(timings):
+    with ExitStack() as stack:
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(timings))
+        yield
+
+
+def tracking(timings):
+    # track_queries, entered now and left with .close(). An async request's queries run on its
+    # sync thread, on connections of that thread: this is entered and closed there through
+    # sync_to_async, around the awaited response
+    stack = ExitStack()
+    stack.enter_context(track_queries(timings))
+    return stack
+
+
+@contextmanager
+def timed(component):
+    # adds the block's duration to `component` of the current request, if there is one
+    timings = current_timings.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            setattr(timings, component, getattr(timings, component) + time.perf_counter() - start)
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Histogram:
+    def __init__(self, name, documentation, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        # labels -> [count per bucket (the last one is +Inf), sum, count]
+        self.series = {}
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self, label_names):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in sorted(self.series.items()):
+            base = ",".join(f'{name}="{escape(value)}"' for name, value in zip(label_names, labels))
+            cumulative = 0
+            for bound, bucket in zip((*self.buckets, "+Inf"), counts):
+                cumulative += bucket
+                lines.append(f'{self.name}_bucket{{{base},le="{bound}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{base}}} {total}")
+            lines.append(f"{self.name}_count{{{base}}} {count}")
+        return lines
+
+
+class RequestMetrics:
+    LABELS = ("route", "method")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {
+                "total": Histogram("http_request_duration_seconds", "Time spent handling the request.", SECONDS_BUCKETS),
+                "db": Histogram("http_request_db_seconds", "Time spent running database queries.", SECONDS_BUCKETS),
+                "queries": Histogram("http_request_db_queries", "Database queries run per request.", QUERY_BUCKETS),
+                "auth": Histogram("http_request_auth_seconds", "Time spent authenticating the request.", SECONDS_BUCKETS),
+                "serialize": Histogram("http_request_serialize_seconds", "Time spent rendering the response body.", SECONDS_BUCKETS),
+            }
+            self.responses = {}
+
+    def record(self, route, method, status_code, timings, total):
+        labels = (route, method)
+        with self.lock:
+            self.histograms["total"].observe(labels, total)
+            self.histograms["db"].observe(labels, timings.db)
+            self.histograms["queries"].observe(labels, timings.queries)
+            self.histograms["auth"].observe(labels, timings.auth)
+            self.histograms["serialize"].observe(labels, timings.serialize)
+            key = (route, method, str(status_code))
+            self.responses[key] = self.responses.get(key, 0) + 1
+
+    def render(self):
+        with self.lock:
+            lines = [
+                "# HELP http_responses_total Responses sent, by route, method and status code.",
+                "# TYPE http_responses_total counter",
+            ]
+            for (route, method, code), count in sorted(self.responses.items()):
+                lines.append(f'http_responses_total{{route="{escape(route)}",method="{method}",status="{code}"}} {count}')
+            for histogram in self.histograms.values():
+                lines.extend(histogram.render(self.LABELS))
+        return "\n".join(lines) + "\n"
+
+
+request_metrics = RequestMetrics()
+
+
+def route_of(request):
+    # the url pattern, not the path, so ids don't turn into a label value each
+    match = getattr(request, "resolver_match", None)
+    return match.route if match is not None else "unmatched"
+
+
+class HasMetricsToken(BasePermission):
+    # lets a scraper in with "Authorization: Metrics <METRICS_TOKEN>", a scheme the JWT
+    # authentication ignores
+    def has_permission(self, request, view):
+        if not settings.METRICS_TOKEN:
+            return False
+        header = request.META.get("HTTP_AUTHORIZATION", "")
+        return hmac.compare_digest(header.encode(), f"Metrics {settings.METRICS_TOKEN}".encode())
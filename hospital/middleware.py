@@ -0,0 +1,193 @@
+import hashlib
+import time
+
+from asgiref.sync import async_to_sync, iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import OperationalError, connections
+
+from .profiling import aprofile_request, profile_reason, profile_request, slots
+from .metrics import RequestTimings, current_timings, request_metrics, route_of, track_queries, tracking
+from .routers import replica_reads, replica_health
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+KNOWN_METHODS = ("GET", "HEAD", "OPTIONS", "POST", "PUT", "PATCH", "DELETE")
+
+
+def pin_key(request):
+    # clients are told apart by their bearer token, anonymous ones by address
+    client = request.META.get("HTTP_AUTHORIZATION") or request.META.get("REMOTE_ADDR", "")
+    return f"db:pinned:{hashlib.sha256(client.encode()).hexdigest()}"
+
+
+class ReplicaRoutingMiddleware:
+    # Lets safe-method requests read from the replicas (see routers.PrimaryReplicaRouter).
+    # A client that just wrote something is pinned to the primary for REPLICA_PIN_SECONDS so it
+    # reads its own writes. The pin lives in Django's cache, so with more than one worker that
+    # has to be a shared backend.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # under ASGI the async views run on the event loop, stay async so they aren't pushed
+        # onto a thread
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+
+        if request.method not in SAFE_METHODS:
+            response = self.get_response(request)
+            cache.set(pin_key(request), True, timeout=settings.REPLICA_PIN_SECONDS)
+            return response
+
+        if cache.get(pin_key(request)):
+            return self.get_response(request)
+
+        token = replica_reads.set(set())
+        try:
+            return self.get_response(request)
+        finally:
+            replica_reads.reset(token)
+
+    async def __acall__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return await self.get_response(request)
+
+        if request.method not in SAFE_METHODS:
+            response = await self.get_response(request)
+            await cache.aset(pin_key(request), True, timeout=settings.REPLICA_PIN_SECONDS)
+            return response
+
+        if await cache.aget(pin_key(request)):
+            return await self.get_response(request)
+
+        token = replica_reads.set(set())
+        try:
+            return await self.get_response(request)
+        finally:
+            replica_reads.reset(token)
+
+    def process_exception(self, request, exception):
+        # a replica went away mid-request: take it out of rotation and run the (safe) request
+        # again against the primary instead of failing it
+        used = replica_reads.get()
+        if not used or not isinstance(exception, OperationalError):
+            return None
+
+        for alias in used:
+            replica_health.mark_down(alias)
+            connections[alias].close()
+        replica_reads.set(None)
+        if self.async_mode:
+            # Django runs this hook in a thread for async middleware
+            return async_to_sync(self.get_response)(request)
+        return self.get_response(request)
+
+
+class RequestMetricsMiddleware:
+    # Times every request (see hospital.metrics) and reports it in a Server-Timing header and the
+    # /api/metrics/ histograms. Registered first so the total covers the other middleware too.
+    # Streaming responses (the exports) are timed up to their first byte only.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        try:
+            with track_queries(timings):
+                response = self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        return self.record(request, response, timings)
+
+    async def __acall__(self, request):
+        if not settings.METRICS_ENABLED:
+            return await self.get_response(request)
+
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        try:
+            queries = await sync_to_async(tracking)(timings)
+            try:
+                response = await self.get_response(request)
+            finally:
+                await sync_to_async(queries.close)()
+        finally:
+            current_timings.reset(token)
+        return self.record(request, response, timings)
+
+    def record(self, request, response, timings):
+        total = time.perf_counter() - timings.start
+        if settings.SERVER_TIMING:
+            response["Server-Timing"] = timings.server_timing(total)
+        # arbitrary methods would each become a label value
+        method = request.method if request.method in KNOWN_METHODS else "other"
+        request_metrics.record(route_of(request), method, response.status_code, timings, total)
+        return response
+
+    def process_template_response(self, request, response):
+        # runs right before a DRF Response gets rendered, the callback right after it was
+        timings = current_timings.get()
+        if timings is not None:
+            start = time.perf_counter()
+
+            def rendered(response):
+                timings.serialize += time.perf_counter() - start
+
+            response.add_post_render_callback(rendered)
+        return response
+
+
+class ProfilingMiddleware:
+    # Profiles the requests picked by hospital.profiling (an X-Profile token or the sampling
+    # switch), as long as a profiling slot is free in this process. Everything else goes through
+    # untouched.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        reason = profile_reason(request)
+        if reason is None or not slots.acquire():
+            return self.get_response(request)
+        try:
+            return profile_request(request, self.get_response, reason)
+        finally:
+            slots.release()
+
+    async def __acall__(self, request):
+        # profile_reason rereads the sampling switch from the cache every few seconds, that one
+        # blocking call is cheap enough to make on the loop
+        reason = profile_reason(request)
+        if reason is None or not slots.acquire():
+            return await self.get_response(request)
+        try:
+            return await aprofile_request(request, self.get_response, reason)
+        finally:
+            slots.release()
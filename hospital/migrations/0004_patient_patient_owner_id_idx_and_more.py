@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-18 17:08
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hospital', '0003_alter_patient_created_by'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['created_by', 'id'], name='patient_owner_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patientdoctormapping',
+            index=models.Index(fields=['assigned_at', 'id'], name='mapping_assigned_id_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.6 on 2026-10-18 17:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hospital', '0004_patient_patient_owner_id_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='doctor',
+            index=models.Index(fields=['specialization', 'id'], name='doctor_spec_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='doctor',
+            index=models.Index(fields=['specialization', 'gender', 'id'], name='doctor_spec_gender_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='doctor',
+            index=models.Index(fields=['gender', 'id'], name='doctor_gender_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='doctor',
+            index=models.Index(fields=['max_appointments_per_day', 'id'], name='doctor_capacity_id_idx'),
+        ),
+    ]
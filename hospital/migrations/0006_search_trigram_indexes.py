@@ -0,0 +1,34 @@
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+import hospital.operations
+
+# trigram GIN indexes behind the name/email search. They're PostgreSQL only, so they live here as
+# raw SQL instead of in the models' Meta: that way other backends never try to rebuild them
+TRIGRAM_INDEXES = [
+    ("hospital_patient", "firstname", "patient_firstname_trgm_idx"),
+    ("hospital_patient", "lastname", "patient_lastname_trgm_idx"),
+    ("hospital_patient", "email", "patient_email_trgm_idx"),
+    ("hospital_doctor", "firstname", "doctor_firstname_trgm_idx"),
+    ("hospital_doctor", "lastname", "doctor_lastname_trgm_idx"),
+    ("hospital_doctor", "email", "doctor_email_trgm_idx"),
+]
+
+
+class Migration(migrations.Migration):
+    # built concurrently so big tables stay writable meanwhile, which can't happen in a transaction
+    atomic = False
+
+    dependencies = [
+        ('hospital', '0005_doctor_filter_indexes'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+    ] + [
+        hospital.operations.PostgresOnly(migrations.RunSQL(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} USING gin ({column} gin_trgm_ops)",
+            reverse_sql=f"DROP INDEX CONCURRENTLY IF EXISTS {name}",
+        ))
+        for table, column, name in TRIGRAM_INDEXES
+    ]
@@ -0,0 +1,51 @@
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery
+
+
+def fill_availability(apps, schema_editor):
+    # counters booked before this migration get their doctor's specialization and what's left
+    Doctor = apps.get_model("hospital", "Doctor")
+    DoctorDayBookings = apps.get_model("hospital", "DoctorDayBookings")
+    doctor = Doctor.objects.filter(pk=OuterRef("doctor_id"))
+    DoctorDayBookings.objects.update(
+        specialization=Subquery(doctor.values("specialization")),
+        remaining=Subquery(doctor.values("max_appointments_per_day")) - F("booked"),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hospital', '0007_appointments'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AvailabilityDay',
+            fields=[
+                ('date', models.DateField(primary_key=True, serialize=False)),
+                ('materialized_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='doctordaybookings',
+            name='specialization',
+            field=models.CharField(choices=[('CARD', 'Cardiologist'), ('DERM', 'Dermatologist'), ('NEUR', 'Neurologist'), ('ORTH', 'Orthopedic'), ('PED', 'Pediatrician'), ('GEN', 'General Physician')], default='', max_length=4),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='doctordaybookings',
+            name='remaining',
+            field=models.IntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_availability, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='doctordaybookings',
+            index=models.Index(fields=['date', 'specialization', '-remaining', 'doctor'], name='availability_spec_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='doctordaybookings',
+            index=models.Index(fields=['date', '-remaining', 'doctor'], name='availability_idx'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    # same as hospital.stats.reconcile, against the historical models
+    Patient = apps.get_model("hospital", "Patient")
+    Doctor = apps.get_model("hospital", "Doctor")
+    PatientDoctorMapping = apps.get_model("hospital", "PatientDoctorMapping")
+    SpecializationStats = apps.get_model("hospital", "SpecializationStats")
+
+    for model, field, related_field in ((Doctor, "patient_count", "doctor"), (Patient, "doctor_count", "patient")):
+        mappings = (
+            PatientDoctorMapping.objects.filter(**{related_field: OuterRef("pk")})
+            .order_by().values(related_field).annotate(n=Count("*")).values("n")
+        )
+        model.objects.update(**{field: Coalesce(Subquery(mappings), Value(0))})
+
+    counts = dict(Doctor.objects.order_by().values_list("specialization").annotate(n=Count("*")))
+    codes = [code for code, _ in Doctor._meta.get_field("specialization").choices]
+    SpecializationStats.objects.bulk_create([
+        SpecializationStats(specialization=code, doctors=counts.get(code, 0))
+        for code in sorted(set(codes) | set(counts))
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hospital', '0009_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='doctor',
+            name='patient_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='doctor_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name='SpecializationStats',
+            fields=[
+                ('specialization', models.CharField(choices=[('CARD', 'Cardiologist'), ('DERM', 'Dermatologist'), ('NEUR', 'Neurologist'), ('ORTH', 'Orthopedic'), ('PED', 'Pediatrician'), ('GEN', 'General Physician')], max_length=4, primary_key=True, serialize=False)),
+                ('doctors', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, router, transaction
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.utils import timezone
 from django.contrib.auth.models import User
@@ -8,7 +8,16 @@ GENDER_CHOICES = [
     ("F", "Female"),
 ]
 
-class Patient(models.Model):
+class AtomicSave:
+    # runs save() and the post_save receivers in one transaction, so the counters they keep
+    # (hospital.stats) and the change log entries commit or roll back together with the row
+    def save(self, *args, **kwargs):
+        using = kwargs.get("using") or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            super().save(*args, **kwargs)
+
+
+class Patient(AtomicSave, models.Model):
     firstname = models.CharField(max_length=64, help_text="Enter the patient's first name")
     lastname = models.CharField(max_length=64, help_text="Enter the patient's last name")
     email = models.EmailField(max_length=128, unique=True, help_text="Enter the patient's email address")
@@ -16,11 +25,24 @@ class Patient(models.Model):
     gender = models.CharField(max_length=1, choices=GENDER_CHOICES, help_text="Select the patient's gender")
 
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name="patients")
+    # bumped by every save (bulk_create too, queryset.update() doesn't), the ETag/Last-Modified
+    # of the API responses are derived from it
+    updated_at = models.DateTimeField(auto_now=True)
+    # assigned doctors, kept by hospital.stats
+    doctor_count = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            # backs the keyset pagination of a user's patients (WHERE created_by = ? AND id > ?)
+            models.Index(fields=["created_by", "id"], name="patient_owner_id_idx"),
+        ]
+        # the name/email search also has trigram GIN indexes on PostgreSQL, created with raw
+        # SQL in migration 0006 so they never end up in the schema of other backends
 
     def __str__(self):
         return f"{self.firstname} {self.lastname}"
 
-class Doctor(models.Model):
+class Doctor(AtomicSave, models.Model):
     SPECIALIZATION_CHOICES = [
         ('CARD', 'Cardiologist'),
         ('DERM', 'Dermatologist'),
@@ -36,17 +58,134 @@ class Doctor(models.Model):
     email = models.EmailField(max_length=128, unique=True, help_text="Enter the doctor's email address")
     gender = models.CharField(max_length=1, choices=GENDER_CHOICES, help_text="Select the doctor's gender")
     specialization = models.CharField(max_length=4, choices=SPECIALIZATION_CHOICES, help_text="Select the doctor's specialization")
+    updated_at = models.DateTimeField(auto_now=True)
+    # assigned patients, kept by hospital.stats
+    patient_count = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            # back the filters of the doctor listing, each ending in id so a filtered page is
+            # read straight off the index in keyset order (WHERE ... AND id > ? ORDER BY id)
+            models.Index(fields=["specialization", "id"], name="doctor_spec_id_idx"),
+            models.Index(fields=["specialization", "gender", "id"], name="doctor_spec_gender_id_idx"),
+            models.Index(fields=["gender", "id"], name="doctor_gender_id_idx"),
+            models.Index(fields=["max_appointments_per_day", "id"], name="doctor_capacity_id_idx"),
+        ]
+        # plus trigram GIN indexes for the search on PostgreSQL, see Patient.Meta
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # what the row looked like when loaded, so the signals can tell what a save changed
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
 
     def __str__(self):
         return f"{self.firstname} {self.lastname} ({self.specialization})"
 
-class PatientDoctorMapping(models.Model):
+class PatientDoctorMapping(AtomicSave, models.Model):
     patient = models.ForeignKey("Patient", on_delete=models.CASCADE, related_name="doctor_mappings")
     doctor = models.ForeignKey("Doctor", on_delete=models.CASCADE, related_name="patient_mappings")
     assigned_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         unique_together = ("patient", "doctor")
+        indexes = [
+            models.Index(fields=["assigned_at", "id"], name="mapping_assigned_id_idx"),
+        ]
     
     def __str__(self):
-        return f"{self.patient} -> {self.doctor} ({self.assigned_at.date()})"
\ No newline at end of file
+        return f"{self.patient} -> {self.doctor} ({self.assigned_at.date()})"
+
+
+class Appointment(models.Model):
+    # a booked day with one of the patient's assigned doctors, at most one per mapping per day.
+    # doctor is copied from the mapping so a day's bookings can be counted and released without a join
+    mapping = models.ForeignKey("PatientDoctorMapping", on_delete=models.CASCADE, related_name="appointments")
+    doctor = models.ForeignKey("Doctor", on_delete=models.CASCADE, related_name="appointments")
+    date = models.DateField(help_text="Day of the appointment")
+    booked_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ("mapping", "date")
+        indexes = [
+            models.Index(fields=["doctor", "date"], name="appointment_doctor_date_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.mapping.patient} with {self.doctor} on {self.date}"
+
+class DoctorDayBookings(models.Model):
+    # How many appointments a doctor has on a day, and how many slots are left. Booking takes a
+    # slot with a conditional UPDATE (remaining > 0), so concurrent bookings for the same doctor
+    # and day queue on this one row lock and nothing else gets locked.
+    #
+    # It doubles as the availability index: specialization is copied from the doctor so "which
+    # cardiologists have slots on X" is one index range scan. Once a date is in AvailabilityDay
+    # every doctor has a row for it. Kept in step by hospital.booking and hospital.availability
+    doctor = models.ForeignKey("Doctor", on_delete=models.CASCADE, related_name="day_bookings")
+    date = models.DateField()
+    specialization = models.CharField(max_length=4, choices=Doctor.SPECIALIZATION_CHOICES)
+    booked = models.PositiveIntegerField(default=0)
+    # max_appointments_per_day - booked, below 0 if the cap was lowered under what's booked
+    remaining = models.IntegerField()
+
+    class Meta:
+        unique_together = ("doctor", "date")
+        indexes = [
+            models.Index(fields=["date", "specialization", "-remaining", "doctor"], name="availability_spec_idx"),
+            models.Index(fields=["date", "-remaining", "doctor"], name="availability_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.doctor} on {self.date}: {self.booked} booked, {self.remaining} left"
+
+class AvailabilityDay(models.Model):
+    # dates for which every doctor has a DoctorDayBookings row, see hospital.availability
+    date = models.DateField(primary_key=True)
+    materialized_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.date}"
+
+class SpecializationStats(models.Model):
+    # doctors per specialization code, one row per code, kept by hospital.stats
+    specialization = models.CharField(max_length=4, primary_key=True, choices=Doctor.SPECIALIZATION_CHOICES)
+    doctors = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.specialization}: {self.doctors}"
+
+class ChangeLog(models.Model):
+    # one row per insert, update or delete of a patient, doctor or mapping, written in the
+    # transaction of the write. The id is the cursor of the change feed, see hospital.changes
+    INSERT, UPDATE, DELETE = "insert", "update", "delete"
+    MODEL_CHOICES = [
+        ("patient", "Patient"),
+        ("doctor", "Doctor"),
+        ("mapping", "Patient-doctor mapping"),
+    ]
+    OP_CHOICES = [
+        (INSERT, "Insert"),
+        (UPDATE, "Update"),
+        (DELETE, "Delete"),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    model = models.CharField(max_length=8, choices=MODEL_CHOICES)
+    object_id = models.BigIntegerField()
+    op = models.CharField(max_length=6, choices=OP_CHOICES)
+    # the user whose patient (or patient's mapping) changed, NULL for doctors, which everyone
+    # sees. Not a foreign key: the entries outlive the user and the rows they point to
+    owner = models.IntegerField(null=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # WHERE (owner = ? OR owner IS NULL) AND id > ? ORDER BY id, one range scan per branch
+            models.Index(fields=["owner", "id"], name="changelog_owner_id_idx"),
+        ]
+
+    def __str__(self):
+        return f"#{self.id} {self.op} {self.model} {self.object_id}"
@@ -0,0 +1,116 @@
+import base64
+import binascii
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    # Pages by seeking past the last row of the previous page (WHERE key > last ORDER BY key)
+    # instead of OFFSET, so every page costs the same no matter how deep the client goes.
+    # The ordering has to end in a unique column (id) so the position is never ambiguous.
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    invalid_cursor_message = "Invalid cursor"
+
+    def __init__(self, ordering=("id",)):
+        self.ordering = tuple(ordering)
+        self.next_position = None
+
+    def get_query_params(self, request):
+        # DRF requests have query_params, the plain Django requests of the async views only GET
+        return getattr(request, "query_params", request.GET)
+
+    def get_page_size(self, request):
+        page_size = settings.PAGE_SIZE
+        try:
+            page_size = int(self.get_query_params(request)[self.page_size_query_param])
+        except (KeyError, ValueError):
+            pass
+        return max(1, min(page_size, settings.MAX_PAGE_SIZE))
+
+    def get_page_queryset(self, queryset, request):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+
+        position = self.decode_cursor(request, queryset.model)
+        queryset = queryset.order_by(*self.ordering)
+        if position is not None:
+            queryset = queryset.filter(self.seek_filter(position))
+
+        # fetching one extra row tells us whether there is a next page without a COUNT(*)
+        return queryset[:self.page_size + 1]
+
+    def get_page(self, rows):
+        if len(rows) > self.page_size:
+            rows = rows[:self.page_size]
+            self.next_position = [self.get_value(rows[-1], field) for field in self.ordering]
+        return rows
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.get_page(list(self.get_page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request):
+        return self.get_page([row async for row in self.get_page_queryset(queryset, request)])
+
+    def seek_filter(self, position):
+        # (a, b) > (x, y)  ->  a > x OR (a = x AND b > y)
+        condition = Q()
+        for i, field in enumerate(self.ordering):
+            equal = {self.ordering[j]: position[j] for j in range(i)}
+            condition |= Q(**equal, **{f"{field}__gt": position[i]})
+        return condition
+
+    def get_value(self, row, field):
+        # rows are model instances, or dicts when the queryset went through .values()
+        if isinstance(row, dict):
+            return row[field]
+        return getattr(row, field)
+
+    def encode_cursor(self, position):
+        values = [value.isoformat() if hasattr(value, "isoformat") else value for value in position]
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def decode_cursor(self, request, model):
+        encoded = self.get_query_params(request).get(self.cursor_query_param)
+        if not encoded:
+            return None
+
+        try:
+            values = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            if not isinstance(values, list) or len(values) != len(self.ordering):
+                raise ValueError
+            # running the values through the model fields (and their range validators) so a bad
+            # cursor is a 404, not a 500. None would pass to_python, the ordering columns aren't null
+            position = []
+            for field, value in zip(self.ordering, values):
+                if value is None:
+                    raise ValueError
+                field = model._meta.get_field(field)
+                value = field.to_python(value)
+                field.run_validators(value)
+                position.append(value)
+            return position
+        except (binascii.Error, ValueError, TypeError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_paginated_data(self, data):
+        return {
+            "next": self.get_next_link(),
+            "results": data,
+        }
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
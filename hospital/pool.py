@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.db import connections
+
+
+def pool_stats(alias):
+    # psycopg_pool counters are cumulative since the pool opened, and per worker process
+    connection = connections[alias]
+    pool = getattr(connection, "pool", None)
+    if pool is None:
+        return {
+            "pooled": False,
+            "conn_max_age": connection.settings_dict["CONN_MAX_AGE"],
+        }
+
+    stats = pool.get_stats()
+    checkouts = stats.get("requests_num", 0)
+    in_use = stats.get("pool_size", 0) - stats.get("pool_available", 0)
+    return {
+        "pooled": True,
+        "min_size": stats.get("pool_min"),
+        "max_size": stats.get("pool_max"),
+        "size": stats.get("pool_size", 0),
+        "available": stats.get("pool_available", 0),
+        "in_use": in_use,
+        # share of max_size handed out right now, near 1 means requests are about to queue
+        "saturation": round(in_use / stats["pool_max"], 3) if stats.get("pool_max") else None,
+        "waiting": stats.get("requests_waiting", 0),
+        "checkouts": checkouts,
+        "queued_checkouts": stats.get("requests_queued", 0),
+        "checkout_errors": stats.get("requests_errors", 0),
+        "wait_ms_total": stats.get("requests_wait_ms", 0),
+        "wait_ms_avg": round(stats.get("requests_wait_ms", 0) / checkouts, 3) if checkouts else None,
+        "usage_ms_total": stats.get("usage_ms", 0),
+        "connections_opened": stats.get("connections_num", 0),
+        "connection_errors": stats.get("connections_errors", 0),
+        "connections_lost": stats.get("connections_lost", 0),
+        "bad_returns": stats.get("returns_bad", 0),
+    }
+
+
+def all_pool_stats():
+    return {alias: pool_stats(alias) for alias in settings.DATABASES}
@@ -0,0 +1,294 @@
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+
+from .metrics import track_queries, tracking
+
+# On-demand sampling profiler for live requests. A profiled request gets a sampler thread that
+# reads the request thread's stack every PROFILE_INTERVAL_MS and counts the stacks it sees,
+# while an execute_wrapper records the SQL it runs. The result is written as JSON to
+# PROFILE_DIR on the worker's host, newest PROFILE_MAX_FILES kept.
+#
+# A request is profiled when it carries a valid X-Profile token (handed out to staff by
+# /api/profiles/token/), or when staff switched on sampling of a fraction of the requests under
+# a path prefix. Requests that aren't profiled pay a header lookup and, while sampling is on,
+# one random() call. At most PROFILE_MAX_CONCURRENT requests per process are profiled at once,
+# and none for longer than PROFILE_MAX_SECONDS.
+
+PROFILE_HEADER = "HTTP_X_PROFILE"
+SAMPLING_KEY = "profiling:sampling"
+TOKEN_SALT = "hospital.profiling"
+PROFILE_ID = re.compile(r"^[0-9]{8}T[0-9]{6}-[0-9a-f]{8}$")
+
+
+# ----- Triggers -----
+
+def make_token(user_id):
+    return signing.TimestampSigner(salt=TOKEN_SALT).sign(str(user_id))
+
+
+def token_user(token):
+    # the staff user who asked for the token, None if it's forged or expired
+    try:
+        return signing.TimestampSigner(salt=TOKEN_SALT).unsign(token, max_age=settings.PROFILE_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return None
+
+
+class SamplingSwitch:
+    # The sampling settings live in the cache so one request reaches every worker, and each
+    # worker rereads them at most every PROFILE_CONFIG_REFRESH seconds
+    def __init__(self):
+        self.config = None
+        self.read_at = None
+
+    def get(self):
+        now = time.monotonic()
+        if self.read_at is None or now - self.read_at >= settings.PROFILE_CONFIG_REFRESH:
+            self.config = cache.get(SAMPLING_KEY)
+            self.read_at = now
+        if self.config and self.config["until"] < time.time():
+            return None
+        return self.config
+
+    def set(self, rate, path, seconds):
+        config = {"rate": rate, "path": path, "until": time.time() + seconds}
+        cache.set(SAMPLING_KEY, config, timeout=seconds)
+        self.read_at = None
+        return config
+
+    def clear(self):
+        cache.delete(SAMPLING_KEY)
+        self.read_at = None
+
+
+sampling = SamplingSwitch()
+
+
+def profile_reason(request):
+    # why this request should be profiled, or None
+    token = request.META.get(PROFILE_HEADER)
+    if token:
+        user_id = token_user(token)
+        if user_id is not None:
+            return f"requested by user {user_id}"
+
+    config = sampling.get()
+    if config and request.path.startswith(config["path"]) and random.random() < config["rate"]:
+        return f"sampled at {config['rate']}"
+    return None
+
+
+class Slots:
+    # caps the profiles running at once in this process, a busy profiler skips requests
+    def __init__(self):
+        self.active = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            if self.active >= settings.PROFILE_MAX_CONCURRENT:
+                return False
+            self.active += 1
+            return True
+
+    def release(self):
+        with self.lock:
+            self.active -= 1
+
+
+slots = Slots()
+
+
+# ----- Profiling -----
+
+def frame_name(frame):
+    code = frame.f_code
+    filename = code.co_filename
+    if filename.startswith(str(settings.BASE_DIR)):
+        filename = os.path.relpath(filename, settings.BASE_DIR)
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+def fold(frame):
+    # "outermost;...;innermost", the collapsed format flamegraph.pl and speedscope read
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class Sampler(threading.Thread):
+    def __init__(self, thread_id):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.stacks = Counter()
+        self.samples = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        interval = settings.PROFILE_INTERVAL_MS / 1000
+        deadline = time.monotonic() + settings.PROFILE_MAX_SECONDS
+        while not self.stopped.wait(interval) and time.monotonic() < deadline:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            self.stacks[fold(frame)] += 1
+            self.samples += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+class QueryLog:
+    # the statements a profiled request runs, without their parameters (they carry patient data)
+    def __init__(self):
+        self.queries = []
+        self.dropped = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            if len(self.queries) < settings.PROFILE_MAX_QUERIES:
+                self.queries.append({
+                    "alias": context["connection"].alias,
+                    "sql": sql,
+                    "many": many,
+                    "ms": round((time.perf_counter() - start) * 1000, 3),
+                })
+            else:
+                self.dropped += 1
+
+
+def profile_request(request, get_response, reason):
+    sampler = Sampler(threading.get_ident())
+    queries = QueryLog()
+    started_at = time.time()
+    start = time.perf_counter()
+
+    sampler.start()
+    try:
+        with track_queries(queries):
+            response = get_response(request)
+    finally:
+        sampler.stop()
+    return finish_profile(request, response, reason, sampler, queries, started_at, start)
+
+
+async def aprofile_request(request, get_response, reason):
+    # samples the event loop's thread, other requests awaiting on the same loop can turn up in
+    # the stacks
+    sampler = Sampler(threading.get_ident())
+    queries = QueryLog()
+    started_at = time.time()
+    start = time.perf_counter()
+
+    sampler.start()
+    try:
+        tracked = await sync_to_async(tracking)(queries)
+        try:
+            response = await get_response(request)
+        finally:
+            await sync_to_async(tracked.close)()
+    finally:
+        sampler.stop()
+    return await sync_to_async(finish_profile)(request, response, reason, sampler, queries, started_at, start)
+
+
+def finish_profile(request, response, reason, sampler, queries, started_at, start):
+    match = getattr(request, "resolver_match", None)
+    response["X-Profile-Id"] = save_profile({
+        "reason": reason,
+        "method": request.method,
+        "path": request.path,
+        "route": match.route if match is not None else None,
+        "status": response.status_code,
+        "started_at": started_at,
+        "duration_ms": round((time.perf_counter() - start) * 1000, 3),
+        "interval_ms": settings.PROFILE_INTERVAL_MS,
+        "samples": sampler.samples,
+        "stacks": dict(sampler.stacks.most_common()),
+        "queries": queries.queries,
+        "queries_dropped": queries.dropped,
+    })
+    return response
+
+
+# ----- Storage -----
+
+def profile_path(profile_id):
+    if not PROFILE_ID.match(profile_id):
+        return None
+    return os.path.join(settings.PROFILE_DIR, f"{profile_id}.json")
+
+
+def save_profile(profile):
+    os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+    profile["id"] = f"{time.strftime('%Y%m%dT%H%M%S', time.gmtime(profile['started_at']))}-{uuid.uuid4().hex[:8]}"
+
+    # written next to the target and renamed, so a listing never reads half a file
+    path = profile_path(profile["id"])
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(profile, f)
+    os.replace(f"{path}.tmp", path)
+
+    for stale in profile_files()[settings.PROFILE_MAX_FILES:]:
+        try:
+            os.remove(os.path.join(settings.PROFILE_DIR, stale))
+        except FileNotFoundError:
+            pass
+    return profile["id"]
+
+
+def profile_files():
+    # newest first, the ids start with their UTC timestamp
+    try:
+        names = os.listdir(settings.PROFILE_DIR)
+    except FileNotFoundError:
+        return []
+    return sorted((name for name in names if name.endswith(".json")), reverse=True)
+
+
+def list_profiles():
+    profiles = []
+    for name in profile_files():
+        try:
+            with open(os.path.join(settings.PROFILE_DIR, name)) as f:
+                profile = json.load(f)
+        except (FileNotFoundError, ValueError):
+            continue
+        profiles.append({
+            key: profile[key]
+            for key in ("id", "reason", "method", "path", "route", "status", "started_at", "duration_ms", "samples")
+        } | {"queries": len(profile["queries"]) + profile["queries_dropped"]})
+    return profiles
+
+
+def load_profile(profile_id):
+    path = profile_path(profile_id)
+    if path is None:
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def folded(profile):
+    return "".join(f"{stack} {count}\n" for stack, count in profile["stacks"].items())
@@ -0,0 +1,94 @@
+from django.utils.cache import patch_vary_headers
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser, JSONParser
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils import encoders
+
+# orjson and msgpack are optional. Without orjson the JSON classes run DRF's stdlib code, without
+# msgpack the MessagePack classes are left out of REST_FRAMEWORK (see settings.py).
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# what orjson can't take goes through DRF's encoder, so lazy strings get evaluated and Decimals
+# become floats the same way as with JSONRenderer
+drf_default = encoders.JSONEncoder().default
+
+
+class VaryOnAccept:
+    # the same url answers in more than one format, caches in between have to key on Accept
+    def vary(self, renderer_context):
+        response = (renderer_context or {}).get("response")
+        if response is not None:
+            patch_vary_headers(response, ("Accept",))
+
+
+class FastJSONRenderer(VaryOnAccept, JSONRenderer):
+    # Same bytes as DRF's JSONRenderer (compact, UTF-8, U+2028/2029 escaped), written by orjson.
+    # Datetimes are written by orjson too, OPT_UTC_Z gives them the trailing Z DRF's encoder
+    # does. Indented output (the browsable API, "application/json; indent=4") and anything orjson
+    # refuses, like ints over 64 bits, falls back to the stdlib encoder. One difference is left:
+    # NaN and Infinity come out as null where JSONRenderer (STRICT_JSON) raises, none of the
+    # API's fields hold a float that could be one.
+    OPTIONS = (
+        orjson.OPT_UTC_Z | orjson.OPT_PASSTHROUGH_DATACLASS | orjson.OPT_NON_STR_KEYS
+        if orjson is not None else 0
+    )
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        self.vary(renderer_context)
+        if data is None:
+            return b""
+        if orjson is None or self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(data, default=drf_default, option=self.OPTIONS)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        if b"\xe2\x80\xa8" in ret or b"\xe2\x80\xa9" in ret:
+            ret = ret.replace(b"\xe2\x80\xa8", b"\\u2028").replace(b"\xe2\x80\xa9", b"\\u2029")
+        return ret
+
+
+class FastJSONParser(JSONParser):
+    # orjson reads UTF-8 only, bodies in another charset go through the stdlib parser
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get("encoding", "utf-8")
+        if orjson is None or encoding.lower().replace("_", "-") not in ("utf-8", "utf8"):
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read() if stream is not None else b"")
+        except orjson.JSONDecodeError as exc:
+            raise ParseError(f"JSON parse error - {exc}")
+
+
+class MessagePackRenderer(VaryOnAccept, BaseRenderer):
+    # Accept: application/msgpack (or ?format=msgpack). Same data as the JSON, datetimes and
+    # decimals included: they're strings and numbers there too
+    media_type = "application/msgpack"
+    format = "msgpack"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        self.vary(renderer_context)
+        if data is None:
+            return b""
+        return msgpack.packb(data, default=drf_default, use_bin_type=True, datetime=False)
+
+
+class MessagePackParser(BaseParser):
+    media_type = "application/msgpack"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read() if stream is not None else b"", raw=False, strict_map_key=False)
+        except (ValueError, TypeError, msgpack.UnpackException) as exc:
+            raise ParseError(f"MessagePack parse error - {exc}")
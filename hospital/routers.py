@@ -0,0 +1,95 @@
+import itertools
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+# Set by ReplicaRoutingMiddleware while a request may read from the replicas: the set of
+# replica aliases it actually read from, so a failing one can be taken out of rotation.
+# None (outside requests, writes, pinned clients) means everything goes to the primary.
+replica_reads = ContextVar("replica_reads", default=None)
+
+
+class ReplicaHealth:
+    # Remembers per process whether each replica answered (and wasn't lagging too far behind)
+    # the last time it was checked, and rechecks it every REPLICA_HEALTH_CHECK_INTERVAL seconds.
+    # A replica that failed mid-request is marked down until its next check.
+    def __init__(self):
+        self.states = {}
+        self.lock = threading.Lock()
+
+    def is_healthy(self, alias):
+        now = time.monotonic()
+        with self.lock:
+            state = self.states.get(alias)
+        if state is not None and now - state[1] < settings.REPLICA_HEALTH_CHECK_INTERVAL:
+            return state[0]
+
+        healthy = self.check(alias)
+        with self.lock:
+            self.states[alias] = (healthy, now)
+        return healthy
+
+    def check(self, alias):
+        connection = connections[alias]
+        try:
+            connection.ensure_connection()
+            if connection.vendor == "postgresql" and settings.REPLICA_MAX_LAG_SECONDS:
+                with connection.cursor() as cursor:
+                    # a replica that has replayed everything it received isn't behind, however
+                    # old its last replayed transaction is (the primary may just be idle)
+                    cursor.execute(
+                        "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                        "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+                    )
+                    lag = cursor.fetchone()[0]
+                return lag <= settings.REPLICA_MAX_LAG_SECONDS
+        except DatabaseError:
+            connection.close()
+            return False
+        return True
+
+    def mark_down(self, alias):
+        with self.lock:
+            self.states[alias] = (False, time.monotonic())
+
+    def reset(self):
+        with self.lock:
+            self.states.clear()
+
+
+replica_health = ReplicaHealth()
+
+
+class PrimaryReplicaRouter:
+    # Reads go round robin to the healthy replicas while replica_reads is set, and fall back to
+    # the primary when none is healthy. Writes, migrations and reads inside a transaction on the
+    # primary (which may need to see its own uncommitted rows) always use default.
+    def __init__(self):
+        self.counter = itertools.count()
+
+    def db_for_read(self, model, **hints):
+        used = replica_reads.get()
+        replicas = settings.DATABASE_REPLICAS
+        if used is None or not replicas or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+
+        start = next(self.counter)
+        for i in range(len(replicas)):
+            alias = replicas[(start + i) % len(replicas)]
+            if replica_health.is_healthy(alias):
+                used.add(alias)
+                return alias
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
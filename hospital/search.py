@@ -0,0 +1,57 @@
+from functools import reduce
+from operator import add, or_
+
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.db import connection
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.db.models.functions import Greatest
+
+# Name/email search for the front desk. Every word of the query has to match one of the fields,
+# results are ranked by how well they matched and cut at `limit`.
+#
+# On PostgreSQL a word matches when it's trigram-similar to part of a field (word_similarity,
+# so typos still hit), which the gin_trgm_ops indexes on those fields answer without a scan.
+# Elsewhere it's a case-insensitive substring match, ranked exact > prefix > substring.
+
+SEARCH_FIELDS = ("firstname", "lastname", "email")
+
+
+def search_terms(query):
+    return query.split()[:5]
+
+
+def trigram_search(queryset, terms, fields):
+    for term in terms:
+        queryset = queryset.filter(reduce(or_, (Q(**{f"{field}__trigram_word_similar": term}) for field in fields)))
+    rank = reduce(add, (
+        Greatest(*(TrigramWordSimilarity(term, field) for field in fields)) for term in terms
+    ))
+    return queryset.annotate(rank=rank)
+
+
+def substring_search(queryset, terms, fields):
+    def matches(lookup, term):
+        return reduce(or_, (Q(**{f"{field}__{lookup}": term}) for field in fields))
+
+    for term in terms:
+        queryset = queryset.filter(matches("icontains", term))
+    rank = reduce(add, (
+        Case(
+            When(matches("iexact", term), then=Value(3)),
+            When(matches("istartswith", term), then=Value(2)),
+            default=Value(1),
+            output_field=IntegerField(),
+        )
+        for term in terms
+    ))
+    return queryset.annotate(rank=rank)
+
+
+def search(queryset, query, limit, fields=SEARCH_FIELDS):
+    terms = search_terms(query)
+    if connection.vendor == "postgresql":
+        queryset = trigram_search(queryset, terms, fields)
+    else:
+        queryset = substring_search(queryset, terms, fields)
+    # id breaks ties so equally good matches come back in a stable order
+    return queryset.order_by("-rank", "id")[:limit]
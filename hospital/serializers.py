@@ -1,6 +1,10 @@
 from rest_framework import serializers
-from .models import Patient, Doctor, PatientDoctorMapping
+from .models import Patient, Doctor, PatientDoctorMapping, Appointment, GENDER_CHOICES
 from django.contrib.auth.models import User
+from django.conf import settings
+from django.utils import timezone
+from datetime import timedelta
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 
 # ----- Patient Serializers -----
 class PatientSerializer(serializers.ModelSerializer):
@@ -18,6 +22,12 @@ class PatientCreateSerializer(serializers.ModelSerializer):
         model = Patient
         fields = ["firstname", "lastname", "age", "gender", "email"]
 
+class PatientBulkCreateSerializer(PatientCreateSerializer):
+    # same rules as PatientCreateSerializer minus the email UniqueValidator, which would run one
+    # query per row. The bulk import checks the whole batch's emails in a single query instead
+    class Meta(PatientCreateSerializer.Meta):
+        extra_kwargs = {"email": {"validators": []}}
+
 class PatientUpdateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Patient
@@ -44,6 +54,18 @@ class RegisterSerializer(serializers.ModelSerializer):
         return user
 
 
+# Login, puts the claims CachedStatelessJWTAuthentication trusts into the token
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token["username"] = user.username
+        token["is_active"] = user.is_active
+        token["is_staff"] = user.is_staff
+        token["is_superuser"] = user.is_superuser
+        return token
+
+
 # ----- Doctor Serializers -----
 class DoctorSerializer(serializers.ModelSerializer):
     class Meta:
@@ -65,6 +87,135 @@ class DoctorUpdateSerializer(serializers.ModelSerializer):
         model = Doctor
         fields = ["firstname", "lastname", "specialization", "email"]
 
+class DoctorFilterSerializer(serializers.Serializer):
+    # query parameters of the doctor listing, every one optional. specialization takes one code
+    # or a comma separated list, min/max_capacity bound max_appointments_per_day
+    specialization = serializers.CharField(required=False)
+    gender = serializers.ChoiceField(choices=GENDER_CHOICES, required=False)
+    min_capacity = serializers.IntegerField(required=False, min_value=0)
+    max_capacity = serializers.IntegerField(required=False, min_value=0)
+
+    def validate_specialization(self, value):
+        codes = [code.strip() for code in value.split(",") if code.strip()]
+        valid = [code for code, _ in Doctor.SPECIALIZATION_CHOICES]
+        unknown = [code for code in codes if code not in valid]
+        if not codes or unknown:
+            raise serializers.ValidationError(f"Unknown specialization, pick from {', '.join(valid)}")
+        return sorted(set(codes))
+
+    def validate(self, data):
+        if "min_capacity" in data and "max_capacity" in data and data["min_capacity"] > data["max_capacity"]:
+            raise serializers.ValidationError("min_capacity can't be greater than max_capacity")
+        return data
+
+    def filter_queryset(self, queryset):
+        # each of these lines up with an index on Doctor, see the model's Meta
+        data = self.validated_data
+        if "specialization" in data:
+            codes = data["specialization"]
+            queryset = queryset.filter(specialization=codes[0]) if len(codes) == 1 else queryset.filter(specialization__in=codes)
+        if "gender" in data:
+            queryset = queryset.filter(gender=data["gender"])
+        if "min_capacity" in data:
+            queryset = queryset.filter(max_appointments_per_day__gte=data["min_capacity"])
+        if "max_capacity" in data:
+            queryset = queryset.filter(max_appointments_per_day__lte=data["max_capacity"])
+        return queryset
+
+
+def within_horizon(date):
+    # bookings open BOOKING_HORIZON_DAYS ahead, the availability rows don't go further either
+    if date > timezone.localdate() + timedelta(days=settings.BOOKING_HORIZON_DAYS):
+        raise serializers.ValidationError(f"Bookings open at most {settings.BOOKING_HORIZON_DAYS} days ahead")
+    return date
+
+
+class AvailabilityQuerySerializer(serializers.Serializer):
+    # query parameters of the availability endpoint, limit defaults to PAGE_SIZE
+    date = serializers.DateField()
+    specialization = serializers.ChoiceField(choices=Doctor.SPECIALIZATION_CHOICES, required=False)
+    limit = serializers.IntegerField(required=False, min_value=1)
+
+    def validate_date(self, value):
+        if value < timezone.localdate():
+            raise serializers.ValidationError("Availability is only kept for today onwards")
+        return within_horizon(value)
+
+    def validate_limit(self, value):
+        return min(value, settings.MAX_PAGE_SIZE)
+
+
+# ----- Search Serializers -----
+class SearchQuerySerializer(serializers.Serializer):
+    # ?q= of the search endpoints, ?limit= defaults to SEARCH_LIMIT
+    q = serializers.CharField(min_length=2, max_length=100)
+    limit = serializers.IntegerField(required=False, min_value=1)
+
+    def validate_limit(self, value):
+        return min(value, settings.SEARCH_MAX_LIMIT)
+
+
+class BatchQuerySerializer(serializers.Serializer):
+    # ?ids=3,1,2 of the batch lookups, duplicates dropped, order kept
+    ids = serializers.CharField()
+
+    def validate_ids(self, value):
+        try:
+            ids = list(dict.fromkeys(int(part) for part in value.split(",") if part.strip()))
+        except ValueError:
+            raise serializers.ValidationError("Expected comma separated ids.")
+        if not ids:
+            raise serializers.ValidationError("Expected at least one id.")
+        # past a bigint they'd blow up in the query, below 1 they can't match anything
+        if any(not 1 <= pk <= 2 ** 63 - 1 for pk in ids):
+            raise serializers.ValidationError("Ids have to be between 1 and 2**63-1.")
+        if len(ids) > settings.BATCH_MAX_IDS:
+            raise serializers.ValidationError(f"At most {settings.BATCH_MAX_IDS} ids per request.")
+        return ids
+
+
+class SparseFieldsSerializer(serializers.Serializer):
+    # ?fields=id,doctor.lastname and ?expand=doctor of the read endpoints, checked against the
+    # fast path serializer in context["rows"]. validated_data["rows"] is its narrowed twin
+    fields = serializers.CharField(required=False)
+    expand = serializers.CharField(required=False, allow_blank=True)
+
+    def split(self, value):
+        return frozenset(name.strip() for name in value.split(",") if name.strip())
+
+    def validate(self, attrs):
+        rows = self.context["rows"]
+        fields = expand = None
+        if "fields" in attrs:
+            fields = self.split(attrs["fields"])
+            unknown = fields - rows.names
+            if unknown or not fields:
+                raise serializers.ValidationError({"fields": f"Expected some of: {', '.join(sorted(rows.names))}."})
+        if "expand" in attrs:
+            expand = self.split(attrs["expand"])
+            if expand - rows.relations:
+                raise serializers.ValidationError({"expand": f"Expected some of: {', '.join(sorted(rows.relations)) or 'nothing'}."})
+            # asking for some fields of a relation means embedding it
+            expand |= {name.partition(".")[0] for name in fields or () if "." in name}
+        return {"rows": rows.select(fields, expand)}
+
+
+class ChangesQuerySerializer(serializers.Serializer):
+    # ?since= is the cursor handed out with the last page ("latest" for the current head, 0 for
+    # everything), ?limit= defaults to CHANGES_LIMIT
+    since = serializers.CharField(required=False, default="0")
+    limit = serializers.IntegerField(required=False, min_value=1)
+
+    def validate_since(self, value):
+        if value == "latest":
+            return value
+        if not value.isdigit():
+            raise serializers.ValidationError("Expected a cursor or 'latest'.")
+        return int(value)
+
+    def validate_limit(self, value):
+        return min(value, settings.CHANGES_MAX_LIMIT)
+
 
 # ----- Mappings Serializers -----
 class MappingsSerializer(serializers.ModelSerializer):
@@ -83,4 +234,68 @@ class MappingsDetailSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = PatientDoctorMapping
-        fields = ["id", "patient", "doctor", "assigned_at"]
\ No newline at end of file
+        fields = ["id", "patient", "doctor", "assigned_at"]
+
+class MappingPairSerializer(serializers.Serializer):
+    patient = serializers.IntegerField()
+    doctor = serializers.IntegerField()
+
+class MappingsBulkSerializer(serializers.Serializer):
+    # either explicit pairs, or every patient in patient_ids paired with every doctor in doctor_ids
+    pairs = MappingPairSerializer(many=True, required=False)
+    patient_ids = serializers.ListField(child=serializers.IntegerField(), required=False)
+    doctor_ids = serializers.ListField(child=serializers.IntegerField(), required=False)
+
+    def validate(self, data):
+        pairs = {(pair["patient"], pair["doctor"]) for pair in data.get("pairs", [])}
+
+        if "patient_ids" in data or "doctor_ids" in data:
+            if "patient_ids" not in data or "doctor_ids" not in data:
+                raise serializers.ValidationError("patient_ids and doctor_ids have to be sent together")
+            patient_ids, doctor_ids = set(data["patient_ids"]), set(data["doctor_ids"])
+            # sized up before it's expanded, a huge cross product never gets built
+            if len(patient_ids) * len(doctor_ids) > settings.BULK_MAX_PAIRS:
+                raise serializers.ValidationError(f"At most {settings.BULK_MAX_PAIRS} pairs per request")
+            pairs.update((patient_id, doctor_id) for patient_id in patient_ids for doctor_id in doctor_ids)
+
+        if not pairs:
+            raise serializers.ValidationError("Send pairs, or patient_ids and doctor_ids")
+        if len(pairs) > settings.BULK_MAX_PAIRS:
+            raise serializers.ValidationError(f"At most {settings.BULK_MAX_PAIRS} pairs per request")
+        return {"pairs": pairs}
+
+
+# ----- Appointment Serializers -----
+class AppointmentSerializer(serializers.ModelSerializer):
+    patient = serializers.IntegerField(source="mapping.patient_id", read_only=True)
+
+    class Meta:
+        model = Appointment
+        fields = ["id", "patient", "doctor", "date", "booked_at"]
+
+class AppointmentCreateSerializer(serializers.Serializer):
+    # the doctor has to be assigned to the patient already, the view looks the mapping up
+    patient = serializers.IntegerField()
+    doctor = serializers.IntegerField()
+    date = serializers.DateField()
+
+    def validate_date(self, value):
+        if value < timezone.localdate():
+            raise serializers.ValidationError("Can't book a day in the past")
+        return within_horizon(value)
+
+
+# ----- Profiling Serializers -----
+class ProfileSamplingSerializer(serializers.Serializer):
+    # switches on profiling of a fraction of the requests under a path, for a while
+    rate = serializers.FloatField(min_value=0, max_value=1)
+    path = serializers.CharField(default="/api/")
+    seconds = serializers.IntegerField(default=300, min_value=1)
+
+    def validate_path(self, value):
+        if not value.startswith("/"):
+            raise serializers.ValidationError("Must be a path prefix starting with /")
+        return value
+
+    def validate_seconds(self, value):
+        return min(value, settings.PROFILE_MAX_SAMPLING_SECONDS)
@@ -0,0 +1,134 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import availability, changes, stats
+from .authentication import revoke_user_tokens
+from .booking import release
+from .cache import invalidate_doctor, invalidate_mapping_list, invalidate_patient_list
+from .models import Patient, Doctor, PatientDoctorMapping, Appointment
+
+
+# covers DoctorCreateSerializer/DoctorUpdateSerializer (they end in Doctor.save) and Doctor.delete,
+# including doctors removed by a cascade. Bulk writes and queryset.update() skip these signals,
+# whoever does one of those has to call invalidate_doctor/invalidate_doctor_list themselves.
+# The versions are bumped again when the transaction commits (see hospital.cache).
+@receiver(post_save, sender=Doctor)
+@receiver(post_delete, sender=Doctor)
+def doctor_changed(sender, instance, **kwargs):
+    invalidate_doctor(instance.pk)
+    invalidate_mapping_list()
+
+
+# the mappings list embeds patients and doctors, so its ETag version moves with any of them.
+# assign_doctors and generate_data bump it themselves after their bulk inserts
+@receiver(post_save, sender=Patient)
+@receiver(post_delete, sender=Patient)
+@receiver(post_save, sender=PatientDoctorMapping)
+@receiver(post_delete, sender=PatientDoctorMapping)
+def mapping_list_changed(sender, instance, **kwargs):
+    invalidate_mapping_list()
+
+
+# the version behind the owner's patients list ETag, the bulk import bumps it itself
+@receiver(post_save, sender=Patient)
+@receiver(post_delete, sender=Patient)
+def patient_list_changed(sender, instance, **kwargs):
+    invalidate_patient_list(instance.created_by_id)
+
+
+# keeps the doctor's upcoming availability rows in step. Updates only cost a query when the
+# specialization or the cap changed (compared to the values loaded by Doctor.from_db)
+@receiver(post_save, sender=Doctor)
+def doctor_saved(sender, instance, created, **kwargs):
+    if created:
+        availability.doctor_added(instance)
+        stats.specialization_changed(None, instance.specialization)
+        instance._loaded_values = {"specialization": instance.specialization, "max_appointments_per_day": instance.max_appointments_per_day}
+        return
+
+    loaded = getattr(instance, "_loaded_values", None) or {}
+    current = {"specialization": instance.specialization, "max_appointments_per_day": instance.max_appointments_per_day}
+    if any(loaded.get(field) != value for field, value in current.items()):
+        availability.doctor_changed(instance)
+        # the specialization counts move along too (the same doctors per code otherwise)
+        if "specialization" in loaded:
+            stats.specialization_changed(loaded["specialization"], instance.specialization)
+        instance._loaded_values = {**loaded, **current}
+
+
+@receiver(post_delete, sender=Doctor)
+def doctor_deleted(sender, instance, **kwargs):
+    loaded = getattr(instance, "_loaded_values", None) or {}
+    stats.specialization_changed(loaded.get("specialization", instance.specialization), None)
+
+
+# roster counters (hospital.stats). PatientDoctorMapping.save is atomic, so the increment commits
+# with the row, and deletes (cascades included) run in the Collector's transaction
+@receiver(post_save, sender=PatientDoctorMapping)
+def mapping_saved(sender, instance, created, **kwargs):
+    if created:
+        stats.mappings_added([(instance.patient_id, instance.doctor_id)])
+
+
+@receiver(pre_delete, sender=PatientDoctorMapping)
+def mapping_deleting(sender, instance, origin=None, **kwargs):
+    stats.mapping_deleting(origin, instance)
+
+
+@receiver(post_delete, sender=PatientDoctorMapping)
+def mapping_deleted(sender, instance, origin=None, **kwargs):
+    stats.mapping_deleted(origin, instance)
+
+
+# change feed (hospital.changes). Every save of the three models is atomic, so the entry commits
+# with the row. Registered last, so the entry is the last write of the transaction
+@receiver(post_save, sender=Patient)
+@receiver(post_save, sender=Doctor)
+@receiver(post_save, sender=PatientDoctorMapping)
+def change_saved(sender, instance, created, **kwargs):
+    changes.log_saved(instance, created)
+
+
+@receiver(pre_delete, sender=Patient)
+@receiver(pre_delete, sender=Doctor)
+@receiver(pre_delete, sender=PatientDoctorMapping)
+def change_deleting(sender, instance, origin=None, **kwargs):
+    changes.deleting(origin, instance)
+
+
+@receiver(post_delete, sender=Patient)
+@receiver(post_delete, sender=Doctor)
+@receiver(post_delete, sender=PatientDoctorMapping)
+def change_deleted(sender, instance, origin=None, **kwargs):
+    changes.deleted(origin, instance)
+
+
+# stateless JWT auth never reloads the user, so tokens of a user who got deactivated, lost
+# staff or superuser rights (the tokens carry them as claims) or changed their password have to
+# be revoked explicitly
+REVOKING_FLAGS = ("is_active", "is_staff", "is_superuser")
+
+
+@receiver(pre_save, sender=User)
+def user_changing(sender, instance, **kwargs):
+    if instance.pk is None:
+        return
+    previous = User.objects.filter(pk=instance.pk).values("password", *REVOKING_FLAGS).first()
+    if previous and (
+        previous["password"] != instance.password
+        or any(previous[flag] and not getattr(instance, flag) for flag in REVOKING_FLAGS)
+    ):
+        revoke_user_tokens(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    revoke_user_tokens(instance.pk)
+
+
+# gives the slot back to the doctor's day, also when the appointment goes with its mapping,
+# patient or doctor. queryset.delete() sends this too, queryset.update() can't delete anything
+@receiver(post_delete, sender=Appointment)
+def appointment_deleted(sender, instance, **kwargs):
+    release(instance.doctor_id, instance.date)
@@ -0,0 +1,119 @@
+import threading
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Patient, Doctor, PatientDoctorMapping, SpecializationStats
+
+# Roster counters kept next to the data they count: Doctor.patient_count, Patient.doctor_count
+# and SpecializationStats.doctors. They're updated with relative UPDATEs (count = count + n) in
+# the same transaction as the write that changes them, from the signals in signals.py and from
+# the bulk paths, so reading them is a primary key lookup.
+#
+# Deletes are batched: Django sends pre_delete for every row a delete (and its cascades) is
+# about to remove before removing any, and post_delete after each. The mappings seen in
+# pre_delete are tallied, and once the last one's post_delete arrives the counts go down with
+# one UPDATE per distinct decrement, not one per mapping.
+#
+# Writes that skip the signals (raw SQL, COPY, queryset.update()) let the counters drift,
+# reconcile() recomputes them.
+
+pending = threading.local()
+
+
+def adjust(model, field, deltas):
+    # deltas is {pk: n}, rows getting the same n share an UPDATE. Never below 0, so rows whose
+    # count was never maintained (bulk inserts) don't trip the column's check constraint
+    by_delta = defaultdict(list)
+    for pk, delta in deltas.items():
+        if delta:
+            by_delta[delta].append(pk)
+    for delta, pks in by_delta.items():
+        model.objects.filter(pk__in=pks).update(**{field: Greatest(F(field) + delta, Value(0))})
+
+
+def mappings_added(pairs):
+    # pairs of (patient_id, doctor_id) that were just inserted
+    adjust(Doctor, "patient_count", Counter(doctor_id for _, doctor_id in pairs))
+    adjust(Patient, "doctor_count", Counter(patient_id for patient_id, _ in pairs))
+
+
+def mapping_deleting(origin, mapping):
+    state = getattr(pending, "state", None)
+    if state is None or state["origin"] is not origin:
+        # a new delete. A state left behind by a delete that failed half way is dropped here
+        state = pending.state = {"origin": origin, "remaining": 0, "pairs": []}
+    state["remaining"] += 1
+    state["pairs"].append((mapping.patient_id, mapping.doctor_id))
+
+
+def mapping_deleted(origin, mapping):
+    state = getattr(pending, "state", None)
+    if state is None or state["origin"] is not origin:
+        # deleted without a pre_delete (can't happen through Django's Collector), count it alone
+        pairs = [(mapping.patient_id, mapping.doctor_id)]
+    else:
+        state["remaining"] -= 1
+        if state["remaining"]:
+            return
+        pairs = state["pairs"]
+        pending.state = None
+
+    adjust(Doctor, "patient_count", {pk: -n for pk, n in Counter(doctor_id for _, doctor_id in pairs).items()})
+    adjust(Patient, "doctor_count", {pk: -n for pk, n in Counter(patient_id for patient_id, _ in pairs).items()})
+
+
+def specialization_changed(old, new):
+    # old None for a new doctor, new None for a deleted one
+    if old == new:
+        return
+    if old is not None:
+        SpecializationStats.objects.filter(specialization=old).update(doctors=Greatest(F("doctors") - 1, Value(0)))
+    if new is not None:
+        if not SpecializationStats.objects.filter(specialization=new).update(doctors=F("doctors") + 1):
+            # the row is seeded by the migration, this only runs if someone deleted it
+            SpecializationStats.objects.bulk_create([SpecializationStats(specialization=new)], ignore_conflicts=True)
+            SpecializationStats.objects.filter(specialization=new).update(doctors=F("doctors") + 1)
+
+
+def specialization_counts():
+    counts = {code: 0 for code, _ in Doctor.SPECIALIZATION_CHOICES}
+    counts.update(SpecializationStats.objects.values_list("specialization", "doctors"))
+    return counts
+
+
+# ----- Reconciling -----
+
+def counted(related_field):
+    # correlated COUNT(*) of the mappings pointing at the outer row, 0 when there are none
+    mappings = (
+        PatientDoctorMapping.objects.filter(**{related_field: OuterRef("pk")})
+        .order_by().values(related_field).annotate(n=Count("*")).values("n")
+    )
+    return Coalesce(Subquery(mappings), Value(0))
+
+
+def reconcile(dry_run=False):
+    # recomputes every counter from the mappings and fixes the ones that drifted, returns how
+    # many rows were (or with dry_run would be) fixed per counter
+    fixed = {}
+    with transaction.atomic():
+        for model, field, related_field in (
+            (Doctor, "patient_count", "doctor"),
+            (Patient, "doctor_count", "patient"),
+        ):
+            actual = counted(related_field)
+            drifted = model.objects.exclude(**{field: actual})
+            fixed[f"{model._meta.model_name}.{field}"] = drifted.count() if dry_run else drifted.update(**{field: actual})
+
+        actual = dict(Doctor.objects.order_by().values_list("specialization").annotate(n=Count("*")))
+        stored = dict(SpecializationStats.objects.values_list("specialization", "doctors"))
+        codes = {code for code, _ in Doctor.SPECIALIZATION_CHOICES} | set(actual) | set(stored)
+        drifted = [code for code in codes if actual.get(code, 0) != stored.get(code)]
+        fixed["specializations"] = len(drifted)
+        if not dry_run:
+            for code in drifted:
+                SpecializationStats.objects.update_or_create(specialization=code, defaults={"doctors": actual.get(code, 0)})
+    return fixed
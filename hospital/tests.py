@@ -1,10 +1,49 @@
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, RequestFactory, override_settings
+from unittest import mock, skipIf, skipUnless
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
+from django.db import models
 
-from rest_framework.test import APITestCase
-from .models import Patient
+from rest_framework.test import APITestCase, APIRequestFactory
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.tokens import AccessToken
+from datetime import timedelta
+from django.utils import timezone
+from .models import Patient, Doctor, PatientDoctorMapping, Appointment, DoctorDayBookings, AvailabilityDay, ChangeLog
+from .serializers import PatientPublicSerializer, DoctorPublicSerializer, MappingsDetailSerializer
+from .fastpath import patient_rows, doctor_rows, mapping_rows
+from .authentication import CachedStatelessJWTAuthentication, verified_tokens, revoke_token
+from .benchmarks import ROUTES, seed_dataset, run_benchmarks, compare_results, percentile, DOCTOR_FILTER_CASES, doctor_filter_page, seed_booking, run_booking_stress
+from .datagen import DataGenerator
+from .search import search
+from .booking import book
+from .availability import materialize_day, available_doctors
+from .stats import reconcile
+from .routers import PrimaryReplicaRouter, replica_reads, replica_health
+from .middleware import ReplicaRoutingMiddleware, RequestMetricsMiddleware, ProfilingMiddleware
+from .metrics import request_metrics
+from .renderers import FastJSONRenderer, FastJSONParser
+from .cache import doctor_detail_key, get_doctors_version
+from . import profiling
 from django.contrib.auth.models import User
 from django.urls import reverse
+import base64
+import datetime
+import csv
+import io
+import json
+import os
+import shutil
+import tempfile
+from django.db import connection, OperationalError
+from django.http import HttpResponse
+from django.test.utils import CaptureQueriesContext
+from django.core.cache import cache
+from django.core.management import call_command, CommandError
 from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.exceptions import ParseError
+from django.conf import settings
+from decimal import Decimal
 
 class AuthTests(APITestCase):
     def setUp(self):
@@ -125,6 +164,7 @@ class PatientTests(APITestCase):
 
 class DoctorTests(APITestCase):
     def setUp(self):
+        cache.clear()
         self.user = User.objects.create_user(username="testuser", password="password123")
         response = self.client.post("/api/auth/login/", {"username": "testuser", "password": "password123"})
         self.token = response.data["access"]
@@ -172,3 +212,2025 @@ class DoctorTests(APITestCase):
     def test_delete_doctor_notfound(self):
         response = self.client.delete("/api/doctors/999/")
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class PaginationTests(APITestCase):
+    def setUp(self):
+        # doctor pages are cached, and bulk_create doesn't invalidate them
+        cache.clear()
+        self.user = User.objects.create_user(username="testuser", password="password123")
+        response = self.client.post("/api/auth/login/", {"username": "testuser", "password": "password123"})
+        self.token = response.data["access"]
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.token}")
+
+        self.patients = Patient.objects.bulk_create([
+            Patient(firstname=f"Patient{i}", lastname="Test", email=f"patient{i}@gmail.com", age=30, gender="M", created_by=self.user)
+            for i in range(5)
+        ])
+        self.doctors = Doctor.objects.bulk_create([
+            Doctor(firstname=f"Doctor{i}", lastname="Test", email=f"doctor{i}@gmail.com", gender="F", specialization="GEN")
+            for i in range(5)
+        ])
+        for doctor in self.doctors:
+            PatientDoctorMapping.objects.create(patient=self.patients[0], doctor=doctor)
+
+    def collect_pages(self, url):
+        # follows the next links until the last page and returns every row seen
+        rows = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data["results"]), 2)
+            rows.extend(response.data["results"])
+            url = response.data["next"]
+        return rows
+
+    def test_patients_pages_cover_every_row_once(self):
+        rows = self.collect_pages("/api/patients/?page_size=2")
+        self.assertEqual([row["id"] for row in rows], [patient.id for patient in self.patients])
+
+    def test_doctors_pages_cover_every_row_once(self):
+        rows = self.collect_pages("/api/doctors/?page_size=2")
+        self.assertEqual([row["id"] for row in rows], [doctor.id for doctor in self.doctors])
+
+    def test_mappings_pages_are_ordered_by_assigned_at(self):
+        # giving every mapping the same timestamp so only the id tiebreaker keeps the pages apart
+        PatientDoctorMapping.objects.update(assigned_at=PatientDoctorMapping.objects.first().assigned_at)
+
+        rows = self.collect_pages("/api/mappings/?page_size=2")
+        self.assertEqual(len(rows), len(self.doctors))
+        self.assertEqual(len({row["id"] for row in rows}), len(self.doctors))
+
+    def test_last_page_has_no_next_link(self):
+        response = self.client.get("/api/patients/")
+        self.assertEqual(len(response.data["results"]), len(self.patients))
+        self.assertIsNone(response.data["next"])
+
+    def test_page_size_is_capped(self):
+        with self.settings(MAX_PAGE_SIZE=3):
+            response = self.client.get("/api/patients/?page_size=1000")
+        self.assertEqual(len(response.data["results"]), 3)
+
+    def test_invalid_cursor(self):
+        response = self.client.get("/api/patients/?cursor=not-a-cursor")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        # well-formed cursors holding values no row can have
+        for position in ([None], [2 ** 70]):
+            cursor = base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+            with self.subTest(position=position):
+                self.assertEqual(self.client.get("/api/patients/", {"cursor": cursor}).status_code, status.HTTP_404_NOT_FOUND)
+
+
+class QueryBudgetTests(APITestCase):
+    # Upper bound on the queries each endpoint may run, auth lookup included. The fixtures have
+    # several rows per relation, so anything that queries per row blows through its budget.
+    # Raising a number here should be a deliberate decision, not a way to get CI green.
+    QUERY_BUDGETS = {
+        "register": 2,
+        "login": 1,
+        "patients-list": 2,
+        # every write also appends its change feed entry
+        "patients-create": 4,
+        "patient-detail": 2,
+        "patient-update": 4,
+        # deletes collect the cascaded mappings and appointments (one SELECT per table, not per
+        # row) so the appointment post_delete signal can give the booked slots back, and lower
+        # the roster counters of the patient and its doctors (one UPDATE each), then log every
+        # deleted row with one INSERT
+        "patient-delete": 9,
+        "doctors-list": 2,
+        # a new doctor gets a row in the availability index for every day already materialized,
+        # and its specialization count goes up
+        "doctors-create": 6,
+        "doctor-detail": 2,
+        "doctor-update": 4,
+        # same for a doctor, plus its specialization count and the owners of its mappings' patients
+        "doctor-delete": 13,
+        "mappings-list": 2,
+        # plus the two roster counters, deleting one moves them too
+        "mappings-create": 8,
+        "mapping-detail": 3,
+        "mapping-delete": 7,
+    }
+    ROWS = 10
+
+    def setUp(self):
+        # doctor pages are cached, and bulk_create doesn't invalidate them
+        cache.clear()
+        self.user = User.objects.create_user(username="testuser", password="password123")
+        response = self.client.post("/api/auth/login/", {"username": "testuser", "password": "password123"})
+        self.token = response.data["access"]
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.token}")
+
+        self.patients = Patient.objects.bulk_create([
+            Patient(firstname=f"Patient{i}", lastname="Test", email=f"patient{i}@gmail.com", age=30, gender="M", created_by=self.user)
+            for i in range(self.ROWS)
+        ])
+        self.doctors = Doctor.objects.bulk_create([
+            Doctor(firstname=f"Doctor{i}", lastname="Test", email=f"doctor{i}@gmail.com", gender="F", specialization="GEN")
+            for i in range(self.ROWS)
+        ])
+        PatientDoctorMapping.objects.bulk_create([
+            PatientDoctorMapping(patient=patient, doctor=doctor)
+            for patient in self.patients[:3] for doctor in self.doctors
+        ])
+
+    def assertWithinBudget(self, endpoint, request, expected_status):
+        with CaptureQueriesContext(connection) as queries:
+            response = request()
+        self.assertEqual(response.status_code, expected_status)
+
+        budget = self.QUERY_BUDGETS[endpoint]
+        self.assertLessEqual(
+            len(queries), budget,
+            f"{endpoint} ran {len(queries)} queries, budget is {budget}:\n"
+            + "\n".join(query["sql"] for query in queries.captured_queries)
+        )
+        return response
+
+    def test_auth_budgets(self):
+        self.client.credentials()
+        self.assertWithinBudget("register", lambda: self.client.post("/api/auth/register/", {
+            "username": "newuser", "email": "newuser@gmail.com", "password": "password123"
+        }), status.HTTP_201_CREATED)
+        self.assertWithinBudget("login", lambda: self.client.post("/api/auth/login/", {
+            "username": "testuser", "password": "password123"
+        }), status.HTTP_200_OK)
+
+    def test_patient_budgets(self):
+        patient = self.patients[0]
+        self.assertWithinBudget("patients-list", lambda: self.client.get("/api/patients/"), status.HTTP_200_OK)
+        self.assertWithinBudget("patients-create", lambda: self.client.post("/api/patients/", {
+            "firstname": "Erling", "lastname": "Haaland", "age": 26, "gender": "M", "email": "earling@gmail.com"
+        }), status.HTTP_201_CREATED)
+        self.assertWithinBudget("patient-detail", lambda: self.client.get(f"/api/patients/{patient.id}/"), status.HTTP_200_OK)
+        self.assertWithinBudget("patient-update", lambda: self.client.put(f"/api/patients/{patient.id}/", {
+            "firstname": "Kiliyan"
+        }), status.HTTP_200_OK)
+        self.assertWithinBudget("patient-delete", lambda: self.client.delete(f"/api/patients/{patient.id}/"), status.HTTP_204_NO_CONTENT)
+
+    def test_doctor_budgets(self):
+        doctor = self.doctors[0]
+        self.assertWithinBudget("doctors-list", lambda: self.client.get("/api/doctors/"), status.HTTP_200_OK)
+        self.assertWithinBudget("doctors-create", lambda: self.client.post("/api/doctors/", {
+            "firstname": "Syed", "lastname": "Mehdi", "specialization": "DERM", "email": "syed@gmail.com", "gender": "M"
+        }), status.HTTP_201_CREATED)
+        self.assertWithinBudget("doctor-detail", lambda: self.client.get(f"/api/doctors/{doctor.id}/"), status.HTTP_200_OK)
+        self.assertWithinBudget("doctor-update", lambda: self.client.put(f"/api/doctors/{doctor.id}/", {
+            "firstname": "Jane"
+        }), status.HTTP_200_OK)
+        self.assertWithinBudget("doctor-delete", lambda: self.client.delete(f"/api/doctors/{doctor.id}/"), status.HTTP_204_NO_CONTENT)
+
+    def test_mapping_budgets(self):
+        patient = self.patients[0]
+        self.assertWithinBudget("mappings-list", lambda: self.client.get("/api/mappings/"), status.HTTP_200_OK)
+        self.assertWithinBudget("mappings-create", lambda: self.client.post("/api/mappings/", {
+            "patient": self.patients[-1].id, "doctor": self.doctors[0].id
+        }), status.HTTP_201_CREATED)
+        response = self.assertWithinBudget("mapping-detail", lambda: self.client.get(f"/api/mappings/{patient.id}/"), status.HTTP_200_OK)
+        self.assertEqual(len(response.data["doctors"]), self.ROWS)
+
+        mapping = PatientDoctorMapping.objects.filter(patient=patient).first()
+        self.assertWithinBudget("mapping-delete", lambda: self.client.delete(f"/api/mappings/{mapping.id}/{mapping.doctor_id}/"), status.HTTP_204_NO_CONTENT)
+
+
+class DoctorCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="testuser", password="password123")
+        response = self.client.post("/api/auth/login/", {"username": "testuser", "password": "password123"})
+        self.token = response.data["access"]
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.token}")
+
+        self.doctor = Doctor.objects.create(firstname="Syed", lastname="Mehdi", specialization="DERM", email="syed@gmail.com", gender="M")
+
+    def test_repeated_reads_skip_the_db(self):
+        self.client.get("/api/doctors/")
+        self.client.get(f"/api/doctors/{self.doctor.id}/")
+
+        # only the auth lookup is left once the payloads are cached
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/doctors/")
+        self.assertEqual(response.data["results"][0]["firstname"], "Syed")
+        with self.assertNumQueries(1):
+            response = self.client.get(f"/api/doctors/{self.doctor.id}/")
+        self.assertEqual(response.data["firstname"], "Syed")
+
+    def test_create_invalidates_list(self):
+        self.client.get("/api/doctors/")
+        self.client.post("/api/doctors/", {
+            "firstname": "Jane", "lastname": "Doe", "specialization": "CARD", "email": "jane@gmail.com", "gender": "F"
+        })
+        response = self.client.get("/api/doctors/")
+        self.assertEqual(len(response.data["results"]), 2)
+
+    def test_update_invalidates_list_and_detail(self):
+        self.client.get("/api/doctors/")
+        self.client.get(f"/api/doctors/{self.doctor.id}/")
+
+        self.client.put(f"/api/doctors/{self.doctor.id}/", {"firstname": "Jane"})
+
+        response = self.client.get(f"/api/doctors/{self.doctor.id}/")
+        self.assertEqual(response.data["firstname"], "Jane")
+        response = self.client.get("/api/doctors/")
+        self.assertEqual(response.data["results"][0]["firstname"], "Jane")
+
+    def test_delete_invalidates_list_and_detail(self):
+        self.client.get("/api/doctors/")
+        self.client.get(f"/api/doctors/{self.doctor.id}/")
+
+        self.client.delete(f"/api/doctors/{self.doctor.id}/")
+
+        response = self.client.get(f"/api/doctors/{self.doctor.id}/")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get("/api/doctors/")
+        self.assertEqual(response.data["results"], [])
+
+    def test_reads_racing_an_uncommitted_write_are_dropped_on_commit(self):
+        url = f"/api/doctors/{self.doctor.id}/"
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.doctor.firstname = "Jane"
+            self.doctor.save()
+            # a reader on another connection still sees the old row and caches it under the
+            # version the save just bumped
+            stale = {"doctor": {**self.client.get(url).data, "firstname": "Syed"}, "updated_at": self.doctor.updated_at}
+            cache.set(doctor_detail_key(self.doctor.id, get_doctors_version()), stale)
+            self.assertEqual(self.client.get(url).data["firstname"], "Syed")
+
+        self.assertEqual(self.client.get(url).data["firstname"], "Jane")
+
+    def test_stats_count_hits_and_misses(self):
+        self.client.get(f"/api/doctors/{self.doctor.id}/")
+        self.client.get(f"/api/doctors/{self.doctor.id}/")
+        self.client.get(f"/api/doctors/{self.doctor.id}/")
+
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get("/api/doctors/cache-stats/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["misses"], 1)
+        self.assertEqual(response.data["hits"], 2)
+
+    def test_stats_require_staff(self):
+        response = self.client.get("/api/doctors/cache-stats/")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class PatientBulkImportTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="password123")
+        response = self.client.post("/api/auth/login/", {"username": "testuser", "password": "password123"})
+        self.token = response.data["access"]
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.token}")
+
+        self.rows = [
+            {"firstname": f"Patient{i}", "lastname": "Test", "age": 30, "gender": "F", "email": f"patient{i}@gmail.com"}
+            for i in range(7)
+        ]
+
+    def test_import_json_array_in_batches(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post("/api/patients/bulk/?batch_size=3", json.dumps(self.rows), content_type="application/json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["created"], 7)
+        self.assertEqual(response.data["errors"], [])
+
+        # three batches of (email check + insert), nowhere near one insert per row
+        inserts = [query for query in queries.captured_queries if query["sql"].startswith('INSERT INTO "hospital_patient"')]
+        self.assertEqual(len(inserts), 3)
+        self.assertEqual(Patient.objects.filter(created_by=self.user).count(), 7)
+
+    def test_import_ndjson(self):
+        body = "\n".join(json.dumps(row) for row in self.rows)
+        response = self.client.post("/api/patients/bulk/", body, content_type="application/x-ndjson")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["created"], 7)
+
+    def test_bad_rows_are_reported_without_aborting(self):
+        Patient.objects.create(created_by=self.user, **self.rows[0])
+        self.rows[2]["age"] = 500
+        self.rows[4]["email"] = self.rows[3]["email"]
+
+        body = "\n".join(json.dumps(row) for row in self.rows) + "\n{not json"
+        response = self.client.post("/api/patients/bulk/?batch_size=2", body, content_type="application/x-ndjson")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["created"], 4)
+
+        errors = {error["row"]: error["errors"] for error in response.data["errors"]}
+        self.assertEqual(sorted(errors), [0, 2, 4, 7])
+        self.assertIn("email", errors[0])
+        self.assertIn("age", errors[2])
+        self.assertIn("email", errors[4])
+        self.assertIn("non_field_errors", errors[7])
+
+    def test_truncated_array_keeps_earlier_rows(self):
+        body = json.dumps(self.rows)[:-20]
+        response = self.client.post("/api/patients/bulk/", body, content_type="application/json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["created"], 6)
+        self.assertEqual(response.data["errors"][0]["row"], 6)
+
+    def test_requires_auth(self):
+        self.client.credentials()
+        response = self.client.post("/api/patients/bulk/", json.dumps(self.rows), content_type="application/json")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class MappingBulkAssignTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="password123")
+        response = self.client.post("/api/auth/login/", {"username": "testuser", "password": "password123"})
+        self.token = response.data["access"]
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.token}")
+
+        self.patients = Patient.objects.bulk_create([
+            Patient(firstname=f"Patient{i}", lastname="Test", email=f"patient{i}@gmail.com", age=30, gender="M", created_by=self.user)
+            for i in range(20)
+        ])
+        self.doctors = Doctor.objects.bulk_create([
+            Doctor(firstname=f"Doctor{i}", lastname="Test", email=f"doctor{i}@gmail.com", gender="F", specialization="GEN")
+            for i in range(20)
+        ])
+
+    def test_cross_product_in_a_handful_of_queries(self):
+        PatientDoctorMapping.objects.create(patient=self.patients[0], doctor=self.doctors[0])
+        data = {
+            "patient_ids": [patient.id for patient in self.patients],
+            "doctor_ids": [doctor.id for doctor in self.doctors],
+        }
+        # auth + patients + doctors + existing pairs + savepoint/insert + the roster counter
+        # UPDATEs (one per distinct increment, 19 and 20 here, per side), not one per pair, and the
+        # change log: the new pairs' ids read back and inserted (in a few batches on SQLite)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post("/api/mappings/bulk/", data, format="json")
+        self.assertLessEqual(len(queries), 16)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["created"], 399)
+        self.assertEqual(response.data["existing"], 1)
+        self.assertEqual(PatientDoctorMapping.objects.count(), 400)
+
+    def test_pairs_and_missing_ids(self):
+        data = {"pairs": [
+            {"patient": self.patients[0].id, "doctor": self.doctors[0].id},
+            {"patient": self.patients[0].id, "doctor": self.doctors[0].id},
+            {"patient": self.patients[1].id, "doctor": 999},
+            {"patient": 999, "doctor": self.doctors[1].id},
+        ]}
+        response = self.client.post("/api/mappings/bulk/", data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["created"], 1)
+        self.assertEqual(response.data["missing_patients"], [999])
+        self.assertEqual(response.data["missing_doctors"], [999])
+
+        # sending the same pair again is not an error anymore, it's just reported as existing
+        response = self.client.post("/api/mappings/bulk/", data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["created"], 0)
+        self.assertEqual(response.data["existing"], 1)
+
+    def test_too_many_pairs(self):
+        data = {
+            "patient_ids": [patient.id for patient in self.patients],
+            "doctor_ids": [doctor.id for doctor in self.doctors],
+        }
+        with self.settings(BULK_MAX_PAIRS=100):
+            response = self.client.post("/api/mappings/bulk/", data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(PatientDoctorMapping.objects.count(), 0)
+
+    def test_cross_product_is_sized_before_it_is_built(self):
+        data = {"patient_ids": list(range(1, 3001)), "doctor_ids": list(range(1, 3001))}
+        with self.settings(BULK_MAX_PAIRS=100):
+            response = self.client.post("/api/mappings/bulk/", data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("At most 100 pairs", str(response.data))
+
+    def test_concurrent_insert_is_not_counted_twice(self):
+        patient, doctor = self.patients[0], self.doctors[0]
+        bulk_create = PatientDoctorMapping.objects.bulk_create
+
+        def racing_bulk_create(*args, **kwargs):
+            # another request inserts one of the pairs between the lookup and the insert
+            PatientDoctorMapping.objects.create(patient=patient, doctor=doctor)
+            return bulk_create(*args, **kwargs)
+
+        data = {"patient_ids": [patient.id], "doctor_ids": [doctor.id, self.doctors[1].id]}
+        with mock.patch.object(PatientDoctorMapping.objects, "bulk_create", side_effect=racing_bulk_create):
+            response = self.client.post("/api/mappings/bulk/", data, format="json")
+
+        self.assertEqual(response.data["created"], 1)
+        self.assertEqual(response.data["existing"], 1)
+        patient.refresh_from_db()
+        doctor.refresh_from_db()
+        self.assertEqual(patient.doctor_count, 2)
+        self.assertEqual(doctor.patient_count, 1)
+        self.assertEqual(ChangeLog.objects.filter(model="mapping", op=ChangeLog.INSERT).count(), 2)
+
+    def test_empty_request(self):
+        response = self.client.post("/api/mappings/bulk/", {}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ExportTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="password123")
+        response = self.client.post("/api/auth/login/", {"username": "testuser", "password": "password123"})
+        self.token = response.data["access"]
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.token}")
+
+        self.patients = Patient.objects.bulk_create([
+            Patient(firstname=f"Patient{i}", lastname="Tést", email=f"patient{i}@gmail.com", age=30, gender="M", created_by=self.user)
+            for i in range(5)
+        ])
+        self.doctors = Doctor.objects.bulk_create([
+            Doctor(firstname=f"Doctor{i}", lastname="Test", email=f"doctor{i}@gmail.com", gender="F", specialization="GEN")
+            for i in range(3)
+        ])
+        for patient in self.patients[:2]:
+            for doctor in self.doctors:
+                PatientDoctorMapping.objects.create(patient=patient, doctor=doctor)
+
+    def read(self, response):
+        self.assertTrue(response.streaming)
+        return b"".join(response.streaming_content).decode()
+
+    def test_patients_ndjson_matches_the_list_endpoint(self):
+        with self.settings(EXPORT_CHUNK_SIZE=2):
+            response = self.client.get("/api/patients/export/")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            rows = [json.loads(line) for line in self.read(response).splitlines()]
+
+        listed = self.client.get("/api/patients/").json()["results"]
+        self.assertEqual(rows, listed)
+
+    def test_mappings_ndjson_matches_the_list_endpoint(self):
+        response = self.client.get("/api/mappings/export/?fmt=ndjson")
+        rows = [json.loads(line) for line in self.read(response).splitlines()]
+
+        listed = self.client.get("/api/mappings/").json()["results"]
+        self.assertEqual(rows, listed)
+
+    def test_mappings_csv(self):
+        response = self.client.get("/api/mappings/export/?fmt=csv")
+        self.assertEqual(response["Content-Type"], "text/csv")
+        rows = list(csv.DictReader(io.StringIO(self.read(response))))
+
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[0]["patient.firstname"], "Patient0")
+        self.assertEqual(rows[0]["doctor.specialization"], "GEN")
+
+    def test_unknown_format(self):
+        response = self.client.get("/api/patients/export/?fmt=xml")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_requires_auth(self):
+        self.client.credentials()
+        response = self.client.get("/api/mappings/export/")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class FastPathTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="password123")
+        patients = Patient.objects.bulk_create([
+            Patient(firstname="Zoë", lastname="Ødegaard", email=f"patient{i}@gmail.com", age=i, gender="MF"[i % 2], created_by=self.user)
+            for i in range(4)
+        ])
+        doctors = Doctor.objects.bulk_create([
+            Doctor(firstname="Jane", lastname=f"Doe {i}", email=f"doctor{i}@gmail.com", gender="F", specialization=code, max_appointments_per_day=i)
+            for i, (code, _) in enumerate(Doctor.SPECIALIZATION_CHOICES)
+        ])
+        for patient in patients:
+            for doctor in doctors[:3]:
+                PatientDoctorMapping.objects.create(patient=patient, doctor=doctor)
+
+    def assertSameJSON(self, fast, serializer_class, queryset):
+        renderer = JSONRenderer()
+        queryset = queryset.order_by("id")
+        expected = renderer.render(serializer_class(queryset, many=True).data)
+        self.assertEqual(renderer.render(fast.serialize(fast.values(queryset))), expected)
+
+    def test_patients_match_serializer(self):
+        self.assertSameJSON(patient_rows, PatientPublicSerializer, Patient.objects.all())
+
+    def test_doctors_match_serializer(self):
+        self.assertSameJSON(doctor_rows, DoctorPublicSerializer, Doctor.objects.all())
+
+    def test_mappings_match_serializer(self):
+        self.assertSameJSON(mapping_rows, MappingsDetailSerializer, PatientDoctorMapping.objects.all())
+
+    def test_mappings_in_one_query(self):
+        with self.assertNumQueries(1):
+            mapping_rows.serialize(mapping_rows.values(PatientDoctorMapping.objects.all()))
+
+
+class BenchmarkTests(APITestCase):
+    def test_run_reports_every_metric(self):
+        cache.clear()
+        owner = seed_dataset(patients=5, doctors=3, mappings_per_patient=2)
+        results = run_benchmarks(owner, ["patients-list", "mappings-create", "mapping-delete"], iterations=3, alloc_iterations=1)
+
+        self.assertEqual(set(results), {"patients-list", "mappings-create", "mapping-delete"})
+        for result in results.values():
+            self.assertLessEqual(result["p50_ms"], result["p95_ms"])
+            self.assertLessEqual(result["p95_ms"], result["p99_ms"])
+            self.assertGreater(result["queries"], 0)
+            self.assertIsNotNone(result["peak_alloc_kib"])
+
+    def test_every_route_runs(self):
+        cache.clear()
+        owner = seed_dataset(patients=5, doctors=3, mappings_per_patient=2)
+        # run_benchmarks raises on any 4xx/5xx answer
+        results = run_benchmarks(owner, list(ROUTES), iterations=1, alloc_iterations=0)
+        self.assertEqual(set(results), set(ROUTES))
+
+    def test_compare_flags_regressions_beyond_tolerance(self):
+        baseline = {"patients-list": {"p50_ms": 10, "p95_ms": 20, "p99_ms": 30, "queries": 2, "peak_alloc_kib": 100}}
+        within = {"patients-list": {"p50_ms": 11, "p95_ms": 23, "p99_ms": 35, "queries": 2, "peak_alloc_kib": 110}}
+        slower = {"patients-list": {"p50_ms": 11, "p95_ms": 30, "p99_ms": 35, "queries": 3, "peak_alloc_kib": 110}}
+
+        self.assertEqual(compare_results(within, baseline, tolerance=0.2), [])
+        regressions = compare_results(slower, baseline, tolerance=0.2)
+        self.assertEqual(len(regressions), 2)
+        self.assertTrue(regressions[0].startswith("patients-list: p95_ms"))
+        self.assertTrue(regressions[1].startswith("patients-list: queries"))
+
+    def test_percentile(self):
+        samples = list(range(1, 101))
+        self.assertEqual(percentile(samples, 50), 50)
+        self.assertEqual(percentile(samples, 99), 99)
+        self.assertEqual(percentile([7], 95), 7)
+
+
+class GenerateDataTests(TestCase):
+    def generate(self, **options):
+        options = {"users": 5, "doctors": 20, "patients": 200, "mappings_per_patient": 3, "seed": 7, **options}
+        call_command("generate_data", stdout=io.StringIO(), **options)
+
+    def test_counts_and_constraints(self):
+        self.generate()
+        self.assertEqual(User.objects.count(), 5)
+        self.assertEqual(Doctor.objects.count(), 20)
+        self.assertEqual(Patient.objects.count(), 200)
+
+        pairs = list(PatientDoctorMapping.objects.values_list("patient_id", "doctor_id"))
+        self.assertGreater(len(pairs), 0)
+        self.assertEqual(len(pairs), len(set(pairs)))
+
+    def test_generated_users_can_log_in(self):
+        self.generate(password="generated-pass")
+        response = self.client.post("/api/auth/login/", {"username": "gen7-user0", "password": "generated-pass"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_same_seed_same_data(self):
+        self.generate(prefix="a")
+        self.generate(prefix="b")
+
+        def dataset(prefix):
+            return list(Patient.objects.filter(email__startswith=f"{prefix}-").order_by("id").values_list("firstname", "lastname", "age", "gender"))
+
+        self.assertEqual(dataset("a"), dataset("b"))
+
+    def test_new_doctors_show_up_as_available(self):
+        today = timezone.localdate()
+        materialize_day(today)
+        self.generate()
+        self.assertEqual(len(available_doctors(today, limit=100)), 20)
+
+    def test_owner_skew(self):
+        self.generate(users=50, patients=1000, owner_skew=1.5)
+        owned = sorted(User.objects.annotate(n=models.Count("patients")).values_list("n", flat=True), reverse=True)
+        # the top 5 of 50 users own more than half the patients
+        self.assertGreater(sum(owned[:5]), 500)
+
+    def test_copy_writes_every_required_column(self):
+        # COPY leaves out the model defaults, a NOT NULL column missing from a field list fails
+        # on PostgreSQL only
+        written = []
+        with mock.patch.object(DataGenerator, "write", autospec=True, side_effect=lambda generator, model, fields, rows: written.append((model, fields))):
+            with mock.patch.object(DataGenerator, "ids", return_value=[1]):
+                self.generate()
+
+        for model, fields in written:
+            required = {
+                field.name for field in model._meta.concrete_fields
+                if not field.null and not field.primary_key and field.db_default is models.NOT_PROVIDED
+            }
+            self.assertEqual(required - {model._meta.get_field(field).name for field in fields}, set(), model.__name__)
+
+    def test_prefix_reuse_is_refused(self):
+        self.generate()
+        with self.assertRaises(CommandError):
+            self.generate()
+
+
+class StatelessAuthTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        verified_tokens.clear()
+        self.user = User.objects.create_user(username="testuser", password="password123", is_staff=True)
+        response = self.client.post("/api/auth/login/", {"username": "testuser", "password": "password123"})
+        self.token = response.data["access"]
+        self.auth = CachedStatelessJWTAuthentication()
+
+    def authenticate(self, token=None):
+        request = APIRequestFactory().get("/api/patients/", HTTP_AUTHORIZATION=f"Bearer {token or self.token}")
+        return self.auth.authenticate(request)
+
+    def test_login_token_carries_claims(self):
+        token = AccessToken(self.token)
+        self.assertEqual(token["username"], "testuser")
+        self.assertTrue(token["is_active"])
+        self.assertTrue(token["is_staff"])
+
+    def test_no_queries_and_signature_verified_once(self):
+        with self.assertNumQueries(0):
+            user, _ = self.authenticate()
+        self.assertEqual(user.id, self.user.id)
+        self.assertTrue(user.is_staff)
+        self.assertEqual(len(verified_tokens), 1)
+
+        # the second time the token comes from the LRU, a forged copy of the same claims doesn't
+        with self.assertNumQueries(0):
+            self.authenticate()
+        header, payload, signature = self.token.split(".")
+        with self.assertRaises(InvalidToken):
+            self.authenticate(f"{header}.{payload}.{signature[:-4]}AAAA")
+
+    def test_expired_token_is_rejected_even_when_cached(self):
+        self.authenticate()
+        token = verified_tokens.get(next(iter(verified_tokens.tokens)))
+        token.set_exp(lifetime=timedelta(seconds=-1))
+
+        with self.assertRaises(InvalidToken):
+            self.authenticate()
+        self.assertEqual(len(verified_tokens), 0)
+
+    def test_revoked_token(self):
+        self.authenticate()
+        revoke_token(AccessToken(self.token))
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_deactivating_user_revokes_tokens(self):
+        self.authenticate()
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_losing_staff_or_superuser_revokes_tokens(self):
+        # the tokens carry both flags as claims
+        User.objects.filter(pk=self.user.pk).update(is_superuser=True)
+        self.user.refresh_from_db()
+        with mock.patch("hospital.signals.revoke_user_tokens") as revoke:
+            self.user.is_superuser = False
+            self.user.save()
+            self.assertEqual(revoke.call_count, 1)
+
+            # gaining a flag or saving it unchanged leaves them alone
+            self.user.is_superuser = True
+            self.user.save()
+            self.assertEqual(revoke.call_count, 1)
+
+        self.authenticate()
+        self.user.is_staff = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_password_change_revokes_tokens(self):
+        self.user.set_password("newpassword123")
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_inactive_claim_is_rejected(self):
+        token = AccessToken.for_user(self.user)
+        token["is_active"] = False
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate(str(token))
+
+    def test_lru_is_bounded(self):
+        with self.settings(JWT_VERIFIED_CACHE_SIZE=2):
+            for _ in range(4):
+                self.authenticate(str(AccessToken.for_user(self.user)))
+        self.assertEqual(len(verified_tokens), 2)
+
+
+class AsyncViewTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="testuser", password="password123")
+        response = self.client.post("/api/auth/login/", {"username": "testuser", "password": "password123"})
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+
+        self.patient = Patient.objects.create(firstname="John", lastname="Doe", email="john@example.com", age=30, gender="M", created_by=self.user)
+        self.doctor = Doctor.objects.create(firstname="Jane", lastname="Smith", email="jane@example.com", gender="F", specialization="CARD")
+        PatientDoctorMapping.objects.create(patient=self.patient, doctor=self.doctor)
+
+    def assertSameAsSync(self, path):
+        sync = self.client.get(f"/api/{path}")
+        native = self.client.get(f"/api/async/{path}")
+        self.assertEqual(native.status_code, sync.status_code)
+        self.assertEqual(native.json(), sync.json())
+
+    def test_reads_match_sync_views(self):
+        for path in ["patients/", f"patients/{self.patient.id}/", "doctors/", f"doctors/{self.doctor.id}/", "mappings/", f"mappings/{self.patient.id}/"]:
+            with self.subTest(path=path):
+                self.assertSameAsSync(path)
+
+    def test_sparse_fields_match_sync_views(self):
+        for path in [
+            "patients/?fields=id,lastname",
+            f"patients/{self.patient.id}/?fields=age",
+            "doctors/?fields=id,specialization&gender=F",
+            f"doctors/{self.doctor.id}/?fields=firstname",
+            "mappings/?fields=id,doctor.lastname&expand=",
+            "mappings/?fields=id,patient,doctor&expand=",
+            f"mappings/{self.patient.id}/?fields=id",
+            "doctors/?fields=nope",
+            f"patients/{self.patient.id}/?fields=",
+            "mappings/?expand=nope",
+        ]:
+            with self.subTest(path=path):
+                self.assertSameAsSync(path)
+
+    @override_settings(LIST_ETAGS=True)
+    def test_conditional_get(self):
+        for path in ["patients/", f"patients/{self.patient.id}/", "doctors/", f"doctors/{self.doctor.id}/", "mappings/", f"mappings/{self.patient.id}/"]:
+            with self.subTest(path=path):
+                url = f"/api/async/{path}"
+                response = self.client.get(url)
+                self.assertTrue(response["ETag"].startswith('W/"'))
+                not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+                self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+                self.assertEqual(not_modified.content, b"")
+
+                self.client.put(f"/api/async/patients/{self.patient.id}/", {"age": self.patient.age + 1}, format="json")
+                self.client.put(f"/api/async/doctors/{self.doctor.id}/", {"lastname": f"Changed{path}"}, format="json")
+                self.patient.refresh_from_db()
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, status.HTTP_200_OK)
+
+        # the details are versioned by the row, the same validators as the sync views
+        for path in [f"patients/{self.patient.id}/", f"doctors/{self.doctor.id}/"]:
+            with self.subTest(path=path):
+                response = self.client.get(f"/api/async/{path}")
+                self.assertEqual(response["ETag"], self.client.get(f"/api/{path}")["ETag"])
+                self.assertEqual(self.client.get(f"/api/async/{path}", HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]).status_code, status.HTTP_304_NOT_MODIFIED)
+
+    @override_settings(LIST_ETAGS=False)
+    def test_lists_without_a_shared_cache(self):
+        for path in ["patients/", "doctors/", "mappings/"]:
+            with self.subTest(path=path):
+                self.assertNotIn("ETag", self.client.get(f"/api/async/{path}"))
+
+    def test_pagination_cursor(self):
+        for i in range(3):
+            Doctor.objects.create(firstname=f"Doc{i}", lastname="Who", email=f"doc{i}@example.com", gender="M", specialization="GEN")
+        cache.clear()
+
+        response = self.client.get("/api/async/doctors/?page_size=2")
+        self.assertEqual(len(response.json()["results"]), 2)
+        response = self.client.get(response.json()["next"])
+        self.assertEqual(len(response.json()["results"]), 2)
+        self.assertIsNone(response.json()["next"])
+
+        response = self.client.get("/api/async/doctors/?cursor=nope")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_patient_crud(self):
+        data = {"firstname": "Alice", "lastname": "Brown", "email": "alice@example.com", "age": 25, "gender": "F"}
+        response = self.client.post("/api/async/patients/", data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        patient = Patient.objects.get(email="alice@example.com")
+        self.assertEqual(patient.created_by, self.user)
+
+        response = self.client.post("/api/async/patients/", data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        etag = self.client.get(f"/api/patients/{patient.id}/")["ETag"]
+        response = self.client.put(f"/api/async/patients/{patient.id}/", {"age": 26}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        patient.refresh_from_db()
+        self.assertEqual(patient.age, 26)
+        # the async update moves updated_at, so the sync view's ETag changes with it
+        response = self.client.get(f"/api/patients/{patient.id}/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["age"], 26)
+
+        response = self.client.delete(f"/api/async/patients/{patient.id}/")
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(Patient.objects.filter(pk=patient.id).exists())
+
+        response = self.client.get(f"/api/async/patients/{patient.id}/")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_doctor_create_invalidates_cache(self):
+        self.client.get("/api/async/doctors/")
+        data = {"firstname": "Greg", "lastname": "House", "email": "house@example.com", "gender": "M", "specialization": "GEN"}
+        response = self.client.post("/api/async/doctors/", data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(self.client.get("/api/async/doctors/").json()["results"]), 2)
+
+    def test_mapping_create_conflict(self):
+        other = Doctor.objects.create(firstname="Greg", lastname="House", email="house@example.com", gender="M", specialization="GEN")
+        response = self.client.post("/api/async/mappings/", {"patient": self.patient.id, "doctor": other.id}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.client.post("/api/async/mappings/", {"patient": self.patient.id, "doctor": other.id}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    def test_authentication(self):
+        self.client.credentials()
+        response = self.client.get("/api/async/patients/")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response["WWW-Authenticate"], 'Bearer realm="api"')
+
+        self.client.credentials(HTTP_AUTHORIZATION="Bearer not-a-token")
+        response = self.client.get("/api/async/patients/")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        # anonymous reads of the doctor directory are fine, like the sync view
+        self.client.credentials()
+        self.assertEqual(self.client.get("/api/async/doctors/").status_code, status.HTTP_200_OK)
+
+
+@override_settings(DATABASE_REPLICAS=["replica1", "replica2"])
+class ReplicaRoutingTests(SimpleTestCase):
+    # the replica aliases only need to exist as names here, health checks are mocked out
+    def setUp(self):
+        cache.clear()
+        replica_health.reset()
+        self.router = PrimaryReplicaRouter()
+        self.healthy = {"replica1": True, "replica2": True}
+        patcher = mock.patch.object(replica_health, "check", side_effect=lambda alias: self.healthy[alias])
+        self.check = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def read(self):
+        return self.router.db_for_read(Doctor)
+
+    def test_primary_outside_replica_reads(self):
+        self.assertEqual(self.read(), "default")
+        self.assertEqual(self.router.db_for_write(Doctor), "default")
+        self.assertFalse(self.router.allow_migrate("replica1", "hospital"))
+
+    def test_round_robin_and_failover(self):
+        token = replica_reads.set(set())
+        try:
+            self.assertEqual({self.read(), self.read()}, {"replica1", "replica2"})
+            self.assertEqual(replica_reads.get(), {"replica1", "replica2"})
+
+            # inside a transaction on the primary, reads stay there
+            with mock.patch.object(connection, "in_atomic_block", True):
+                self.assertEqual(self.read(), "default")
+
+            replica_health.mark_down("replica1")
+            self.assertEqual({self.read(), self.read()}, {"replica2"})
+
+            replica_health.mark_down("replica2")
+            self.assertEqual(self.read(), "default")
+        finally:
+            replica_reads.reset(token)
+
+    def test_health_is_rechecked_after_interval(self):
+        self.healthy["replica1"] = False
+        self.assertFalse(replica_health.is_healthy("replica1"))
+        self.healthy["replica1"] = True
+        self.assertFalse(replica_health.is_healthy("replica1"))
+        self.assertEqual(self.check.call_count, 1)
+
+        with self.settings(REPLICA_HEALTH_CHECK_INTERVAL=0):
+            self.assertTrue(replica_health.is_healthy("replica1"))
+
+    def test_writes_pin_client_to_primary(self):
+        seen = []
+        middleware = ReplicaRoutingMiddleware(lambda request: seen.append(replica_reads.get()) or HttpResponse())
+        factory = RequestFactory()
+
+        middleware(factory.get("/api/doctors/", HTTP_AUTHORIZATION="Bearer a"))
+        middleware(factory.post("/api/doctors/", HTTP_AUTHORIZATION="Bearer a"))
+        middleware(factory.get("/api/doctors/", HTTP_AUTHORIZATION="Bearer a"))
+        middleware(factory.get("/api/doctors/", HTTP_AUTHORIZATION="Bearer b"))
+
+        self.assertEqual(seen, [set(), None, None, set()])
+        self.assertIsNone(replica_reads.get())
+
+        with self.settings(REPLICA_PIN_SECONDS=0):
+            cache.clear()
+            middleware(factory.get("/api/doctors/", HTTP_AUTHORIZATION="Bearer a"))
+        self.assertEqual(seen[-1], set())
+
+    def test_async_requests_stay_async(self):
+        seen = []
+
+        async def view(request):
+            seen.append(replica_reads.get())
+            return HttpResponse()
+
+        middleware = ReplicaRoutingMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        factory = RequestFactory()
+
+        async_to_sync(middleware)(factory.get("/api/doctors/", HTTP_AUTHORIZATION="Bearer a"))
+        async_to_sync(middleware)(factory.post("/api/doctors/", HTTP_AUTHORIZATION="Bearer a"))
+        async_to_sync(middleware)(factory.get("/api/doctors/", HTTP_AUTHORIZATION="Bearer a"))
+
+        self.assertEqual(seen, [set(), None, None])
+        self.assertIsNone(replica_reads.get())
+        self.assertFalse(iscoroutinefunction(ReplicaRoutingMiddleware(lambda request: HttpResponse())))
+
+    def test_failed_replica_read_is_retried_on_primary(self):
+        middleware = ReplicaRoutingMiddleware(lambda request: HttpResponse(str(replica_reads.get())))
+        request = RequestFactory().get("/api/doctors/")
+        token = replica_reads.set({"replica1"})
+        try:
+            with mock.patch.object(replica_health, "mark_down") as mark_down, mock.patch("hospital.middleware.connections"):
+                response = middleware.process_exception(request, OperationalError("gone"))
+        finally:
+            replica_reads.reset(token)
+
+        mark_down.assert_called_once_with("replica1")
+        self.assertEqual(response.content, b"None")
+
+
+class PoolStatsTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="password123", is_staff=True)
+        response = self.client.post("/api/auth/login/", {"username": "testuser", "password": "password123"})
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+
+    def test_unpooled(self):
+        response = self.client.get("/api/db/pool-stats/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.data["default"]["pooled"])
+
+    def test_pooled(self):
+        pool = mock.Mock()
+        pool.get_stats.return_value = {
+            "pool_min": 2, "pool_max": 10, "pool_size": 4, "pool_available": 1,
+            "requests_num": 8, "requests_waiting": 0, "requests_wait_ms": 20, "connections_num": 4,
+        }
+        with mock.patch.object(connection, "pool", pool, create=True):
+            response = self.client.get("/api/db/pool-stats/")
+
+        stats = response.data["default"]
+        self.assertTrue(stats["pooled"])
+        self.assertEqual(stats["in_use"], 3)
+        self.assertEqual(stats["saturation"], 0.3)
+        self.assertEqual(stats["checkouts"], 8)
+        self.assertEqual(stats["wait_ms_avg"], 2.5)
+
+    def test_requires_staff(self):
+        self.user.is_staff = False
+        self.user.save()
+        response = self.client.get("/api/db/pool-stats/")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class MetricsTests(APITestCase):
+    def setUp(self):
+        request_metrics.reset()
+        self.user = User.objects.create_user(username="testuser", password="password123", is_staff=True)
+        response = self.client.post("/api/auth/login/", {"username": "testuser", "password": "password123"})
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        Patient.objects.create(firstname="John", lastname="Doe", email="john@example.com", age=30, gender="M", created_by=self.user)
+
+    def server_timing(self, response):
+        entries = {}
+        for entry in response["Server-Timing"].split(", "):
+            name, *params = entry.split(";")
+            entries[name] = dict(param.split("=", 1) for param in params)
+        return entries
+
+    def test_server_timing(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/patients/")
+        timing = self.server_timing(response)
+
+        self.assertEqual(set(timing), {"total", "db", "auth", "serialize"})
+        self.assertEqual(timing["db"]["desc"], f'"{len(queries)} queries"')
+        self.assertGreater(float(timing["serialize"]["dur"]), 0)
+        self.assertGreater(float(timing["auth"]["dur"]), 0)
+        self.assertGreaterEqual(float(timing["total"]["dur"]), float(timing["db"]["dur"]))
+
+    def test_metrics(self):
+        self.client.get("/api/patients/")
+        self.client.get("/api/patients/")
+        self.client.get("/api/patients/999999/")
+
+        response = self.client.get("/api/metrics/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        body = response.content.decode()
+        self.assertIn('http_responses_total{route="api/patients/",method="GET",status="200"} 2', body)
+        self.assertIn('http_responses_total{route="api/patients/<int:pk>/",method="GET",status="404"} 1', body)
+        self.assertIn('http_request_duration_seconds_count{route="api/patients/",method="GET"} 2', body)
+        self.assertIn('http_request_db_queries_bucket{route="api/patients/",method="GET",le="+Inf"} 2', body)
+        self.assertIn("# TYPE http_request_serialize_seconds histogram", body)
+
+    def test_async_requests(self):
+        @sync_to_async
+        def count():
+            return Patient.objects.count()
+
+        async def view(request):
+            return HttpResponse(str(await count()))
+
+        middleware = RequestMetricsMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        response = async_to_sync(middleware)(RequestFactory().get("/api/patients/"))
+
+        self.assertEqual(response.content, b"1")
+        self.assertEqual(self.server_timing(response)["db"]["desc"], '"1 queries"')
+
+    def test_metrics_access(self):
+        self.user.is_staff = False
+        self.user.save()
+        self.assertEqual(self.client.get("/api/metrics/").status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.credentials(HTTP_AUTHORIZATION="Metrics s3cret")
+        self.assertEqual(self.client.get("/api/metrics/").status_code, status.HTTP_401_UNAUTHORIZED)
+        with override_settings(METRICS_TOKEN="s3cret"):
+            self.assertEqual(self.client.get("/api/metrics/").status_code, status.HTTP_200_OK)
+            self.client.credentials(HTTP_AUTHORIZATION="Metrics wrong")
+            self.assertEqual(self.client.get("/api/metrics/").status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_disabled(self):
+        request_metrics.reset()
+        response = self.client.get("/api/patients/")
+        self.assertNotIn("Server-Timing", response)
+        self.assertEqual(request_metrics.render().count("http_responses_total{"), 0)
+
+
+class ProfilingTests(APITestCase):
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.profile_dir)
+        self.settings_override = override_settings(PROFILE_DIR=self.profile_dir, PROFILE_INTERVAL_MS=1)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        self.addCleanup(profiling.sampling.clear)
+
+        self.user = User.objects.create_user(username="testuser", password="password123", is_staff=True)
+        response = self.client.post("/api/auth/login/", {"username": "testuser", "password": "password123"})
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        Patient.objects.create(firstname="John", lastname="Doe", email="john@example.com", age=30, gender="M", created_by=self.user)
+
+    def test_profile_by_header(self):
+        token = self.client.post("/api/profiles/token/").data["token"]
+        response = self.client.get("/api/patients/", HTTP_X_PROFILE=token)
+        profile_id = response["X-Profile-Id"]
+
+        [listed] = self.client.get("/api/profiles/").data["results"]
+        self.assertEqual(listed["id"], profile_id)
+        self.assertEqual(listed["route"], "api/patients/")
+        self.assertEqual(listed["status"], 200)
+
+        profile = json.loads(b"".join(self.client.get(f"/api/profiles/{profile_id}/")))
+        self.assertTrue(any("hospital_patient" in query["sql"] for query in profile["queries"]))
+        self.assertEqual(profile["samples"], sum(profile["stacks"].values()))
+
+        folded = self.client.get(f"/api/profiles/{profile_id}/", {"fmt": "folded"})
+        self.assertEqual(folded.status_code, status.HTTP_200_OK)
+        # ids are checked against the format before they go near the filesystem
+        self.assertEqual(self.client.get("/api/profiles/..%2Fdb.sqlite3/").status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_async_requests(self):
+        @sync_to_async
+        def count():
+            return Patient.objects.count()
+
+        async def view(request):
+            return HttpResponse(str(await count()))
+
+        middleware = ProfilingMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        token = self.client.post("/api/profiles/token/").data["token"]
+        response = async_to_sync(middleware)(RequestFactory().get("/api/patients/", HTTP_X_PROFILE=token))
+        self.assertEqual(response.content, b"1")
+
+        profile = json.loads(b"".join(self.client.get(f"/api/profiles/{response['X-Profile-Id']}/")))
+        self.assertTrue(any("hospital_patient" in query["sql"] for query in profile["queries"]))
+        self.assertNotIn("X-Profile-Id", async_to_sync(middleware)(RequestFactory().get("/api/patients/")))
+
+    def test_bad_token_is_ignored(self):
+        response = self.client.get("/api/patients/", HTTP_X_PROFILE="not-a-token")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn("X-Profile-Id", response)
+        self.assertEqual(os.listdir(self.profile_dir), [])
+
+    def test_sampling(self):
+        response = self.client.put("/api/profiles/sampling/", {"rate": 1, "path": "/api/doctors/"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assertNotIn("X-Profile-Id", self.client.get("/api/patients/"))
+        self.assertIn("X-Profile-Id", self.client.get("/api/doctors/"))
+
+        self.client.delete("/api/profiles/sampling/")
+        self.assertNotIn("X-Profile-Id", self.client.get("/api/doctors/"))
+        self.assertEqual(self.client.put("/api/profiles/sampling/", {"rate": 2}, format="json").status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_limits(self):
+        token = self.client.post("/api/profiles/token/").data["token"]
+        with override_settings(PROFILE_MAX_FILES=2):
+            for _ in range(3):
+                self.client.get("/api/patients/", HTTP_X_PROFILE=token)
+        self.assertEqual(len(os.listdir(self.profile_dir)), 2)
+
+        # every slot taken, the request goes through unprofiled
+        with override_settings(PROFILE_MAX_CONCURRENT=0):
+            self.assertNotIn("X-Profile-Id", self.client.get("/api/patients/", HTTP_X_PROFILE=token))
+
+    def test_staff_only(self):
+        token = self.client.post("/api/profiles/token/").data["token"]
+        self.user.is_staff = False
+        self.user.save()
+        self.assertEqual(self.client.get("/api/profiles/").status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.client.post("/api/profiles/token/").status_code, status.HTTP_403_FORBIDDEN)
+
+
+class DoctorFilterTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        specs = ["CARD", "CARD", "NEUR", "PED"]
+        for i, spec in enumerate(specs):
+            Doctor.objects.create(
+                firstname=f"Doc{i}", lastname="Test", email=f"doc{i}@example.com",
+                gender="MF"[i % 2], specialization=spec, max_appointments_per_day=10 * (i + 1),
+            )
+
+    def names(self, query):
+        response = self.client.get(f"/api/doctors/?{query}")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [doctor["firstname"] for doctor in response.data["results"]]
+
+    def test_filters(self):
+        self.assertEqual(self.names("specialization=CARD"), ["Doc0", "Doc1"])
+        self.assertEqual(self.names("specialization=CARD,PED"), ["Doc0", "Doc1", "Doc3"])
+        self.assertEqual(self.names("specialization=CARD&gender=F"), ["Doc1"])
+        self.assertEqual(self.names("gender=M"), ["Doc0", "Doc2"])
+        self.assertEqual(self.names("min_capacity=20&max_capacity=30"), ["Doc1", "Doc2"])
+        self.assertEqual(self.names("specialization=NEUR&min_capacity=40"), [])
+
+    def test_filtered_pages_keep_their_filters(self):
+        response = self.client.get("/api/doctors/?specialization=CARD,PED&page_size=2")
+        self.assertEqual(len(response.data["results"]), 2)
+        response = self.client.get(response.data["next"])
+        self.assertEqual([doctor["firstname"] for doctor in response.data["results"]], ["Doc3"])
+
+    def test_invalid_filters(self):
+        for query in ["specialization=XYZ", "specialization=CARD,XYZ", "gender=Q", "min_capacity=abc", "min_capacity=30&max_capacity=10"]:
+            with self.subTest(query=query):
+                response = self.client.get(f"/api/doctors/?{query}")
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_async_view_filters(self):
+        response = self.client.get("/api/async/doctors/?specialization=CARD&gender=F")
+        self.assertEqual([doctor["firstname"] for doctor in response.json()["results"]], ["Doc1"])
+        self.assertEqual(self.client.get("/api/async/doctors/?gender=Q").status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@skipUnless(connection.vendor == "postgresql", "query plans are checked on PostgreSQL")
+class DoctorFilterPlanTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        DataGenerator(seed=1, batch_size=10000).doctors(50000)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE hospital_doctor")
+
+    def test_filters_use_indexes(self):
+        for name, params in DOCTOR_FILTER_CASES.items():
+            with self.subTest(filters=name):
+                plan = doctor_filter_page(params).explain()
+                self.assertNotIn("Seq Scan", plan)
+                self.assertIn("Index", plan)
+
+    def test_filters_use_their_own_index(self):
+        self.assertIn("doctor_spec_id_idx", doctor_filter_page({"specialization": "CARD"}).explain())
+        self.assertIn("doctor_spec_gender_id_idx", doctor_filter_page({"specialization": "NEUR", "gender": "F"}).explain())
+
+
+class SearchTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="testuser", password="password123")
+        other = User.objects.create_user(username="otheruser", password="password123")
+        response = self.client.post("/api/auth/login/", {"username": "testuser", "password": "password123"})
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+
+        for firstname, lastname, owner in [("John", "Doe", self.user), ("Johnny", "Walker", self.user), ("Mary", "Johnson", self.user), ("John", "Other", other)]:
+            Patient.objects.create(firstname=firstname, lastname=lastname, email=f"{firstname}.{lastname}@example.com".lower(), age=30, gender="M", created_by=owner)
+        for firstname, lastname in [("Gregory", "House"), ("James", "Wilson"), ("Lisa", "Cuddy")]:
+            Doctor.objects.create(firstname=firstname, lastname=lastname, email=f"{lastname}@example.com".lower(), gender="M", specialization="GEN")
+
+    def search(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [f"{row['firstname']} {row['lastname']}" for row in response.data["results"]]
+
+    def test_patient_search_is_ranked_and_scoped(self):
+        # the exact name ranks first, and the other user's John never shows up
+        results = self.search("/api/patients/search/?q=john")
+        self.assertEqual(results[0], "John Doe")
+        self.assertCountEqual(results, ["John Doe", "Johnny Walker", "Mary Johnson"])
+        self.assertEqual(self.search("/api/patients/search/?q=john doe"), ["John Doe"])
+        self.assertEqual(self.search("/api/patients/search/?q=john&limit=1"), ["John Doe"])
+
+    def test_doctor_search(self):
+        self.assertEqual(self.search("/api/doctors/search/?q=house"), ["Gregory House"])
+        self.assertEqual(self.search("/api/doctors/search/?q=wilson@example"), ["James Wilson"])
+        self.assertEqual(self.search("/api/doctors/search/?q=nobody"), [])
+
+    def test_result_shape(self):
+        response = self.client.get("/api/doctors/search/?q=cuddy")
+        doctor = Doctor.objects.get(lastname="Cuddy")
+        self.assertEqual(response.data["results"], [DoctorPublicSerializer(doctor).data])
+
+    def test_invalid_queries(self):
+        for url in ["/api/doctors/search/", "/api/doctors/search/?q=a", "/api/doctors/search/?q=john&limit=0"]:
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_patient_search_requires_auth(self):
+        self.client.credentials()
+        self.assertEqual(self.client.get("/api/patients/search/?q=john").status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class BatchLookupTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="testuser", password="password123")
+        other = User.objects.create_user(username="otheruser", password="password123")
+        response = self.client.post("/api/auth/login/", {"username": "testuser", "password": "password123"})
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+
+        self.patients = [
+            Patient.objects.create(firstname=f"Patient{i}", lastname="Test", email=f"patient{i}@example.com", age=30, gender="M", created_by=self.user)
+            for i in range(3)
+        ]
+        self.theirs = Patient.objects.create(firstname="Other", lastname="Test", email="other@example.com", age=30, gender="F", created_by=other)
+        self.doctors = [
+            Doctor.objects.create(firstname=f"Doctor{i}", lastname="Test", email=f"doctor{i}@example.com", gender="F", specialization="GEN")
+            for i in range(3)
+        ]
+
+    def batch(self, url, ids):
+        response = self.client.get(url, {"ids": ",".join(str(pk) for pk in ids)})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_patients_in_request_order(self):
+        ids = [self.patients[2].id, self.patients[0].id, 999, self.theirs.id, self.patients[0].id]
+        # the auth lookup and one IN query
+        with self.assertNumQueries(2):
+            data = self.batch("/api/patients/batch/", ids)
+        self.assertEqual(data["results"], [PatientPublicSerializer(self.patients[2]).data, PatientPublicSerializer(self.patients[0]).data])
+        # someone else's patient looks like one that doesn't exist
+        self.assertEqual(data["missing"], [999, self.theirs.id])
+
+    def test_doctors_share_the_detail_cache(self):
+        self.client.get(f"/api/doctors/{self.doctors[1].id}/")
+        ids = [self.doctors[2].id, 999, self.doctors[1].id, self.doctors[0].id]
+        # the auth lookup and one query for the two doctors that weren't cached
+        with self.assertNumQueries(2):
+            data = self.batch("/api/doctors/batch/", ids)
+        self.assertEqual(data["results"], [DoctorPublicSerializer(self.doctors[i]).data for i in (2, 1, 0)])
+        self.assertEqual(data["missing"], [999])
+
+        # now all cached (ids that don't exist aren't, like with the detail endpoint), and the
+        # detail endpoint reads what the batch cached
+        with self.assertNumQueries(1):
+            self.assertEqual(self.batch("/api/doctors/batch/", [pk for pk in ids if pk != 999])["results"], data["results"])
+        with self.assertNumQueries(0):
+            self.client.credentials()
+            response = self.client.get(f"/api/doctors/{self.doctors[2].id}/")
+        self.assertEqual(response.data, data["results"][0])
+
+    def test_changed_doctors_are_reread(self):
+        self.batch("/api/doctors/batch/", [self.doctors[0].id])
+        self.client.put(f"/api/doctors/{self.doctors[0].id}/", {"firstname": "Jane"})
+        self.assertEqual(self.batch("/api/doctors/batch/", [self.doctors[0].id])["results"][0]["firstname"], "Jane")
+
+    def test_invalid_ids(self):
+        for params in ({}, {"ids": ""}, {"ids": "1,x"}, {"ids": ",".join(str(i) for i in range(1, 102))}, {"ids": "0"}, {"ids": f"1,{2 ** 63}"}):
+            for url in ("/api/patients/batch/", "/api/doctors/batch/"):
+                with self.subTest(url=url, params=params):
+                    self.assertEqual(self.client.get(url, params).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_patients_require_auth(self):
+        self.client.credentials()
+        response = self.client.get("/api/patients/batch/", {"ids": self.patients[0].id})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class SparseFieldsTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="testuser", password="password123")
+        response = self.client.post("/api/auth/login/", {"username": "testuser", "password": "password123"})
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+
+        self.patients = [
+            Patient.objects.create(firstname=f"Patient{i}", lastname="Test", email=f"patient{i}@example.com", age=30, gender="M", created_by=self.user)
+            for i in range(2)
+        ]
+        self.doctors = [
+            Doctor.objects.create(firstname=f"Doctor{i}", lastname="Test", email=f"doctor{i}@example.com", gender="F", specialization="GEN")
+            for i in range(2)
+        ]
+        self.mappings = [
+            PatientDoctorMapping.objects.create(patient=patient, doctor=doctor)
+            for patient in self.patients for doctor in self.doctors
+        ]
+
+    def get(self, url, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.sql = [query["sql"] for query in queries.captured_queries]
+        return response.data
+
+    def test_mappings_without_joins(self):
+        data = self.get("/api/mappings/", fields="id,patient,doctor", expand="")
+        self.assertEqual(data["results"][0], {"id": self.mappings[0].id, "patient": self.patients[0].id, "doctor": self.doctors[0].id})
+        self.assertNotIn("JOIN", self.sql[-1])
+
+    def test_mappings_expand_one_relation(self):
+        data = self.get("/api/mappings/", fields="id,doctor.lastname,patient", expand="doctor", page_size=3)
+        self.assertEqual(data["results"][0], {"id": self.mappings[0].id, "patient": self.patients[0].id, "doctor": {"lastname": "Test"}})
+        self.assertNotIn('JOIN "hospital_patient"', self.sql[-1])
+        self.assertNotIn("email", self.sql[-1])
+
+        # the page still knows where it ended without assigned_at in the output
+        data = self.client.get(data["next"]).data
+        self.assertEqual([row["id"] for row in data["results"]], [self.mappings[3].id])
+
+    def test_asking_for_relation_fields_expands_it(self):
+        data = self.get("/api/mappings/", fields="patient.firstname", expand="")
+        self.assertEqual(data["results"][0], {"patient": {"firstname": "Patient0"}})
+
+    def test_defaults_are_unchanged(self):
+        data = self.get("/api/mappings/")
+        self.assertEqual(data["results"][0], MappingsDetailSerializer(self.mappings[0]).data)
+
+    def test_patients(self):
+        data = self.get("/api/patients/", fields="firstname")
+        self.assertEqual(data["results"], [{"firstname": "Patient0"}, {"firstname": "Patient1"}])
+        self.assertNotIn("lastname", self.sql[-1])
+        self.assertEqual(self.get(f"/api/patients/{self.patients[1].id}/", fields="id,age"), {"id": self.patients[1].id, "age": 30})
+        self.assertEqual(
+            self.get("/api/patients/batch/", ids=f"{self.patients[1].id}", fields="lastname"),
+            {"results": [{"lastname": "Test"}], "missing": []},
+        )
+
+    def test_doctors(self):
+        doctor = self.doctors[0]
+        self.assertEqual(self.get("/api/doctors/", fields="id,lastname")["results"][0], {"id": doctor.id, "lastname": "Test"})
+        # the detail entry is cached in full, both shapes come out of it
+        self.assertEqual(self.get(f"/api/doctors/{doctor.id}/", fields="specialization"), {"specialization": "GEN"})
+        self.assertEqual(self.get(f"/api/doctors/{doctor.id}/"), DoctorPublicSerializer(doctor).data)
+        self.assertEqual(len(self.sql), 1)  # the auth lookup
+
+        data = self.get(f"/api/mappings/{self.patients[0].id}/", fields="id")
+        self.assertEqual(data["doctors"], [{"id": doctor.id}, {"id": self.doctors[1].id}])
+
+    def test_unknown_names(self):
+        for url, params in (
+            ("/api/mappings/", {"fields": "id,secret"}),
+            ("/api/mappings/", {"expand": "assigned_at"}),
+            ("/api/patients/", {"fields": "email"}),
+            ("/api/doctors/", {"expand": "patient"}),
+            ("/api/doctors/", {"fields": ","}),
+        ):
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, (url, params))
+
+
+class RendererTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="testuser", password="password123")
+        response = self.client.post("/api/auth/login/", {"username": "testuser", "password": "password123"})
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+
+        patient = Patient.objects.create(firstname="Zoë", lastname="Test", email="zoe@example.com", age=30, gender="F", created_by=self.user)
+        doctor = Doctor.objects.create(firstname="Jane", lastname="Doe", email="jane@example.com", gender="F", specialization="CARD")
+        PatientDoctorMapping.objects.create(patient=patient, doctor=doctor)
+
+    def test_same_bytes_as_drf(self):
+        data = {
+            "mappings": mapping_rows.serialize(mapping_rows.values(PatientDoctorMapping.objects.all())),
+            "when": timezone.now(),
+            "whole_second": timezone.now().replace(microsecond=0),
+            "naive": datetime.datetime(2026, 1, 2, 3, 4, 5, 6),
+            "offset": datetime.datetime(2026, 1, 2, tzinfo=datetime.timezone(timedelta(hours=5, minutes=30))),
+            "time": datetime.time(1, 2, 3, 4),
+            "day": timezone.now().date(),
+            "price": Decimal("1.50"),
+            "line": "a\u2028b\u2029c",
+            1: None,
+        }
+        expected = JSONRenderer().render(data)
+        self.assertEqual(FastJSONRenderer().render(data), expected)
+        # the stdlib fallback, without orjson
+        with mock.patch("hospital.renderers.orjson", None):
+            self.assertEqual(FastJSONRenderer().render(data), expected)
+        # indented output isn't orjson's
+        self.assertEqual(FastJSONRenderer().render(data, "application/json; indent=4"), JSONRenderer().render(data, "application/json; indent=4"))
+
+    def test_parser(self):
+        parser = FastJSONParser()
+        self.assertEqual(parser.parse(io.BytesIO('{"name": "Zoë", "ids": [1, 2]}'.encode())), {"name": "Zoë", "ids": [1, 2]})
+        with self.assertRaises(ParseError):
+            parser.parse(io.BytesIO(b"{nope"))
+
+        response = self.client.post("/api/patients/", "{nope", content_type="application/json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post("/api/patients/", {"firstname": "Erling", "lastname": "Haaland", "email": "erling@example.com", "age": 26, "gender": "M"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_json_by_default(self):
+        response = self.client.get("/api/mappings/")
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertIn("Accept", response["Vary"])
+        self.assertEqual(json.loads(response.content)["results"][0]["patient"]["firstname"], "Zoë")
+
+    @skipUnless(settings.MSGPACK_ENABLED, "msgpack isn't installed")
+    def test_msgpack(self):
+        import msgpack
+
+        json_data = json.loads(self.client.get("/api/mappings/").content)
+        response = self.client.get("/api/mappings/", HTTP_ACCEPT="application/msgpack")
+        self.assertEqual(response["Content-Type"], "application/msgpack")
+        self.assertEqual(msgpack.unpackb(response.content), json_data)
+        self.assertEqual(msgpack.unpackb(self.client.get("/api/mappings/?format=msgpack").content), json_data)
+
+        body = msgpack.packb({"firstname": "Erling", "lastname": "Haaland", "email": "erling@example.com", "age": 26, "gender": "M"})
+        response = self.client.post("/api/patients/", body, content_type="application/msgpack")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    @skipIf(settings.MSGPACK_ENABLED, "msgpack is installed")
+    def test_no_msgpack(self):
+        response = self.client.get("/api/mappings/", HTTP_ACCEPT="application/msgpack")
+        self.assertEqual(response.status_code, status.HTTP_406_NOT_ACCEPTABLE)
+
+
+@skipUnless(connection.vendor == "postgresql", "trigram indexes only exist on PostgreSQL")
+class SearchPlanTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        DataGenerator(seed=2, batch_size=10000).doctors(50000)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE hospital_doctor")
+
+    def test_search_uses_trigram_indexes(self):
+        plan = search(Doctor.objects.all(), "smith", limit=20).explain()
+        self.assertNotIn("Seq Scan", plan)
+        self.assertIn("trgm_idx", plan)
+
+
+class AppointmentTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="password123")
+        response = self.client.post("/api/auth/login/", {"username": "testuser", "password": "password123"})
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+
+        self.doctor = Doctor.objects.create(firstname="Jane", lastname="Smith", email="jane@example.com", gender="F", specialization="CARD", max_appointments_per_day=2)
+        self.patients = [
+            Patient.objects.create(firstname=f"Patient{i}", lastname="Test", email=f"patient{i}@example.com", age=30, gender="M", created_by=self.user)
+            for i in range(3)
+        ]
+        for patient in self.patients:
+            PatientDoctorMapping.objects.create(patient=patient, doctor=self.doctor)
+        self.day = (timezone.localdate() + timedelta(days=1)).isoformat()
+
+    def book(self, patient, day=None):
+        return self.client.post("/api/appointments/", {"patient": patient.id, "doctor": self.doctor.id, "date": day or self.day}, format="json")
+
+    def booked(self):
+        return DoctorDayBookings.objects.get(doctor=self.doctor, date=self.day).booked
+
+    def test_cap_is_enforced(self):
+        response = self.book(self.patients[0])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["patient"], self.patients[0].id)
+        self.assertEqual(response.data["doctor"], self.doctor.id)
+        self.assertEqual(self.book(self.patients[1]).status_code, status.HTTP_201_CREATED)
+
+        response = self.book(self.patients[2])
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(Appointment.objects.count(), 2)
+        self.assertEqual(self.booked(), 2)
+
+        # another day has its own slots
+        next_day = (timezone.localdate() + timedelta(days=2)).isoformat()
+        self.assertEqual(self.book(self.patients[2], next_day).status_code, status.HTTP_201_CREATED)
+
+    def test_same_day_twice_is_a_conflict_and_keeps_the_slot(self):
+        self.book(self.patients[0])
+        self.assertEqual(self.book(self.patients[0]).status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(self.booked(), 1)
+
+    def test_rejected_bookings(self):
+        other_doctor = Doctor.objects.create(firstname="Greg", lastname="House", email="house@example.com", gender="M", specialization="GEN")
+        response = self.client.post("/api/appointments/", {"patient": self.patients[0].id, "doctor": other_doctor.id, "date": self.day}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        other_user = User.objects.create_user(username="otheruser", password="password123")
+        stranger = Patient.objects.create(firstname="Other", lastname="Patient", email="other@example.com", age=30, gender="M", created_by=other_user)
+        PatientDoctorMapping.objects.create(patient=stranger, doctor=self.doctor)
+        self.assertEqual(self.book(stranger).status_code, status.HTTP_404_NOT_FOUND)
+
+        self.assertEqual(self.book(self.patients[0], "2000-01-01").status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_cancelling_frees_the_slot(self):
+        appointment_id = self.book(self.patients[0]).data["id"]
+        self.book(self.patients[1])
+
+        response = self.client.delete(f"/api/appointments/{appointment_id}/")
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.booked(), 1)
+        self.assertEqual(self.book(self.patients[2]).status_code, status.HTTP_201_CREATED)
+
+        # deleting the mapping takes its appointment along, and its slot comes back too
+        PatientDoctorMapping.objects.get(patient=self.patients[2]).delete()
+        self.assertEqual(self.booked(), 1)
+
+    def test_list(self):
+        self.book(self.patients[0])
+        self.book(self.patients[1])
+        response = self.client.get("/api/appointments/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row["patient"] for row in response.data["results"]], [self.patients[0].id, self.patients[1].id])
+
+
+class RosterStatsTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="password123")
+        response = self.client.post("/api/auth/login/", {"username": "testuser", "password": "password123"})
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+
+        self.doctors = [
+            Doctor.objects.create(firstname=f"Doctor{i}", lastname="Test", email=f"doctor{i}@example.com", gender="F", specialization=spec)
+            for i, spec in enumerate(["CARD", "CARD", "NEUR"])
+        ]
+        self.patients = [
+            Patient.objects.create(firstname=f"Patient{i}", lastname="Test", email=f"patient{i}@example.com", age=30, gender="M", created_by=self.user)
+            for i in range(3)
+        ]
+
+    def counts(self):
+        doctors = dict(Doctor.objects.values_list("id", "patient_count"))
+        patients = dict(Patient.objects.values_list("id", "doctor_count"))
+        return [doctors[doctor.id] for doctor in self.doctors], [patients[patient.id] for patient in self.patients]
+
+    def assign(self, patient, doctor):
+        response = self.client.post("/api/mappings/", {"patient": patient.id, "doctor": doctor.id}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_mappings_move_the_counters(self):
+        self.assign(self.patients[0], self.doctors[0])
+        self.assign(self.patients[1], self.doctors[0])
+        self.assign(self.patients[0], self.doctors[1])
+        self.client.post("/api/mappings/bulk/", {"patient_ids": [self.patients[2].id], "doctor_ids": [d.id for d in self.doctors]}, format="json")
+        self.assertEqual(self.counts(), ([3, 2, 1], [2, 1, 3]))
+
+        self.client.delete(f"/api/mappings/{self.patients[0].id}/{self.doctors[0].id}/")
+        self.assertEqual(self.counts(), ([2, 2, 1], [1, 1, 3]))
+
+    def test_cascades(self):
+        for patient in self.patients:
+            for doctor in self.doctors:
+                PatientDoctorMapping.objects.create(patient=patient, doctor=doctor)
+
+        self.client.delete(f"/api/patients/{self.patients[0].id}/")
+        self.patients.pop(0)
+        self.assertEqual(self.counts(), ([2, 2, 2], [3, 3]))
+
+        self.client.delete(f"/api/doctors/{self.doctors[0].id}/")
+        self.doctors.pop(0)
+        self.assertEqual(self.counts(), ([2, 2], [2, 2]))
+
+        # a queryset delete, one batch for everything it cascades into
+        with CaptureQueriesContext(connection) as queries:
+            Patient.objects.filter(created_by=self.user).delete()
+        self.assertEqual([doctor.patient_count for doctor in Doctor.objects.order_by("id")], [0, 0])
+        self.assertEqual(sum('UPDATE "hospital_doctor"' in query["sql"] for query in queries), 1)
+
+    def test_summary(self):
+        response = self.client.get("/api/stats/")
+        self.assertEqual(response.data["doctors"], 3)
+        self.assertEqual(response.data["doctors_by_specialization"], {"CARD": 2, "DERM": 0, "NEUR": 1, "ORTH": 0, "PED": 0, "GEN": 0})
+
+        self.client.put(f"/api/doctors/{self.doctors[0].id}/", {"specialization": "PED"}, format="json")
+        self.doctors[2].delete()
+        response = self.client.get("/api/stats/")
+        self.assertEqual(response.data["doctors"], 2)
+        self.assertEqual(response.data["doctors_by_specialization"]["CARD"], 1)
+        self.assertEqual(response.data["doctors_by_specialization"]["NEUR"], 0)
+        self.assertEqual(response.data["doctors_by_specialization"]["PED"], 1)
+
+    def test_per_row_endpoints(self):
+        self.assign(self.patients[0], self.doctors[0])
+        self.assign(self.patients[1], self.doctors[0])
+
+        # the auth lookup and the counter itself
+        with self.assertNumQueries(2):
+            response = self.client.get(f"/api/stats/doctors/{self.doctors[0].id}/")
+        self.assertEqual(response.data, {"id": self.doctors[0].id, "patients": 2})
+        self.assertEqual(self.client.get(f"/api/stats/patients/{self.patients[0].id}/").data, {"id": self.patients[0].id, "doctors": 1})
+
+        response = self.client.get("/api/stats/doctors/", {"page_size": 2})
+        self.assertEqual(response.data["results"], [{"id": self.doctors[0].id, "patients": 2}, {"id": self.doctors[1].id, "patients": 0}])
+        self.assertIsNotNone(response.data["next"])
+        self.assertEqual([row["doctors"] for row in self.client.get("/api/stats/patients/").data["results"]], [1, 1, 0])
+
+        other_user = User.objects.create_user(username="otheruser", password="password123")
+        stranger = Patient.objects.create(firstname="Other", lastname="Patient", email="other@example.com", age=30, gender="M", created_by=other_user)
+        self.assertEqual(self.client.get(f"/api/stats/patients/{stranger.id}/").status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get("/api/stats/doctors/999999/").status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_reconcile(self):
+        # bulk_create skips the signals, so the counters drift
+        PatientDoctorMapping.objects.bulk_create([PatientDoctorMapping(patient=patient, doctor=self.doctors[0]) for patient in self.patients])
+        Doctor.objects.bulk_create([Doctor(firstname="Bulk", lastname="Doc", email="bulk@example.com", gender="M", specialization="GEN")])
+        self.assertEqual(self.counts(), ([0, 0, 0], [0, 0, 0]))
+
+        out = io.StringIO()
+        call_command("reconcile_stats", dry_run=True, stdout=out)
+        self.assertIn("doctor.patient_count: 1 drifted", out.getvalue())
+        self.assertEqual(self.counts(), ([0, 0, 0], [0, 0, 0]))
+
+        call_command("reconcile_stats", stdout=io.StringIO())
+        self.assertEqual(self.counts(), ([3, 0, 0], [1, 1, 1]))
+        self.assertEqual(self.client.get("/api/stats/").data["doctors_by_specialization"]["GEN"], 1)
+        self.assertEqual(reconcile(dry_run=True), {"doctor.patient_count": 0, "patient.doctor_count": 0, "specializations": 0})
+
+
+class ConditionalGetTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="testuser", password="password123")
+        response = self.client.post("/api/auth/login/", {"username": "testuser", "password": "password123"})
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+
+        self.patient = Patient.objects.create(firstname="John", lastname="Doe", email="john@example.com", age=30, gender="M", created_by=self.user)
+        self.doctor = Doctor.objects.create(firstname="Jane", lastname="Smith", email="jane@example.com", gender="F", specialization="CARD")
+        PatientDoctorMapping.objects.create(patient=self.patient, doctor=self.doctor)
+
+    def revalidate(self, url, response, queries=None):
+        # asks again with the validators of `response`, returns the status
+        headers = {"HTTP_IF_NONE_MATCH": response["ETag"]}
+        if queries is None:
+            return self.client.get(url, **headers).status_code
+        with self.assertNumQueries(queries):
+            return self.client.get(url, **headers).status_code
+
+    def test_detail_endpoints(self):
+        for url, model, changes in (
+            (f"/api/patients/{self.patient.id}/", Patient, {"age": 31}),
+            (f"/api/doctors/{self.doctor.id}/", Doctor, {"firstname": "Janet"}),
+        ):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertTrue(response["ETag"].startswith('W/"'))
+                self.assertIn("Last-Modified", response)
+
+                not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+                self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+                self.assertEqual(not_modified.content, b"")
+                self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]).status_code, status.HTTP_304_NOT_MODIFIED)
+
+                updated = self.client.put(url, changes, format="json")
+                self.assertNotEqual(updated["ETag"], response["ETag"])
+                self.assertEqual(self.revalidate(url, response), status.HTTP_200_OK)
+                self.assertEqual(self.revalidate(url, updated), status.HTTP_304_NOT_MODIFIED)
+
+    def test_304_skips_the_row(self):
+        url = f"/api/patients/{self.patient.id}/"
+        # auth user lookup and the updated_at lookup, the row itself isn't read
+        self.assertEqual(self.revalidate(url, self.client.get(url), queries=2), status.HTTP_304_NOT_MODIFIED)
+
+        # the cached doctor needs no query at all
+        url = f"/api/doctors/{self.doctor.id}/"
+        self.assertEqual(self.revalidate(url, self.client.get(url), queries=1), status.HTTP_304_NOT_MODIFIED)
+
+    @override_settings(LIST_ETAGS=True)
+    def test_patient_list(self):
+        url = "/api/patients/"
+        response = self.client.get(url)
+        # only the auth user lookup, the version comes from the cache
+        self.assertEqual(self.revalidate(url, response, queries=1), status.HTTP_304_NOT_MODIFIED)
+
+        # another user's patients don't move this list's version
+        someone = User.objects.create_user(username="someone", password="password123")
+        Patient.objects.create(firstname="Bo", lastname="Kim", email="bo@example.com", age=20, gender="M", created_by=someone)
+        self.assertEqual(self.revalidate(url, response), status.HTTP_304_NOT_MODIFIED)
+
+        # an update of one of their own does
+        self.client.put(f"/api/patients/{self.patient.id}/", {"age": 32}, format="json")
+        self.assertEqual(self.revalidate(url, response), status.HTTP_200_OK)
+
+        # the bulk import skips the signals and bumps it itself
+        response = self.client.get(url)
+        self.client.post("/api/patients/bulk/", [{"firstname": "Cy", "lastname": "Ng", "email": "cy@example.com", "age": 50, "gender": "M"}], format="json")
+        self.assertEqual(self.revalidate(url, response), status.HTTP_200_OK)
+
+        response = self.client.get(url)
+
+        other = Patient.objects.create(firstname="Ann", lastname="Lee", email="ann@example.com", age=40, gender="F", created_by=self.user)
+        self.assertEqual(self.revalidate(url, response), status.HTTP_200_OK)
+
+        response = self.client.get(url)
+        other.delete()
+        self.assertEqual(self.revalidate(url, response), status.HTTP_200_OK)
+
+        # other pages of the same list have their own ETag
+        self.assertNotEqual(self.client.get(url, {"page_size": 1})["ETag"], self.client.get(url)["ETag"])
+
+    @override_settings(LIST_ETAGS=True)
+    def test_doctor_and_mapping_lists(self):
+        for url in ("/api/doctors/", "/api/mappings/"):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(self.revalidate(url, response), status.HTTP_304_NOT_MODIFIED)
+
+                self.doctor.lastname = f"Changed{url}"
+                self.doctor.save()
+                self.assertEqual(self.revalidate(url, response), status.HTTP_200_OK)
+
+        # the mappings list also shows the patients
+        response = self.client.get("/api/mappings/")
+        self.client.put(f"/api/patients/{self.patient.id}/", {"lastname": "Changed"}, format="json")
+        self.assertEqual(self.revalidate("/api/mappings/", response), status.HTTP_200_OK)
+
+        # bulk assignments skip the signals and bump the version themselves
+        [house] = Doctor.objects.bulk_create([Doctor(firstname="Greg", lastname="House", email="house@example.com", gender="M", specialization="GEN")])
+        response = self.client.get("/api/mappings/")
+        self.client.post("/api/mappings/bulk/", {"pairs": [{"patient": self.patient.id, "doctor": house.id}]}, format="json")
+        self.assertEqual(self.revalidate("/api/mappings/", response), status.HTTP_200_OK)
+
+    @override_settings(LIST_ETAGS=False)
+    def test_lists_without_a_shared_cache(self):
+        # another worker's cache wouldn't see the version bumps, so the lists carry no ETag
+        for url in ("/api/patients/", "/api/doctors/", "/api/mappings/"):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertNotIn("ETag", response)
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH="*").status_code, status.HTTP_200_OK)
+
+        # the details are versioned by the database and keep theirs
+        self.assertIn("ETag", self.client.get(f"/api/mappings/{self.patient.id}/"))
+
+    def test_mapping_detail(self):
+        url = f"/api/mappings/{self.patient.id}/"
+        response = self.client.get(url)
+        self.assertEqual(self.revalidate(url, response), status.HTTP_304_NOT_MODIFIED)
+
+        # a doctor of the patient changed
+        self.doctor.lastname = "Changed"
+        self.doctor.save()
+        self.assertEqual(self.revalidate(url, response), status.HTTP_200_OK)
+
+        # a doctor got unassigned
+        response = self.client.get(url)
+        PatientDoctorMapping.objects.filter(patient=self.patient).delete()
+        self.assertEqual(self.revalidate(url, response), status.HTTP_200_OK)
+
+
+class AvailabilityTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="password123")
+        response = self.client.post("/api/auth/login/", {"username": "testuser", "password": "password123"})
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+
+        self.cardiologist = Doctor.objects.create(firstname="Jane", lastname="Smith", email="jane@example.com", gender="F", specialization="CARD", max_appointments_per_day=2)
+        self.surgeon = Doctor.objects.create(firstname="Greg", lastname="House", email="house@example.com", gender="M", specialization="NEUR", max_appointments_per_day=5)
+        self.patient = Patient.objects.create(firstname="John", lastname="Doe", email="john@example.com", age=30, gender="M", created_by=self.user)
+        self.mapping = PatientDoctorMapping.objects.create(patient=self.patient, doctor=self.cardiologist)
+        self.day = (timezone.localdate() + timedelta(days=1)).isoformat()
+
+    def available(self, **params):
+        response = self.client.get("/api/doctors/availability/", {"date": self.day, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [(row["id"], row["remaining"]) for row in response.data["results"]]
+
+    def materialize(self):
+        call_command("materialize_availability", days=2, stdout=io.StringIO())
+
+    def test_queries_never_write(self):
+        book(self.mapping, self.day)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.available(), [(self.surgeon.id, 5), (self.cardiologist.id, 1)])
+        self.assertFalse(any(query["sql"].startswith(("INSERT", "UPDATE")) for query in queries))
+        self.assertFalse(AvailabilityDay.objects.filter(date=self.day).exists())
+        self.assertEqual(DoctorDayBookings.objects.filter(date=self.day).count(), 1)
+
+        # the command fills the day in, same answer off the index
+        self.materialize()
+        self.assertTrue(AvailabilityDay.objects.filter(date=self.day).exists())
+        self.assertEqual(DoctorDayBookings.objects.filter(date=self.day).count(), 2)
+        self.assertEqual(self.available(), [(self.surgeon.id, 5), (self.cardiologist.id, 1)])
+
+    def test_booking_horizon(self):
+        with self.settings(BOOKING_HORIZON_DAYS=30):
+            call_command("materialize_availability", stdout=io.StringIO())
+            self.assertEqual(AvailabilityDay.objects.count(), 31)
+
+            last = (timezone.localdate() + timedelta(days=30)).isoformat()
+            beyond = (timezone.localdate() + timedelta(days=31)).isoformat()
+            self.assertEqual(self.client.get("/api/doctors/availability/", {"date": last}).status_code, status.HTTP_200_OK)
+            self.assertEqual(self.client.get("/api/doctors/availability/", {"date": beyond}).status_code, status.HTTP_400_BAD_REQUEST)
+
+            response = self.client.post("/api/appointments/", {"patient": self.patient.id, "doctor": self.cardiologist.id, "date": beyond}, format="json")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(DoctorDayBookings.objects.filter(date=beyond).exists())
+
+    def test_specialization_filter(self):
+        self.assertEqual(self.available(specialization="CARD"), [(self.cardiologist.id, 2)])
+        self.assertEqual(self.available(specialization="GEN"), [])
+
+    def test_bookings_update_remaining(self):
+        self.materialize()
+        appointment = book(self.mapping, self.day)
+        self.assertEqual(self.available(specialization="CARD"), [(self.cardiologist.id, 1)])
+
+        other = Patient.objects.create(firstname="Ann", lastname="Lee", email="ann@example.com", age=40, gender="F", created_by=self.user)
+        book(PatientDoctorMapping.objects.create(patient=other, doctor=self.cardiologist), self.day)
+        # fully booked doctors drop out
+        self.assertEqual(self.available(), [(self.surgeon.id, 5)])
+
+        appointment.delete()
+        self.assertEqual(self.available(specialization="CARD"), [(self.cardiologist.id, 1)])
+
+    def test_doctor_changes_are_kept(self):
+        self.materialize()
+        newcomer = Doctor.objects.create(firstname="Lisa", lastname="Cuddy", email="cuddy@example.com", gender="F", specialization="CARD", max_appointments_per_day=3)
+        self.assertEqual(self.available(specialization="CARD"), [(newcomer.id, 3), (self.cardiologist.id, 2)])
+
+        book(self.mapping, self.day)
+        self.cardiologist.max_appointments_per_day = 6
+        self.cardiologist.save()
+        self.assertEqual(self.available(specialization="CARD"), [(self.cardiologist.id, 5), (newcomer.id, 3)])
+
+        self.surgeon.specialization = "CARD"
+        self.surgeon.save()
+        self.assertEqual(self.available(specialization="NEUR"), [])
+        self.assertEqual(len(self.available(specialization="CARD")), 3)
+
+    def test_refresh_picks_up_bulk_created_doctors(self):
+        self.materialize()
+        Doctor.objects.bulk_create([Doctor(firstname="Bulk", lastname="Doc", email="bulk@example.com", gender="M", specialization="GEN", max_appointments_per_day=4)])
+        self.assertEqual(self.available(specialization="GEN"), [])
+
+        call_command("materialize_availability", days=2, refresh=True, stdout=io.StringIO())
+        self.assertEqual([remaining for _, remaining in self.available(specialization="GEN")], [4])
+
+    def test_invalid_queries(self):
+        for params in ({"date": "2000-01-01"}, {"specialization": "NOPE"}, {"date": "tomorrow"}):
+            response = self.client.get("/api/doctors/availability/", {"date": self.day, **params})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(CHANGES_SETTLE_SECONDS=0)
+class ChangeFeedTests(APITestCase):
+    def setUp(self):
+        # the oldest entry is cached, and ids start over with every test's rolled back transaction
+        cache.clear()
+        self.user = User.objects.create_user(username="testuser", password="password123")
+        self.other = User.objects.create_user(username="otheruser", password="password123")
+        response = self.client.post("/api/auth/login/", {"username": "testuser", "password": "password123"})
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        self.cursor = self.client.get("/api/changes/", {"since": "latest"}).data["cursor"]
+
+    def sync(self, **params):
+        # follows the pages like a client would, returns the changes and keeps the cursor
+        changes = []
+        while True:
+            response = self.client.get("/api/changes/", {"since": self.cursor, **params})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            changes.extend((change["model"], change["id"], change["op"]) for change in response.data["changes"])
+            self.last_page = response.data
+            self.cursor = response.data["cursor"]
+            if not response.data["has_more"]:
+                return changes
+
+    def create_patient(self, owner, i):
+        return Patient.objects.create(firstname=f"Patient{i}", lastname="Test", email=f"patient{i}@example.com", age=30, gender="M", created_by=owner)
+
+    def test_inserts_updates_and_tombstones(self):
+        response = self.client.post("/api/patients/", {"firstname": "Erling", "lastname": "Haaland", "email": "erling@example.com", "age": 26, "gender": "M"})
+        patient_id = response.data["id"]
+        self.client.put(f"/api/patients/{patient_id}/", {"firstname": "Kevin"})
+        doctor = Doctor.objects.create(firstname="Jane", lastname="Doe", email="jane@example.com", gender="F", specialization="CARD")
+
+        # the insert and the update come as one insert carrying the current row
+        self.assertEqual(self.sync(), [("patient", patient_id, "insert"), ("doctor", doctor.id, "insert")])
+        self.assertEqual(self.last_page["changes"][0]["data"]["firstname"], "Kevin")
+        self.assertEqual(self.last_page["changes"][1]["data"], DoctorPublicSerializer(doctor).data)
+
+        self.client.put(f"/api/patients/{patient_id}/", {"age": 27})
+        self.assertEqual(self.sync(), [("patient", patient_id, "update")])
+        self.client.delete(f"/api/patients/{patient_id}/")
+        self.assertEqual(self.sync(), [("patient", patient_id, "delete")])
+        self.assertNotIn("data", self.last_page["changes"][0])
+        self.assertEqual(self.sync(), [])
+
+    def test_only_the_users_patients(self):
+        mine = self.create_patient(self.user, 0)
+        theirs = self.create_patient(self.other, 1)
+        doctor = Doctor.objects.create(firstname="Jane", lastname="Doe", email="jane@example.com", gender="F", specialization="CARD")
+        mapping = PatientDoctorMapping.objects.create(patient=mine, doctor=doctor)
+        PatientDoctorMapping.objects.create(patient=theirs, doctor=doctor)
+
+        self.assertEqual(self.sync(), [("patient", mine.id, "insert"), ("doctor", doctor.id, "insert"), ("mapping", mapping.id, "insert")])
+
+    def test_cascaded_deletes_in_one_insert(self):
+        doctors = [
+            Doctor.objects.create(firstname=f"Doctor{i}", lastname="Test", email=f"doctor{i}@example.com", gender="F", specialization="CARD")
+            for i in range(2)
+        ]
+        patient = self.create_patient(self.user, 0)
+        mappings = [PatientDoctorMapping.objects.create(patient=patient, doctor=doctor) for doctor in doctors]
+        patient_id = patient.id
+        self.sync()
+
+        with CaptureQueriesContext(connection) as queries:
+            patient.delete()
+        inserts = [query for query in queries.captured_queries if query["sql"].startswith('INSERT INTO "hospital_changelog"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(sorted(self.sync()), sorted([("mapping", mapping.id, "delete") for mapping in mappings] + [("patient", patient_id, "delete")]))
+
+        # a doctor's mappings belong to their patients' owners
+        theirs = PatientDoctorMapping.objects.create(patient=self.create_patient(self.other, 1), doctor=doctors[0])
+        doctor_id = doctors[0].id
+        self.sync()
+        doctors[0].delete()
+        self.assertEqual(self.sync(), [("doctor", doctor_id, "delete")])
+        self.assertTrue(ChangeLog.objects.filter(model="mapping", object_id=theirs.id, op="delete", owner=self.other.id).exists())
+
+    def test_bulk_writes_are_logged(self):
+        doctor = Doctor.objects.create(firstname="Jane", lastname="Doe", email="jane@example.com", gender="F", specialization="CARD")
+        rows = [{"firstname": f"Bulk{i}", "lastname": "Test", "email": f"bulk{i}@example.com", "age": 40, "gender": "F"} for i in range(3)]
+        self.client.post("/api/patients/bulk/", rows, format="json")
+        patient_ids = sorted(Patient.objects.filter(created_by=self.user).values_list("id", flat=True))
+        self.client.post("/api/mappings/bulk/", {"patient_ids": patient_ids, "doctor_ids": [doctor.id]}, format="json")
+
+        changes = self.sync()
+        self.assertEqual([change for change in changes if change[0] == "patient"], [("patient", pk, "insert") for pk in patient_ids])
+        self.assertEqual(len([change for change in changes if change[0] == "mapping"]), 3)
+
+    def test_pages(self):
+        patients = [self.create_patient(self.user, i) for i in range(5)]
+        response = self.client.get("/api/changes/", {"since": self.cursor, "limit": 2})
+        self.assertTrue(response.data["has_more"])
+        self.assertEqual(len(response.data["changes"]), 2)
+        self.assertEqual(self.sync(limit=2), [("patient", patient.id, "insert") for patient in patients])
+
+    def test_nothing_new_is_one_query(self):
+        self.sync()
+        # the auth lookup and the range scan on the log
+        with self.assertNumQueries(2):
+            response = self.client.get("/api/changes/", {"since": self.cursor})
+        self.assertEqual(response.data, {"changes": [], "cursor": self.cursor, "has_more": False})
+
+    @override_settings(CHANGES_SETTLE_SECONDS=60)
+    def test_recent_entries_wait(self):
+        self.create_patient(self.user, 0)
+        self.assertEqual(self.sync(), [])
+
+    def test_expired_cursor(self):
+        for i in range(3):
+            self.create_patient(self.user, i)
+        ChangeLog.objects.update(created_at=timezone.now() - timedelta(days=40))
+        call_command("prune_changes", stdout=io.StringIO())
+
+        response = self.client.get("/api/changes/", {"since": self.cursor})
+        self.assertEqual(response.status_code, status.HTTP_410_GONE)
+        # the newest entry is kept, a client that had it carries on
+        self.cursor = self.client.get("/api/changes/", {"since": "latest"}).data["cursor"]
+        self.assertEqual(self.sync(), [])
+
+    def test_invalid_cursor(self):
+        for since in ("-1", "abc"):
+            response = self.client.get("/api/changes/", {"since": since})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@skipUnless(connection.vendor == "postgresql", "sqlite can't take concurrent writers")
+class BookingStressTests(TransactionTestCase):
+    def test_concurrent_bookings_never_overbook(self):
+        mappings = seed_booking(doctors=3, patients=60, capacity=10)
+        result = run_booking_stress(mappings, days=2, threads=12)
+
+        self.assertEqual(result["violations"], [])
+        self.assertEqual(result["outcomes"].get("error", 0), 0)
+        self.assertEqual(result["outcomes"]["booked"], 3 * 2 * 10)
+        self.assertEqual(Appointment.objects.count(), 3 * 2 * 10)
@@ -1,18 +1,54 @@
 from django.urls import path
-from . import views
+from . import views, async_views
 from rest_framework_simplejwt.views import TokenObtainPairView
 
 urlpatterns = [
     path("patients/", views.patients_list, name="patients-list"),
     path("patients/<int:pk>/", views.patient_detail),
+    path("patients/bulk/", views.patients_bulk_create),
+    path("patients/export/", views.patients_export),
+    path("patients/search/", views.patients_search),
+    path("patients/batch/", views.patients_batch),
     
     path("auth/register/", views.register, name="register"),
     path("auth/login/", TokenObtainPairView.as_view(), name="login"),
 
     path("doctors/", views.doctors_list),
     path("doctors/<int:pk>/", views.doctor_detail),
+    path("doctors/cache-stats/", views.doctor_cache_stats),
+    path("doctors/search/", views.doctors_search),
+    path("doctors/batch/", views.doctors_batch),
+    path("doctors/availability/", views.doctors_availability),
 
     path("mappings/", views.mappings_list),
+    path("mappings/bulk/", views.mappings_bulk_create),
+    path("mappings/export/", views.mappings_export),
     path("mappings/<int:patient_id>/", views.mapping_detail),
     path("mappings/<int:pk>/<int:doc_id>/", views.mapping_delete),
-]
\ No newline at end of file
+
+    path("appointments/", views.appointments_list),
+    path("appointments/<int:pk>/", views.appointment_detail),
+
+    path("stats/", views.stats_summary),
+    path("stats/doctors/", views.stats_doctors),
+    path("stats/doctors/<int:pk>/", views.stats_doctor),
+    path("stats/patients/", views.stats_patients),
+    path("stats/patients/<int:pk>/", views.stats_patient),
+
+    path("changes/", views.changes_feed),
+
+    path("db/pool-stats/", views.db_pool_stats),
+    path("metrics/", views.metrics),
+    path("profiles/", views.profiles_list),
+    path("profiles/token/", views.profile_token),
+    path("profiles/sampling/", views.profile_sampling),
+    path("profiles/<str:profile_id>/", views.profile_download),
+
+    # same endpoints as native async views, for serving under ASGI
+    path("async/patients/", async_views.patients_list),
+    path("async/patients/<int:pk>/", async_views.patient_detail),
+    path("async/doctors/", async_views.doctors_list),
+    path("async/doctors/<int:pk>/", async_views.doctor_detail),
+    path("async/mappings/", async_views.mappings_list),
+    path("async/mappings/<int:patient_id>/", async_views.mapping_detail),
+]
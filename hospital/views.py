@@ -1,4 +1,4 @@
-from .models import Patient, Doctor, PatientDoctorMapping
+from .models import Patient, Doctor, PatientDoctorMapping, Appointment
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from .serializers import (
@@ -10,12 +10,40 @@ from .serializers import (
     DoctorPublicSerializer,
     DoctorCreateSerializer,
     DoctorUpdateSerializer,
+    DoctorFilterSerializer,
 
     MappingsSerializer,
-    MappingsDetailSerializer
+    MappingsBulkSerializer,
+    SearchQuerySerializer,
+    BatchQuerySerializer,
+    SparseFieldsSerializer,
+    ChangesQuerySerializer,
+    AvailabilityQuerySerializer,
+    ProfileSamplingSerializer,
+
+    AppointmentSerializer,
+    AppointmentCreateSerializer
 )
+from .pagination import KeysetPagination
+from .bulk import iter_rows, import_patients, assign_doctors
+from . import exports
+from .fastpath import patient_rows, doctor_rows, mapping_rows
+from django.conf import settings
+from . import cache
+from .pool import all_pool_stats
+from .metrics import request_metrics, HasMetricsToken
+from . import profiling
+from .stats import specialization_counts
+from . import changes
+from django.http import HttpResponse
+import json
+from .search import search
+from .booking import book, BookingError
+from .availability import available_doctors
+from .conditional import row_etag, version_etag, list_etag, is_conditional, not_modified, with_validators
+from django.db.models import Count, Max
 from rest_framework import status
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 
 # ----- Patient endpoints -----
 
@@ -24,37 +52,137 @@ from rest_framework.permissions import IsAuthenticated
 def patients_list(request):
     if request.method == "GET":
         # getting only the patients that are owned by the logged in user
-        patients = Patient.objects.filter(created_by=request.user)
-        serializer = PatientPublicSerializer(patients, many=True)
+        # (by id, with stateless auth request.user is a TokenUser, not a User row)
+        owned = Patient.objects.filter(created_by_id=request.user.id)
+        sparse = SparseFieldsSerializer(data=request.query_params, context={"rows": patient_rows})
+        if not sparse.is_valid():
+            return Response(sparse.errors, status=status.HTTP_400_BAD_REQUEST)
+        rows = sparse.validated_data["rows"]
+
+        # the owner's list version moves with every write to one of their patients, a 304 costs
+        # no query. No Last-Modified, a delete doesn't make anything newer
+        etag = list_etag(request, lambda: cache.get_patients_version(request.user.id), request.user.id)
+        unchanged = not_modified(request, etag)
+        if unchanged is not None:
+            return unchanged
+
+        # read-only output goes through the .values() fast path, same JSON as PatientPublicSerializer
+        # (or the part of it ?fields= asks for, reading only those columns)
+        paginator = KeysetPagination(ordering=("id",))
+        page = paginator.paginate_queryset(rows.values(owned, "id"), request)
 
-        return Response(serializer.data, status=200)
+        return with_validators(paginator.get_paginated_response(rows.serialize(page)), etag)
     
     elif request.method == "POST":
         serializer = PatientCreateSerializer(data=request.data)
 
         if serializer.is_valid():
-            patient = serializer.save(created_by=request.user)
+            patient = serializer.save(created_by_id=request.user.id)
             resp_serializer = PatientPublicSerializer(patient)
             return Response(resp_serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+def patients_bulk_create(request):
+    # the body (a JSON array or NDJSON) is read as a stream, never through request.data
+    try:
+        batch_size = int(request.query_params.get("batch_size", settings.BULK_BATCH_SIZE))
+    except ValueError:
+        batch_size = settings.BULK_BATCH_SIZE
+    batch_size = max(1, min(batch_size, settings.BULK_MAX_BATCH_SIZE))
+
+    rows = iter_rows(request.stream, request.content_type)
+    report = import_patients(rows, request.user, batch_size)
+
+    if report["created"] == 0 and report["failed"]:
+        return Response(report, status=status.HTTP_400_BAD_REQUEST)
+    return Response(report, status=status.HTTP_201_CREATED)
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def patients_export(request):
+    # ?fmt= rather than ?format=, DRF reserves format for picking a renderer
+    export_format = request.query_params.get("fmt", "ndjson")
+    if export_format not in exports.FORMATS:
+        return Response({"detail": f"fmt must be one of {', '.join(exports.FORMATS)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+    return exports.export_patients(request.user, export_format)
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def patients_search(request):
+    params = SearchQuerySerializer(data=request.query_params)
+    sparse = SparseFieldsSerializer(data=request.query_params, context={"rows": patient_rows})
+    if not all([params.is_valid(), sparse.is_valid()]):
+        return Response({**params.errors, **sparse.errors}, status=status.HTTP_400_BAD_REQUEST)
+    rows = sparse.validated_data["rows"]
+
+    # only the user's own patients, like the listing
+    patients = search(
+        Patient.objects.filter(created_by_id=request.user.id),
+        params.validated_data["q"], params.validated_data.get("limit", settings.SEARCH_LIMIT),
+    )
+    return Response({"results": rows.serialize(rows.values(patients))}, status=status.HTTP_200_OK)
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def patients_batch(request):
+    # ?ids=3,1,2 in one query instead of a detail request per id, results in the order asked.
+    # Other users' patients are reported missing, same as ones that don't exist
+    params = BatchQuerySerializer(data=request.query_params)
+    sparse = SparseFieldsSerializer(data=request.query_params, context={"rows": patient_rows})
+    if not all([params.is_valid(), sparse.is_valid()]):
+        return Response({**params.errors, **sparse.errors}, status=status.HTTP_400_BAD_REQUEST)
+    rows = sparse.validated_data["rows"]
+
+    ids = params.validated_data["ids"]
+    found = {
+        row["id"]: rows.to_representation(row)
+        for row in rows.values(Patient.objects.filter(created_by_id=request.user.id, id__in=ids), "id")
+    }
+    return Response({
+        "results": [found[pk] for pk in ids if pk in found],
+        "missing": [pk for pk in ids if pk not in found],
+    }, status=status.HTTP_200_OK)
+
+
 @api_view(["GET", "PUT", "DELETE"])
 def patient_detail(request, pk):
+    if request.method == "GET" and is_conditional(request):
+        # a client revalidating its copy: look up the version only, and skip the row if it matches
+        updated_at = Patient.objects.filter(pk=pk).values_list("updated_at", flat=True).first()
+        if updated_at is not None:
+            unchanged = not_modified(request, row_etag(pk, updated_at), updated_at)
+            if unchanged is not None:
+                return unchanged
+
+    if request.method == "GET":
+        sparse = SparseFieldsSerializer(data=request.query_params, context={"rows": patient_rows})
+        if not sparse.is_valid():
+            return Response(sparse.errors, status=status.HTTP_400_BAD_REQUEST)
+        rows = sparse.validated_data["rows"]
+
+        # the columns of the fields asked for and the version, not a whole model instance
+        row = rows.values(Patient.objects.filter(pk=pk), "updated_at").first()
+        if row is None:
+            return Response({"msg": "Patient Not Found"}, status=status.HTTP_404_NOT_FOUND)
+        return with_validators(Response(rows.to_representation(row), status=200), row_etag(pk, row["updated_at"]), row["updated_at"])
+
     try:
         patient = Patient.objects.get(pk=pk)
     except Patient.DoesNotExist:
         return Response({"msg": "Patient Not Found"}, status=status.HTTP_404_NOT_FOUND)
 
-    if request.method == "GET":
-        serializer = PatientPublicSerializer(patient)
-        return Response(serializer.data, status=200)
-
-    elif request.method == "PUT":
+    if request.method == "PUT":
         serializer = PatientUpdateSerializer(patient, data=request.data, partial=True)
         if serializer.is_valid():
             serializer.save()
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            return with_validators(Response(serializer.data, status=status.HTTP_200_OK), row_etag(pk, patient.updated_at), patient.updated_at)
         else:
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     elif request.method == "DELETE":
@@ -80,10 +208,29 @@ def register(request):
 @api_view(["GET", "POST"])
 def doctors_list(request):
     if request.method == "GET":
-        doctors = Doctor.objects.all()
-        serializer = DoctorPublicSerializer(doctors, many=True)
+        filters = DoctorFilterSerializer(data=request.query_params)
+        sparse = SparseFieldsSerializer(data=request.query_params, context={"rows": doctor_rows})
+        if not all([filters.is_valid(), sparse.is_valid()]):
+            return Response({**filters.errors, **sparse.errors}, status=status.HTTP_400_BAD_REQUEST)
+        rows = sparse.validated_data["rows"]
+
+        # the ETag hangs off the same version as the cached pages, a 304 costs no query at all
+        etag = list_etag(request, cache.get_doctors_version)
+        unchanged = not_modified(request, etag)
+        if unchanged is not None:
+            return unchanged
+
+        # the directory rarely changes, so pages come from the cache until a doctor is written
+        # (the cache key is the full url, so every filter and ?fields= combination gets its own entry)
+        def build_page():
+            doctors = rows.values(filters.filter_queryset(Doctor.objects.all()), "id")
 
-        return Response(serializer.data, status=status.HTTP_200_OK)
+            paginator = KeysetPagination(ordering=("id",))
+            page = paginator.paginate_queryset(doctors, request)
+
+            return paginator.get_paginated_response(rows.serialize(page)).data
+
+        return with_validators(Response(cache.get_doctor_list(request, build_page), status=status.HTTP_200_OK), etag)
     
     elif request.method == "POST":
         if not request.user.is_authenticated:
@@ -100,24 +247,95 @@ def doctors_list(request):
 @api_view(["GET", "PUT", "DELETE"])
 def doctor_detail(request, pk):
     try:
+        if request.method == "GET":
+            sparse = SparseFieldsSerializer(data=request.query_params, context={"rows": doctor_rows})
+            if not sparse.is_valid():
+                return Response(sparse.errors, status=status.HTTP_400_BAD_REQUEST)
+            rows = sparse.validated_data["rows"]
+
+            # only a cache miss touches the db, the validators are cached with the payload (in full,
+            # ?fields= is applied to the cached copy)
+            def build():
+                doctor = Doctor.objects.get(pk=pk)
+                return {"doctor": DoctorPublicSerializer(doctor).data, "updated_at": doctor.updated_at}
+
+            entry = cache.get_doctor_detail(pk, build)
+            etag = row_etag(pk, entry["updated_at"])
+            unchanged = not_modified(request, etag, entry["updated_at"])
+            if unchanged is not None:
+                return unchanged
+            return with_validators(Response(rows.pick(entry["doctor"]), status=status.HTTP_200_OK), etag, entry["updated_at"])
+
         doctor = Doctor.objects.get(pk=pk)
     except Doctor.DoesNotExist:
         return Response({"msg": "Doctor Not Found"}, status=status.HTTP_404_NOT_FOUND)
 
-    if request.method == "GET":
-        serializer = DoctorPublicSerializer(doctor)
-        return Response(serializer.data, status=status.HTTP_200_OK)
-    
-    elif request.method == "PUT":
+    if request.method == "PUT":
         serializer = DoctorUpdateSerializer(doctor, data=request.data, partial=True)
         if serializer.is_valid():
             serializer.save()
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            return with_validators(Response(serializer.data, status=status.HTTP_200_OK), row_etag(pk, doctor.updated_at), doctor.updated_at)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     elif request.method == "DELETE":
         doctor.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+@api_view(["GET"])
+def doctors_search(request):
+    params = SearchQuerySerializer(data=request.query_params)
+    sparse = SparseFieldsSerializer(data=request.query_params, context={"rows": doctor_rows})
+    if not all([params.is_valid(), sparse.is_valid()]):
+        return Response({**params.errors, **sparse.errors}, status=status.HTTP_400_BAD_REQUEST)
+    rows = sparse.validated_data["rows"]
+
+    doctors = search(Doctor.objects.all(), params.validated_data["q"], params.validated_data.get("limit", settings.SEARCH_LIMIT))
+    return Response({"results": rows.serialize(rows.values(doctors))}, status=status.HTTP_200_OK)
+
+
+@api_view(["GET"])
+def doctors_batch(request):
+    # ?ids=3,1,2, read through the same cache entries as the detail endpoint: one get_many, then
+    # one query for the doctors that weren't cached
+    params = BatchQuerySerializer(data=request.query_params)
+    sparse = SparseFieldsSerializer(data=request.query_params, context={"rows": doctor_rows})
+    if not all([params.is_valid(), sparse.is_valid()]):
+        return Response({**params.errors, **sparse.errors}, status=status.HTTP_400_BAD_REQUEST)
+    rows = sparse.validated_data["rows"]
+
+    def build(missing):
+        found = doctor_rows.values(Doctor.objects.filter(id__in=missing), "updated_at")
+        return {row["id"]: {"doctor": doctor_rows.to_representation(row), "updated_at": row["updated_at"]} for row in found}
+
+    ids = params.validated_data["ids"]
+    entries = cache.get_doctor_details(ids, build)
+    return Response({
+        "results": [rows.pick(entries[pk]["doctor"]) for pk in ids if pk in entries],
+        "missing": [pk for pk in ids if pk not in entries],
+    }, status=status.HTTP_200_OK)
+
+
+@api_view(["GET"])
+def doctors_availability(request):
+    params = AvailabilityQuerySerializer(data=request.query_params)
+    if not params.is_valid():
+        return Response(params.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    # read off the maintained availability rows, most free slots first
+    doctors = available_doctors(
+        params.validated_data["date"],
+        params.validated_data.get("specialization"),
+        params.validated_data.get("limit", settings.PAGE_SIZE),
+    )
+    results = [{**DoctorPublicSerializer(doctor).data, "remaining": remaining} for doctor, remaining in doctors]
+    return Response({"date": params.validated_data["date"], "results": results}, status=status.HTTP_200_OK)
+
+
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def doctor_cache_stats(request):
+    return Response(cache.doctor_cache_stats(), status=status.HTTP_200_OK)
     
 
 # ----- Mappings endpoints -----
@@ -125,10 +343,26 @@ def doctor_detail(request, pk):
 @api_view(["GET", "POST"])
 def mappings_list(request):
     if request.method == "GET":
-        mappings = PatientDoctorMapping.objects.all()
-        serializer = MappingsDetailSerializer(mappings, many=True)
-        
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        sparse = SparseFieldsSerializer(data=request.query_params, context={"rows": mapping_rows})
+        if not sparse.is_valid():
+            return Response(sparse.errors, status=status.HTTP_400_BAD_REQUEST)
+        rows = sparse.validated_data["rows"]
+
+        # versioned in the cache (see signals.py), counting the whole table would cost more than a page
+        etag = list_etag(request, cache.get_mappings_version)
+        unchanged = not_modified(request, etag)
+        if unchanged is not None:
+            return unchanged
+
+        # the patient and doctor columns come in through one join, nothing is queried per row. A
+        # relation left out of ?expand= is its id, read off the mapping without the join
+        mappings = rows.values(PatientDoctorMapping.objects.all(), "assigned_at", "id")
+
+        # newest assignments come last, id breaks ties between rows assigned at the same instant
+        paginator = KeysetPagination(ordering=("assigned_at", "id"))
+        page = paginator.paginate_queryset(mappings, request)
+
+        return with_validators(paginator.get_paginated_response(rows.serialize(page)), etag)
     
     elif request.method == "POST":
         serializer = MappingsSerializer(data=request.data)
@@ -138,34 +372,265 @@ def mappings_list(request):
         # return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         return Response({"detail":"Mapping already exists"}, status=status.HTTP_409_CONFLICT)
 
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+def mappings_bulk_create(request):
+    serializer = MappingsBulkSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    report = assign_doctors(serializer.validated_data["pairs"], settings.BULK_BATCH_SIZE)
+    if report["created"]:
+        return Response(report, status=status.HTTP_201_CREATED)
+    return Response(report, status=status.HTTP_200_OK)
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def mappings_export(request):
+    export_format = request.query_params.get("fmt", "ndjson")
+    if export_format not in exports.FORMATS:
+        return Response({"detail": f"fmt must be one of {', '.join(exports.FORMATS)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+    return exports.export_mappings(export_format)
+
 @api_view(["GET"])
 def mapping_detail(request, patient_id):
-    try:
-        patient = Patient.objects.get(pk=patient_id)
-    except Patient.DoesNotExist:
+    # ?fields= picks the fields of the doctors listed
+    sparse = SparseFieldsSerializer(data=request.query_params, context={"rows": doctor_rows})
+    if not sparse.is_valid():
+        return Response(sparse.errors, status=status.HTTP_400_BAD_REQUEST)
+    rows = sparse.validated_data["rows"]
+
+    # the patient together with the version of everything the response shows: its own row, how
+    # many doctors it has (moves on unassigning) and the newest mapping and doctor updates
+    patient = (
+        Patient.objects.filter(pk=patient_id)
+        .values("id", "firstname", "lastname", "updated_at")
+        .annotate(
+            mappings=Count("doctor_mappings"),
+            mapped=Max("doctor_mappings__updated_at"),
+            doctors_updated=Max("doctor_mappings__doctor__updated_at"),
+        )
+        .first()
+    )
+    if patient is None:
         return Response({"detail": "Patient Not Found"}, status=status.HTTP_404_NOT_FOUND)
 
-    mappings = PatientDoctorMapping.objects.filter(patient=patient)
+    etag = version_etag(request, patient["updated_at"], patient["mappings"], patient["mapped"], patient["doctors_updated"])
+    unchanged = not_modified(request, etag)
+    if unchanged is not None:
+        return unchanged
 
     if request.method == "GET":
-        # basically gettin all the docs of the patient
-        doctors = [mapping.doctor for mapping in mappings]
+        # basically gettin all the docs of the patient, in one query through the mappings
+        doctors = Doctor.objects.filter(patient_mappings__patient_id=patient_id).order_by("patient_mappings__assigned_at", "patient_mappings__id")
 
-        # Serializing the docs
-        serializer = DoctorPublicSerializer(doctors, many=True)
+        # Serializing the docs, only the columns of the fields asked for
         resp = {
-            "patient_id": f"{patient.id}",
-            "patient": f"{patient.firstname} {patient.lastname}",
-            "doctors": serializer.data
+            "patient_id": f"{patient['id']}",
+            "patient": f"{patient['firstname']} {patient['lastname']}",
+            "doctors": rows.serialize(rows.values(doctors))
         }
-        return Response(resp, status=status.HTTP_200_OK)
+        return with_validators(Response(resp, status=status.HTTP_200_OK), etag)
 
 @api_view(["DELETE"])
 def mapping_delete(request, pk, doc_id):
     try:
-        mapping = PatientDoctorMapping.objects.get(pk=pk, doctor_id=doc_id)
+        # the patient comes along for the change log entry's owner
+        mapping = PatientDoctorMapping.objects.select_related("patient").get(pk=pk, doctor_id=doc_id)
     except PatientDoctorMapping.DoesNotExist:
         return Response({"detail": "Mapping not found"}, status=status.HTTP_404_NOT_FOUND)
     
     mapping.delete()
-    return Response(status=status.HTTP_204_NO_CONTENT)
\ No newline at end of file
+    return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+# ----- Appointment endpoints -----
+
+@api_view(["GET", "POST"])
+@permission_classes([IsAuthenticated])
+def appointments_list(request):
+    if request.method == "GET":
+        # appointments of the user's own patients, soonest first
+        appointments = Appointment.objects.filter(mapping__patient__created_by_id=request.user.id).select_related("mapping")
+
+        paginator = KeysetPagination(ordering=("date", "id"))
+        page = paginator.paginate_queryset(appointments, request)
+
+        return paginator.get_paginated_response(AppointmentSerializer(page, many=True).data)
+
+    serializer = AppointmentCreateSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        mapping = PatientDoctorMapping.objects.select_related("patient", "doctor").get(
+            patient_id=serializer.validated_data["patient"],
+            doctor_id=serializer.validated_data["doctor"],
+            patient__created_by_id=request.user.id,
+        )
+    except PatientDoctorMapping.DoesNotExist:
+        return Response({"detail": "Doctor isn't assigned to this patient"}, status=status.HTTP_404_NOT_FOUND)
+
+    # the cap is enforced inside book(), a full day or a second booking of the same day is a 409
+    try:
+        appointment = book(mapping, serializer.validated_data["date"])
+    except BookingError as exc:
+        return Response({"detail": str(exc)}, status=status.HTTP_409_CONFLICT)
+    return Response(AppointmentSerializer(appointment).data, status=status.HTTP_201_CREATED)
+
+
+@api_view(["DELETE"])
+@permission_classes([IsAuthenticated])
+def appointment_detail(request, pk):
+    try:
+        appointment = Appointment.objects.get(pk=pk, mapping__patient__created_by_id=request.user.id)
+    except Appointment.DoesNotExist:
+        return Response({"detail": "Appointment not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    # the post_delete signal frees the slot
+    appointment.delete()
+    return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+# ----- Stats endpoints -----
+# all read off the counters kept by hospital.stats, never a COUNT over the mappings
+
+@api_view(["GET"])
+def stats_summary(request):
+    by_specialization = specialization_counts()
+    return Response({
+        "doctors": sum(by_specialization.values()),
+        "doctors_by_specialization": by_specialization,
+    }, status=status.HTTP_200_OK)
+
+
+@api_view(["GET"])
+def stats_doctors(request):
+    # patients per doctor, paginated like the doctors list
+    doctors = Doctor.objects.values("id", "patient_count")
+    paginator = KeysetPagination(ordering=("id",))
+    page = paginator.paginate_queryset(doctors, request)
+    return paginator.get_paginated_response([{"id": row["id"], "patients": row["patient_count"]} for row in page])
+
+
+@api_view(["GET"])
+def stats_doctor(request, pk):
+    patients = Doctor.objects.filter(pk=pk).values_list("patient_count", flat=True).first()
+    if patients is None:
+        return Response({"msg": "Doctor Not Found"}, status=status.HTTP_404_NOT_FOUND)
+    return Response({"id": pk, "patients": patients}, status=status.HTTP_200_OK)
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def stats_patients(request):
+    # doctors per patient, for the user's own patients
+    patients = Patient.objects.filter(created_by_id=request.user.id).values("id", "doctor_count")
+    paginator = KeysetPagination(ordering=("id",))
+    page = paginator.paginate_queryset(patients, request)
+    return paginator.get_paginated_response([{"id": row["id"], "doctors": row["doctor_count"]} for row in page])
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def stats_patient(request, pk):
+    doctors = Patient.objects.filter(pk=pk, created_by_id=request.user.id).values_list("doctor_count", flat=True).first()
+    if doctors is None:
+        return Response({"msg": "Patient Not Found"}, status=status.HTTP_404_NOT_FOUND)
+    return Response({"id": pk, "doctors": doctors}, status=status.HTTP_200_OK)
+
+
+# ----- Change feed -----
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def changes_feed(request):
+    # what changed in the user's patients and mappings, and in the doctors, after ?since=.
+    # A client stores the cursor of each page and passes it back, until has_more is false
+    params = ChangesQuerySerializer(data=request.query_params)
+    if not params.is_valid():
+        return Response(params.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    since = params.validated_data["since"]
+    if since == "latest":
+        # for a client about to download the lists: sync from here once it has them
+        return Response({"changes": [], "cursor": changes.head(), "has_more": False}, status=status.HTTP_200_OK)
+    if changes.is_expired(since):
+        return Response({"detail": "Cursor expired, download the lists again and sync from since=latest"}, status=status.HTTP_410_GONE)
+
+    limit = params.validated_data.get("limit", settings.CHANGES_LIMIT)
+    return Response(changes.changes_since(request.user.id, since, limit), status=status.HTTP_200_OK)
+
+
+# ----- Database endpoints -----
+
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def db_pool_stats(request):
+    # per alias, for the worker process that happens to serve this request
+    return Response(all_pool_stats(), status=status.HTTP_200_OK)
+
+
+# ----- Metrics endpoints -----
+
+@api_view(["GET"])
+@permission_classes([IsAdminUser | HasMetricsToken])
+def metrics(request):
+    # Prometheus text format, counting the requests this worker process has served
+    return HttpResponse(request_metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+# ----- Profiling endpoints -----
+
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def profiles_list(request):
+    # the profiles stored on the host that serves this request, newest first
+    return Response({"results": profiling.list_profiles()}, status=status.HTTP_200_OK)
+
+
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def profile_download(request, profile_id):
+    profile = profiling.load_profile(profile_id)
+    if profile is None:
+        return Response({"detail": "Profile not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    # ?fmt=folded gives the stacks in the collapsed format flamegraph tools read
+    if request.query_params.get("fmt") == "folded":
+        response = HttpResponse(profiling.folded(profile), content_type="text/plain; charset=utf-8")
+        response["Content-Disposition"] = f'attachment; filename="{profile_id}.folded"'
+        return response
+
+    response = HttpResponse(json.dumps(profile), content_type="application/json")
+    response["Content-Disposition"] = f'attachment; filename="{profile_id}.json"'
+    return response
+
+
+@api_view(["POST"])
+@permission_classes([IsAdminUser])
+def profile_token(request):
+    # send the token back as X-Profile on the request that should be profiled
+    return Response({
+        "header": "X-Profile",
+        "token": profiling.make_token(request.user.id),
+        "expires_in": settings.PROFILE_TOKEN_MAX_AGE,
+    }, status=status.HTTP_201_CREATED)
+
+
+@api_view(["GET", "PUT", "DELETE"])
+@permission_classes([IsAdminUser])
+def profile_sampling(request):
+    if request.method == "PUT":
+        serializer = ProfileSamplingSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        config = profiling.sampling.set(**serializer.validated_data)
+        return Response(config, status=status.HTTP_200_OK)
+
+    if request.method == "DELETE":
+        profiling.sampling.clear()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    return Response(profiling.sampling.get() or {"rate": 0}, status=status.HTTP_200_OK)